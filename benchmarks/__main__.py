@@ -0,0 +1,333 @@
+"""
+Benchmarks de la API contra una base local (SQLite o MySQL/MariaDB).
+
+    python -m backend.benchmarks generar [--productos 10000] [--ventas 5000000] [--dias 365] [--vaciar]
+    python -m backend.benchmarks correr [--requests 200] [--concurrencia 1] [--modo sync|async] [--escenarios a,b] [--salida X.json]
+    python -m backend.benchmarks comparar ANTES.json DESPUES.json
+    python -m backend.benchmarks serializacion [--filas 1000]
+    python -m backend.benchmarks reportes [--rangos 50]
+
+La base se elige con --url (o DATABASE_URL); por defecto sqlite:///bench.db.
+Los requests pasan por la app ASGI completa (middlewares incluidos) en el
+mismo proceso, sin red.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+URL_POR_DEFECTO = "sqlite:///bench.db"
+CARPETA_RESULTADOS = os.path.join(os.path.dirname(__file__), "resultados")
+
+
+def _rss_pico_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB, macOS en bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentil(ordenadas, p):
+    # Nearest-rank sobre la lista ya ordenada
+    if not ordenadas:
+        return None
+    indice = max(0, min(len(ordenadas) - 1, round(p / 100 * len(ordenadas) + 0.5) - 1))
+    return ordenadas[indice]
+
+
+# 🔹 generar
+def _generar(args):
+    from backend.config.db import conexion
+    from backend.config.migraciones import aplicar_migraciones
+    from backend.benchmarks import datos
+
+    aplicar_migraciones()
+    if args.vaciar:
+        with conexion() as conn:
+            datos.vaciar(conn)
+
+    def progreso(hechas, total):
+        print(f"\r  ventas {hechas}/{total}", end="", flush=True)
+
+    resultado = datos.generar(args.productos, args.ventas, args.dias, args.semilla, progreso)
+    print()
+    print(json.dumps(resultado, indent=2))
+
+
+# 🔹 correr
+async def _medir(cliente, escenario, cantidad, concurrencia, azar, contexto):
+    latencias = []
+    errores = {}
+    pendientes = iter(range(cantidad))
+
+    async def trabajador():
+        for _ in pendientes:
+            if escenario.preparar:
+                escenario.preparar()
+            peticion = escenario.peticion(azar, contexto)
+            inicio = time.perf_counter()
+            respuesta = await cliente.request(**peticion)
+            latencias.append(time.perf_counter() - inicio)
+            if respuesta.status_code >= 400:
+                errores[respuesta.status_code] = errores.get(respuesta.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    return latencias, errores, time.perf_counter() - inicio
+
+
+async def _correr_escenarios(args, escenarios):
+    import httpx
+    from sqlalchemy import func, select
+    from backend.main import app
+    from backend.config.db import conexion, get_engine
+    from backend.models.producto import productos
+    from backend.models.venta import ventas
+    from backend.benchmarks import datos
+
+    resultados = {}
+    async with app.router.lifespan_context(app):
+        with conexion() as conn:
+            conteos = datos.contar(conn)
+            hasta = conn.execute(select(func.max(ventas.c.fecha_venta))).scalar() or datetime.now()
+            maximo_producto = conn.execute(select(func.max(productos.c.id_producto))).scalar()
+        if not maximo_producto:
+            raise SystemExit("La base no tiene datos: correr antes `python -m backend.benchmarks generar`")
+        contexto = {"productos": maximo_producto, "hasta": hasta}
+
+        # Un error de la app cuenta como 500, no corta la corrida
+        transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+            for escenario in escenarios:
+                azar = random.Random(args.semilla)
+                await _medir(cliente, escenario, args.calentamiento, 1, azar, contexto)
+                latencias, errores, duracion = await _medir(
+                    cliente, escenario, args.requests, args.concurrencia, azar, contexto
+                )
+                ordenadas = sorted(latencias)
+                resultados[escenario.nombre] = {
+                    "requests": len(latencias),
+                    "errores": errores,
+                    "p50_ms": round(_percentil(ordenadas, 50) * 1000, 3),
+                    "p95_ms": round(_percentil(ordenadas, 95) * 1000, 3),
+                    "p99_ms": round(_percentil(ordenadas, 99) * 1000, 3),
+                    "media_ms": round(sum(ordenadas) / len(ordenadas) * 1000, 3),
+                    "rps": round(len(latencias) / duracion, 1),
+                    "rss_pico_mb": _rss_pico_mb()
+                }
+                r = resultados[escenario.nombre]
+                print(f"{escenario.nombre:32} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  "
+                      f"p99 {r['p99_ms']:9.2f} ms  {r['rps']:8.1f} req/s" + (f"  errores {errores}" if errores else ""))
+        dialecto = get_engine().dialect.name
+    return resultados, conteos, dialecto
+
+
+def _correr(args):
+    from backend.benchmarks.escenarios import seleccionar
+
+    escenarios = seleccionar(args.escenarios.split(",") if args.escenarios else None, args.solo_lectura)
+    resultados, conteos, dialecto = asyncio.run(_correr_escenarios(args, escenarios))
+
+    commit = _commit()
+    informe = {
+        "commit": commit,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "dialecto": dialecto,
+        "modo": os.getenv("DB_MODO", "sync"),
+        "tablas": conteos,
+        "parametros": {"requests": args.requests, "concurrencia": args.concurrencia,
+                       "calentamiento": args.calentamiento, "semilla": args.semilla},
+        "rss_pico_mb": _rss_pico_mb(),
+        "escenarios": resultados
+    }
+    salida = args.salida or os.path.join(
+        CARPETA_RESULTADOS, f"{datetime.now():%Y%m%dT%H%M%S}-{commit or 'sin-git'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as archivo:
+        json.dump(informe, archivo, indent=2)
+    print(f"Resultados en {salida}")
+
+
+# 🔹 comparar
+def _comparar(args):
+    with open(args.antes, encoding="utf-8") as archivo:
+        antes = json.load(archivo)
+    with open(args.despues, encoding="utf-8") as archivo:
+        despues = json.load(archivo)
+
+    def cambio(previo, actual):
+        return f"{(actual - previo) / previo * 100:+7.1f}%" if previo else "      -"
+
+    print(f"{antes.get('commit')} -> {despues.get('commit')}")
+    for nombre, actual in despues["escenarios"].items():
+        previo = antes["escenarios"].get(nombre)
+        if previo is None:
+            print(f"{nombre:32} (nuevo)")
+            continue
+        columnas = [f"{m} {previo[m]:.2f} -> {actual[m]:.2f} ({cambio(previo[m], actual[m]).strip()})"
+                    for m in ("p50_ms", "p95_ms", "rps")]
+        print(f"{nombre:32} " + "  ".join(columnas))
+
+
+# 🔹 serializacion: response_model de FastAPI vs utils/json_rapido sobre las mismas filas
+def _serializacion(args):
+    import timeit
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    from backend.config.db import conexion
+    from backend.models.producto import productos
+    from backend.models.venta import ventas
+    from backend.schemas.producto import ProductoResponse
+    from backend.schemas.venta import VentaResponse
+    from backend.utils.json_rapido import SerializadorFilas, orjson
+
+    print(f"json_rapido con {'orjson' if orjson else 'json de la stdlib'}, {args.filas} filas")
+    for tabla, modelo in ((ventas, VentaResponse), (productos, ProductoResponse)):
+        adaptador = TypeAdapter(list[modelo])
+        serializador = SerializadorFilas.para_modelo(modelo, tabla)
+        with conexion() as conn:
+            completas = conn.execute(select(tabla).limit(args.filas)).fetchall()
+            justas = conn.execute(select(*serializador.columnas).limit(args.filas)).fetchall()
+
+        def actual():
+            # Lo que hace FastAPI con response_model: validar, pasar a tipos JSON y json.dumps
+            datos = adaptador.validate_python([dict(fila._mapping) for fila in completas])
+            json.dumps(adaptador.dump_python(datos, mode="json"), ensure_ascii=False,
+                       separators=(",", ":")).encode()
+
+        def rapido():
+            serializador.json(justas)
+
+        for nombre, funcion in (("response_model", actual), ("json_rapido", rapido)):
+            segundos = min(timeit.repeat(funcion, number=args.repeticiones, repeat=3)) / args.repeticiones
+            print(f"{tabla.name:10} {nombre:15} {segundos * 1000:8.3f} ms  {len(completas) / segundos:12,.0f} filas/s")
+
+
+# 🔹 reportes: motor SQL (ventas_diarias + bordes) vs motor en memoria sobre los mismos rangos
+def _reportes(args):
+    import math
+    from sqlalchemy import func, select
+    from backend.config.db import conexion
+    from backend.config.migraciones import aplicar_migraciones
+    from backend.models.venta import ventas
+    from backend.routes.reportes import _calcular_reporte, _calcular_reporte_memoria
+    from backend.utils.reportes_memoria import reportes_memoria
+
+    if not reportes_memoria.disponible:
+        raise SystemExit("El motor en memoria necesita numpy")
+    aplicar_migraciones()
+    with conexion() as conn:
+        total = conn.execute(select(func.count()).select_from(ventas)).scalar()
+        hasta = conn.execute(select(func.max(ventas.c.fecha_venta))).scalar()
+    if not total:
+        raise SystemExit("La base no tiene ventas: correr antes `python -m backend.benchmarks generar`")
+
+    reportes_memoria.cargar()
+    estado = reportes_memoria.estadisticas()
+    print(f"{total} ventas; carga en memoria {estado['segundos_ultima_carga']:.2f} s, {estado['mb']} MB")
+
+    def iguales(a, b):
+        if isinstance(a, dict):
+            return a.keys() == b.keys() and all(iguales(a[k], b[k]) for k in a)
+        if isinstance(a, list):
+            return len(a) == len(b) and all(iguales(x, y) for x, y in zip(a, b))
+        if isinstance(a, float):
+            return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+        return a == b
+
+    azar = random.Random(args.semilla)
+    for periodo, dias in (("dia", 31), ("semana", 90), ("mes", 365), ("anio", 365 * 3)):
+        tiempos = {"sql": [], "memoria": []}
+        distintos = 0
+        for _ in range(args.rangos):
+            # Como los escenarios: rangos que no empiezan a medianoche
+            fin = hasta - timedelta(days=azar.randint(0, 30), minutes=azar.randint(0, 600))
+            inicio = fin - timedelta(days=dias)
+            inicio_sql = time.perf_counter()
+            with conexion() as conn:
+                por_sql = _calcular_reporte(conn, inicio, fin, periodo)
+            tiempos["sql"].append(time.perf_counter() - inicio_sql)
+            inicio_memoria = time.perf_counter()
+            en_memoria = _calcular_reporte_memoria(inicio, fin, periodo)
+            tiempos["memoria"].append(time.perf_counter() - inicio_memoria)
+            distintos += not iguales(por_sql, en_memoria)
+
+        p50 = {motor: _percentil(sorted(t), 50) * 1000 for motor, t in tiempos.items()}
+        print(f"{periodo:7} {dias:5} días  sql {p50['sql']:9.2f} ms  memoria {p50['memoria']:8.2f} ms  "
+              f"x{p50['sql'] / p50['memoria']:6.1f}" + (f"  DISTINTOS {distintos}/{args.rangos}" if distintos else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="backend.benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    base = argparse.ArgumentParser(add_help=False)
+    base.add_argument("--url", help=f"Base de datos (por defecto DATABASE_URL o {URL_POR_DEFECTO})")
+
+    generar = comandos.add_parser("generar", parents=[base], help="Crear el dataset sintético")
+    generar.add_argument("--productos", type=int, default=10000)
+    generar.add_argument("--ventas", type=int, default=5000000)
+    generar.add_argument("--dias", type=int, default=365, help="Días de historia de ventas (hasta hoy)")
+    generar.add_argument("--semilla", type=int, default=42)
+    generar.add_argument("--vaciar", action="store_true", help="Borrar los datos existentes antes de generar")
+    generar.set_defaults(func=_generar)
+
+    correr = comandos.add_parser("correr", parents=[base], help="Medir los escenarios y guardar el JSON de resultados")
+    correr.add_argument("--requests", type=int, default=200, help="Requests medidos por escenario")
+    correr.add_argument("--concurrencia", type=int, default=1)
+    correr.add_argument("--calentamiento", type=int, default=20, help="Requests previos sin medir")
+    correr.add_argument("--escenarios", help="Lista separada por comas (por defecto todos)")
+    correr.add_argument("--solo-lectura", action="store_true", help="Saltar los escenarios que escriben")
+    correr.add_argument("--semilla", type=int, default=42)
+    correr.add_argument("--modo", choices=["sync", "async"], help="DB_MODO de la app (por defecto el del entorno)")
+    correr.add_argument("--salida", help="Archivo JSON (por defecto benchmarks/resultados/<fecha>-<commit>.json)")
+    correr.set_defaults(func=_correr)
+
+    comparar = comandos.add_parser("comparar", help="Comparar dos resultados")
+    comparar.add_argument("antes")
+    comparar.add_argument("despues")
+    comparar.set_defaults(func=_comparar)
+
+    serializacion = comandos.add_parser("serializacion", parents=[base],
+                                        help="Comparar la serialización de listados (response_model vs json_rapido)")
+    serializacion.add_argument("--filas", type=int, default=1000)
+    serializacion.add_argument("--repeticiones", type=int, default=50)
+    serializacion.set_defaults(func=_serializacion)
+
+    reportes = comandos.add_parser("reportes", parents=[base],
+                                   help="Comparar los motores de /reportes/rango (sql vs memoria)")
+    reportes.add_argument("--rangos", type=int, default=50, help="Rangos medidos por periodo")
+    reportes.add_argument("--semilla", type=int, default=42)
+    reportes.set_defaults(func=_reportes)
+
+    args = parser.parse_args(argv)
+    # Antes de importar la app: el engine y los módulos leen el entorno al cargarse
+    os.environ["DATABASE_URL"] = getattr(args, "url", None) or os.getenv("DATABASE_URL") or URL_POR_DEFECTO
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if getattr(args, "modo", None):
+        os.environ["DB_MODO"] = args.modo
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compara un checkout de N líneas hecho con POST /ventas/lote contra
+N llamadas secuenciales a POST /ventas/ sobre una API en ejecución.
+
+Uso:
+    python benchmarks/bench_ventas_lote.py --url http://localhost:8000 --productos 1,2,3 --lineas 20
+
+⚠️ Crea ventas reales: usar contra una base de pruebas con stock suficiente.
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.request
+
+
+def _post(url, cuerpo):
+    datos = json.dumps(cuerpo).encode()
+    peticion = urllib.request.Request(url, data=datos, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(peticion) as respuesta:
+        respuesta.read()
+
+
+def _carrito(productos, lineas):
+    return [{"id_producto": productos[i % len(productos)], "cantidad": 1} for i in range(lineas)]
+
+
+def medir_secuencial(base, carrito):
+    inicio = time.perf_counter()
+    for linea in carrito:
+        _post(f"{base}/ventas/", linea)
+    return time.perf_counter() - inicio
+
+
+def medir_lote(base, carrito):
+    inicio = time.perf_counter()
+    _post(f"{base}/ventas/lote", carrito)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--productos", default="1", help="IDs de producto separados por coma")
+    parser.add_argument("--lineas", type=int, default=20)
+    parser.add_argument("--repeticiones", type=int, default=10)
+    args = parser.parse_args()
+
+    base = args.url.rstrip("/")
+    carrito = _carrito([int(p) for p in args.productos.split(",")], args.lineas)
+
+    secuencial = [medir_secuencial(base, carrito) for _ in range(args.repeticiones)]
+    lote = [medir_lote(base, carrito) for _ in range(args.repeticiones)]
+
+    for nombre, tiempos in (("secuencial", secuencial), ("lote", lote)):
+        print(f"{nombre:>10}: mediana {statistics.median(tiempos) * 1000:.1f} ms "
+              f"(min {min(tiempos) * 1000:.1f} ms, max {max(tiempos) * 1000:.1f} ms)")
+    print(f"aceleración: x{statistics.median(secuencial) / statistics.median(lote):.1f}")
+
+
+if __name__ == "__main__":
+    main()
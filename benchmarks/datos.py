@@ -0,0 +1,121 @@
+"""
+Dataset sintético para los benchmarks: productos, ventas y sus historiales,
+más el resumen ventas_diarias. Reproducible con la misma semilla.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from backend.config.db import conexion
+from backend.models.cambio import cambios
+from backend.models.historial_productos import historial_productos
+from backend.models.historial_ventas import historial_ventas
+from backend.models.imagen import imagenes
+from backend.models.producto import productos
+from backend.models.stock_fragmento import stock_fragmentos
+from backend.models.venta import ventas
+from backend.models.venta_diaria import ventas_diarias
+from backend.utils.ventas_diarias import reconstruir_todo
+
+LOTE = 10000
+STOCK = 10 ** 9  # los escenarios de venta nunca se quedan sin stock
+
+# Orden de borrado (las ventas referencian productos)
+_TABLAS = (ventas_diarias, historial_ventas, ventas, historial_productos, stock_fragmentos, productos, imagenes, cambios)
+
+
+def _lotes(total, tamanio=LOTE):
+    inicio = 0
+    while inicio < total:
+        yield inicio, min(tamanio, total - inicio)
+        inicio += tamanio
+
+
+def vaciar(conn):
+    for tabla in _TABLAS:
+        conn.execute(delete(tabla))
+    conn.commit()
+
+
+def contar(conn):
+    return {tabla.name: conn.execute(select(func.count()).select_from(tabla)).scalar() for tabla in _TABLAS}
+
+
+def _productos(conn, total, azar, desde):
+    precios = []  # (precio, costo) por producto
+    for inicio, cantidad in _lotes(total):
+        filas, historial = [], []
+        for i in range(inicio, inicio + cantidad):
+            costo = round(azar.uniform(1, 100), 2)
+            precio = round(costo * azar.uniform(1.1, 1.8), 2)
+            fila = {
+                "id_producto": i + 1,
+                "nombre": f"Producto {i + 1:07d}",
+                "costo": costo,
+                "precio_venta": precio,
+                "stock": STOCK,
+                "activo": True,
+                "inversion_acumulada": 0,
+                "fecha_registro": desde
+            }
+            filas.append(fila)
+            historial.append({**{k: v for k, v in fila.items() if k != "id_producto"},
+                              "id_producto": fila["id_producto"], "accion": "creacion"})
+            precios.append((precio, costo))
+        conn.execute(insert(productos), filas)
+        conn.execute(insert(historial_productos), historial)
+        conn.commit()
+    return precios
+
+
+def _ventas(conn, total, azar, precios, desde, hasta, progreso):
+    # Fechas crecientes (como en producción: el id y la fecha avanzan juntos) sin guardarlas todas
+    paso = (hasta - desde).total_seconds() / max(total, 1)
+    instante = 0.0
+    for inicio, cantidad in _lotes(total):
+        filas = []
+        for i in range(inicio, inicio + cantidad):
+            instante += azar.expovariate(1 / paso) if paso else 0
+            # Pocos productos venden mucho (distribución sesgada, como un catálogo real)
+            id_producto = min(int(azar.paretovariate(1.2)), len(precios))
+            id_producto = azar.randint(1, len(precios)) if id_producto == 1 else id_producto
+            unidades = azar.randint(1, 5)
+            precio, costo = precios[id_producto - 1]
+            filas.append({
+                "id_venta": i + 1,
+                "id_producto": id_producto,
+                "cantidad": unidades,
+                "precio_unitario": precio,
+                "precio_total": round(precio * unidades, 2),
+                "fecha_venta": min(desde + timedelta(seconds=instante), hasta),
+                "costo_unitario": costo
+            })
+        conn.execute(insert(ventas), filas)
+        conn.execute(insert(historial_ventas), filas)
+        conn.commit()
+        progreso(inicio + cantidad, total)
+
+
+def generar(productos_total, ventas_total, dias=365, semilla=42, progreso=None):
+    """
+    Llena una base vacía (usar `vaciar` antes si no lo está). Las ventas se
+    reparten en los `dias` previos a hoy. Devuelve los conteos y los segundos usados.
+    """
+    progreso = progreso or (lambda hechas, total: None)
+    azar = random.Random(semilla)
+    hasta = datetime.now().replace(microsecond=0)
+    desde = hasta - timedelta(days=dias)
+    inicio = time.perf_counter()
+
+    with conexion() as conn:
+        if conn.execute(select(func.count()).select_from(productos)).scalar():
+            raise RuntimeError("La base ya tiene productos: usar --vaciar para regenerar el dataset")
+        precios = _productos(conn, productos_total, azar, desde)
+        _ventas(conn, ventas_total, azar, precios, desde, hasta, progreso)
+        reconstruir_todo(conn, desde.date(), hasta.date())
+        conteos = contar(conn)
+
+    return {"tablas": conteos, "desde": desde.isoformat(), "hasta": hasta.isoformat(),
+            "semilla": semilla, "segundos": round(time.perf_counter() - inicio, 1)}
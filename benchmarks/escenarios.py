@@ -0,0 +1,77 @@
+"""
+Escenarios del benchmark: cada uno arma un request contra la app ASGI en
+proceso. `preparar` (opcional) corre antes de cada request y no se mide.
+"""
+from datetime import timedelta
+
+from backend.utils.cache_reportes import cache_reportes
+
+
+class Escenario:
+    def __init__(self, nombre, peticion, preparar=None, escritura=False):
+        self.nombre = nombre
+        self.peticion = peticion    # (azar, contexto) -> dict con method/url/params/json/data
+        self.preparar = preparar
+        self.escritura = escritura  # se saltan con --solo-lectura
+
+
+def _producto(azar, contexto):
+    return azar.randint(1, contexto["productos"])
+
+
+def _rango(azar, contexto, dias):
+    # Rango que no empieza a medianoche: combina ventas_diarias con los bordes parciales de ventas
+    hasta = contexto["hasta"] - timedelta(days=azar.randint(0, 30), minutes=azar.randint(0, 600))
+    return {"desde": (hasta - timedelta(days=dias)).isoformat(), "hasta": hasta.isoformat()}
+
+
+def _reporte(periodo, dias, motor="sql"):
+    def peticion(azar, contexto):
+        return {"method": "GET", "url": "/reportes/rango",
+                "params": {**_rango(azar, contexto, dias), "periodo": periodo, "motor": motor}}
+    return peticion
+
+
+ESCENARIOS = [
+    Escenario("create_venta", lambda azar, ctx: {
+        "method": "POST", "url": "/ventas/",
+        "json": {"id_producto": _producto(azar, ctx), "cantidad": azar.randint(1, 3)}
+    }, escritura=True),
+    # Todas las ventas al mismo producto (el 1): la fila de stock más disputada; ver stock fragmentado
+    Escenario("create_venta_caliente", lambda azar, ctx: {
+        "method": "POST", "url": "/ventas/", "json": {"id_producto": 1, "cantidad": 1}
+    }, escritura=True),
+    Escenario("listar_productos", lambda azar, ctx: {"method": "GET", "url": "/productos"}),
+    Escenario("listar_ventas", lambda azar, ctx: {
+        "method": "GET", "url": "/ventas/", "params": {"direccion": "desc", "limite": 100}
+    }),
+    Escenario("listar_ventas_producto", lambda azar, ctx: {
+        "method": "GET", "url": "/ventas/",
+        "params": {"id_producto": _producto(azar, ctx), "direccion": "desc", "limite": 100}
+    }),
+    # Reportes sin caché: se vacía antes de cada request (lo que cuesta un rango nuevo)
+    *[Escenario(f"reportes_por_rango_{periodo}", _reporte(periodo, dias), preparar=cache_reportes.limpiar)
+      for periodo, dias in (("dia", 31), ("semana", 90), ("mes", 365), ("anio", 365))],
+    # Lo mismo con el motor en memoria (la carga inicial cae en el calentamiento)
+    *[Escenario(f"reportes_por_rango_{periodo}_memoria", _reporte(periodo, dias, "memoria"),
+                preparar=cache_reportes.limpiar)
+      for periodo, dias in (("dia", 31), ("semana", 90), ("mes", 365), ("anio", 365))],
+    Escenario("create_producto", lambda azar, ctx: {
+        "method": "POST", "url": "/productos",
+        "data": {"nombre": f"Bench {azar.getrandbits(40):x}", "costo": "10.5", "precio_venta": "15", "stock": "100"}
+    }, escritura=True),
+    Escenario("actualizar_producto", lambda azar, ctx: {
+        "method": "PUT", "url": f"/productos/{_producto(azar, ctx)}",
+        "data": {"precio_venta": f"{azar.uniform(10, 200):.2f}"}
+    }, escritura=True),
+]
+
+
+def seleccionar(nombres=None, solo_lectura=False):
+    elegidos = [e for e in ESCENARIOS if not (solo_lectura and e.escritura)]
+    if nombres:
+        desconocidos = set(nombres) - {e.nombre for e in ESCENARIOS}
+        if desconocidos:
+            raise ValueError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        elegidos = [e for e in elegidos if e.nombre in nombres]
+    return elegidos
@@ -0,0 +1,162 @@
+"""
+Comandos de mantenimiento.
+
+    python -m backend.cli migrar
+    python -m backend.cli ventas-diarias [--desde AAAA-MM-DD] [--hasta AAAA-MM-DD]
+    python -m backend.cli imagenes-huerfanas [--horas H] [--borrar]
+    python -m backend.cli stock-rebalancear
+    python -m backend.cli costos-ventas
+    python -m backend.cli servir [--workers N] [--preload] [--host H] [--port P] [--reload]
+"""
+import argparse
+import os
+from datetime import date
+
+from backend.config.db import conexion
+
+
+def _migrar(args):
+    from backend.config.migraciones import aplicar_migraciones, VERSION_ACTUAL
+
+    aplicadas = aplicar_migraciones()
+    if aplicadas:
+        print(f"Migraciones aplicadas: {aplicadas}")
+    else:
+        print(f"El esquema ya está en la versión {VERSION_ACTUAL}")
+
+
+def _ventas_diarias(args):
+    from backend.utils.ventas_diarias import reconstruir_todo
+
+    with conexion() as conn:
+        dias = reconstruir_todo(conn, args.desde, args.hasta)
+    print(f"Resumen ventas_diarias reconstruido: {dias} días")
+
+
+def _imagenes_huerfanas(args):
+    from datetime import timedelta
+    from backend.utils import deduplicacion
+    from backend.utils.almacenamiento import crear_almacenamiento
+
+    almacenamiento = crear_almacenamiento()
+    with conexion() as conn:
+        filas = deduplicacion.huerfanas(conn, timedelta(hours=args.horas))
+        borradas = 0
+        for fila in filas:
+            print(f"{fila.huella}  {fila.url}")
+            if not args.borrar or not deduplicacion.eliminar(conn, fila.huella):
+                continue
+            conn.commit()
+            # Primero la fila: si falla el borrado remoto queda un archivo suelto, nunca un producto sin imagen
+            urls = set((fila.variantes or {}).values()) | {fila.url}
+            if not all(almacenamiento.eliminar(url) for url in urls):
+                print("  (el almacenamiento no permitió borrar los archivos)")
+            borradas += 1
+    print(f"Huérfanas: {len(filas)}, borradas: {borradas}")
+
+
+def _stock_rebalancear(args):
+    from backend.utils.stock_fragmentado import rebalancear_todos
+
+    rebalanceados = rebalancear_todos()
+    print(f"Productos rebalanceados: {rebalanceados or 'ninguno'}")
+
+
+def _costos_ventas(args):
+    from backend.models.venta import ventas
+    from backend.models.historial_ventas import historial_ventas
+    from backend.utils.costo_ventas import completar_costos
+
+    from backend.utils.ventas_diarias import reconstruir_todo
+
+    with conexion() as conn:
+        for tabla in (ventas, historial_ventas):
+            completadas = completar_costos(conn, tabla, args.lote)
+            print(f"{tabla.name}: {completadas} filas con costo_unitario completado")
+            # El resumen sumó esas ventas con costo 0: se recalcula con el costo nuevo
+            if tabla is ventas and completadas:
+                print(f"ventas_diarias: {reconstruir_todo(conn)} días reconstruidos")
+
+
+def _servir_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+    from backend.config.db import olvidar_engines
+
+    class Aplicacion(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", args.preload)
+            # Conexiones abiertas en el master no se comparten con los hijos (ni se cierran desde ellos)
+            self.cfg.set("post_fork", lambda server, worker: olvidar_engines())
+
+        def load(self):
+            from backend.main import app
+            return app
+
+    Aplicacion().run()
+
+
+def _servir(args):
+    import uvicorn
+
+    if args.workers > 1:
+        # Cada worker tiene sus propias cachés: se sincronizan por la tabla `cambios`
+        os.environ["COHERENCIA_ACTIVA"] = "1"
+
+    if args.workers > 1 and not args.reload:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            if args.preload:
+                print("gunicorn no está instalado: se ignora --preload")
+        else:
+            _servir_gunicorn(args)
+            return
+
+    uvicorn.run("backend.main:app", host=args.host, port=args.port,
+                workers=None if args.reload else args.workers, reload=args.reload)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="backend.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    migrar = comandos.add_parser("migrar", help="Crear / actualizar el esquema de la base de datos")
+    migrar.set_defaults(func=_migrar)
+
+    resumen = comandos.add_parser("ventas-diarias", help="Reconstruir / rellenar el resumen diario de ventas")
+    resumen.add_argument("--desde", type=date.fromisoformat, help="Primer día (por defecto, la primera venta)")
+    resumen.add_argument("--hasta", type=date.fromisoformat, help="Último día (por defecto, la última venta)")
+    resumen.set_defaults(func=_ventas_diarias)
+
+    huerfanas = comandos.add_parser("imagenes-huerfanas", help="Listar / borrar imágenes que ningún producto usa")
+    huerfanas.add_argument("--horas", type=float, default=1, help="Antigüedad mínima (por defecto 1 hora)")
+    huerfanas.add_argument("--borrar", action="store_true", help="Borrarlas del almacenamiento y de la tabla")
+    huerfanas.set_defaults(func=_imagenes_huerfanas)
+
+    rebalancear = comandos.add_parser("stock-rebalancear", help="Emparejar los fragmentos de stock desparejos")
+    rebalancear.set_defaults(func=_stock_rebalancear)
+
+    costos = comandos.add_parser("costos-ventas", help="Completar costo_unitario de ventas que no lo tienen")
+    costos.add_argument("--lote", type=int, default=10000, help="Filas por transacción")
+    costos.set_defaults(func=_costos_ventas)
+
+    servir = comandos.add_parser("servir", help="Levantar la API (uno o varios workers)")
+    servir.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="Procesos worker (por defecto WEB_CONCURRENCY o 1)")
+    servir.add_argument("--preload", action="store_true",
+                        help="Importar la app en el master antes de crear los workers (requiere gunicorn)")
+    servir.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    servir.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    servir.add_argument("--reload", action="store_true", help="Recarga automática (desarrollo, un solo proceso)")
+    servir.set_defaults(func=_servir)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# Compatibilidad con el antiguo config.py (conexión pymysql cruda)
+from backend.config.db import get_connection  # noqa: F401
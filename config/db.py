@@ -1,14 +1,301 @@
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.engine import URL
-
-DATABASE_URL = URL.create(
-    drivername="mysql+pymysql",
-    username="root",
-    password="",
-    host="localhost",
-    database="inventario_db"
-)
-
-engine = create_engine(DATABASE_URL)
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from backend.utils.metricas import instrumentar_engine, observar_checkout
+from backend.utils.perfil_sql import perfil_sql
+
+logger = logging.getLogger(__name__)
+
 meta = MetaData()
-conn = engine.connect()
+
+# 🔹 Registro único de engines (uno por nombre, creados bajo demanda)
+_engines = {}
+_engines_async = {}
+_engines_lock = threading.Lock()
+
+
+def _entero(nombre, defecto):
+    return int(os.getenv(nombre, defecto))
+
+
+def _booleano(nombre, defecto):
+    return os.getenv(nombre, defecto).strip().lower() in ("1", "true", "si", "yes")
+
+
+def database_url():
+    """
+    URL de conexión: DATABASE_URL (producción) o variables DB_* (desarrollo local).
+    """
+    valor = os.getenv("DATABASE_URL")
+    if valor:
+        url = make_url(valor)
+        # 🌐 Render/Railway entregan "mysql://..."; forzamos el driver pymysql
+        if url.drivername == "mysql":
+            url = url.set(drivername="mysql+pymysql")
+        return url
+
+    # 🏠 Desarrollo local - fallback
+    return URL.create(
+        drivername="mysql+pymysql",
+        username=os.getenv("DB_USER", "root"),
+        password=os.getenv("DB_PASSWORD", ""),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=_entero("DB_PORT", 3306),
+        database=os.getenv("DB_NAME", "inventario_db"),
+        query={"charset": "utf8mb4"},
+    )
+
+
+def modo_async():
+    """DB_MODO=async: las rutas calientes usan el AsyncEngine (ver get_conn_async)."""
+    return os.getenv("DB_MODO", "sync").strip().lower() == "async"
+
+
+# Driver async equivalente a cada driver sync (DB_DRIVER_ASYNC lo fuerza, p. ej. mysql+asyncmy)
+_DRIVERS_ASYNC = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def database_url_async():
+    url = database_url()
+    drivername = os.getenv("DB_DRIVER_ASYNC") or _DRIVERS_ASYNC.get(url.get_backend_name())
+    if drivername is None:
+        raise ValueError(f"No hay driver async para {url.drivername}")
+    return url.set(drivername=drivername)
+
+
+def _opciones_pool(url):
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # SQLite en memoria no admite QueuePool; usamos el pool por defecto
+        return {}
+    return {
+        "pool_size": _entero("DB_POOL_SIZE", 5),
+        "max_overflow": _entero("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": _entero("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": _entero("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": _booleano("DB_POOL_PRE_PING", "1"),
+    }
+
+
+def _configurar_timeout(engine, timeout_ms):
+    # max_execution_time solo existe en MySQL (aplica a SELECT)
+    @event.listens_for(engine, "connect")
+    def _fijar_timeout(dbapi_conn, _registro):
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute(f"SET SESSION max_execution_time = {int(timeout_ms)}")
+        finally:
+            cursor.close()
+
+
+def crear_engine(url=None):
+    url = make_url(url) if url is not None else database_url()
+    engine = create_engine(url, **_opciones_pool(url))
+
+    timeout_ms = _entero("DB_STATEMENT_TIMEOUT_MS", 0)
+    if timeout_ms > 0 and engine.dialect.name == "mysql":
+        _configurar_timeout(engine, timeout_ms)
+
+    # Número de consultas y tiempo de BD por request (GET /metrics)
+    instrumentar_engine(engine)
+    # Perfil de SQL por request y log de consultas lentas (utils/perfil_sql.py)
+    perfil_sql.instrumentar_engine(engine)
+    return engine
+
+
+def crear_engine_async(url=None):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    url = make_url(url) if url is not None else database_url_async()
+    opciones = _opciones_pool(url)
+    if opciones and url.get_backend_name() == "sqlite":
+        # aiosqlite usa NullPool por defecto (un hilo nuevo por conexión); el stand-in reutiliza conexiones
+        opciones["poolclass"] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **opciones)
+
+    # Eventos y hooks se registran sobre el engine sync que envuelve
+    timeout_ms = _entero("DB_STATEMENT_TIMEOUT_MS", 0)
+    if timeout_ms > 0 and engine.dialect.name == "mysql":
+        _configurar_timeout(engine.sync_engine, timeout_ms)
+    instrumentar_engine(engine.sync_engine)
+    perfil_sql.instrumentar_engine(engine.sync_engine)
+    return engine
+
+
+def get_engine(nombre="default"):
+    """
+    Devuelve el engine registrado con ese nombre, creándolo la primera vez.
+    Crear el engine no abre ninguna conexión.
+    """
+    engine = _engines.get(nombre)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(nombre)
+            if engine is None:
+                engine = crear_engine()
+                _engines[nombre] = engine
+    return engine
+
+
+def get_engine_async(nombre="default"):
+    """Como get_engine, para el AsyncEngine (DB_MODO=async)."""
+    engine = _engines_async.get(nombre)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines_async.get(nombre)
+            if engine is None:
+                engine = crear_engine_async()
+                _engines_async[nombre] = engine
+    return engine
+
+
+def registrar_engine(nombre, engine):
+    with _engines_lock:
+        anterior = _engines.get(nombre)
+        _engines[nombre] = engine
+    if anterior is not None and anterior is not engine:
+        anterior.dispose()
+
+
+def cerrar_engines():
+    with _engines_lock:
+        engines = list(_engines.values())
+        engines_async = list(_engines_async.values())
+        _engines.clear()
+        _engines_async.clear()
+    for engine in engines:
+        engine.dispose()
+    # Sin event loop no se pueden cerrar: se olvidan
+    for engine in engines_async:
+        engine.sync_engine.dispose(close=False)
+
+
+def olvidar_engines():
+    """
+    Tras un fork (post_fork de gunicorn): el hijo descarta los pools heredados sin cerrar
+    sus conexiones, que siguen siendo del padre; cada worker abre las suyas.
+    """
+    with _engines_lock:
+        engines = list(_engines.values()) + [e.sync_engine for e in _engines_async.values()]
+        _engines.clear()
+        _engines_async.clear()
+    for engine in engines:
+        engine.dispose(close=False)
+
+
+async def cerrar_engines_async():
+    with _engines_lock:
+        engines = list(_engines_async.values())
+        _engines_async.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+# 🔹 Conexiones con reintento y backoff exponencial
+def conectar(engine=None):
+    engine = engine or get_engine()
+    reintentos = _entero("DB_CONNECT_RETRIES", 3)
+    backoff = float(os.getenv("DB_CONNECT_BACKOFF", "0.2"))
+
+    intento = 0
+    while True:
+        try:
+            inicio = time.perf_counter()
+            conn = engine.connect()
+            observar_checkout(time.perf_counter() - inicio)
+            return conn
+        except (OperationalError, InterfaceError) as e:
+            if intento >= reintentos:
+                raise
+            espera = backoff * (2 ** intento)
+            logger.warning("Conexión a la BD fallida (%s), reintentando en %.2fs", e.orig, espera)
+            time.sleep(espera)
+            intento += 1
+
+
+@contextmanager
+def conexion(engine=None):
+    conn = conectar(engine)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_conn():
+    """
+    Dependencia de FastAPI: una conexión propia del pool por request.
+    Confirma lo pendiente al terminar bien y revierte si hubo una excepción.
+    """
+    with conexion() as conn:
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction():
+                conn.rollback()
+            raise
+        if conn.in_transaction():
+            conn.commit()
+
+
+# 🔹 Lo mismo sobre el AsyncEngine
+async def conectar_async(engine=None):
+    engine = engine or get_engine_async()
+    reintentos = _entero("DB_CONNECT_RETRIES", 3)
+    backoff = float(os.getenv("DB_CONNECT_BACKOFF", "0.2"))
+
+    intento = 0
+    while True:
+        try:
+            inicio = time.perf_counter()
+            conn = await engine.connect()
+            observar_checkout(time.perf_counter() - inicio)
+            return conn
+        except (OperationalError, InterfaceError) as e:
+            if intento >= reintentos:
+                raise
+            espera = backoff * (2 ** intento)
+            logger.warning("Conexión a la BD fallida (%s), reintentando en %.2fs", e.orig, espera)
+            await asyncio.sleep(espera)
+            intento += 1
+
+
+@asynccontextmanager
+async def conexion_async(engine=None):
+    conn = await conectar_async(engine)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+
+async def get_conn_async():
+    """
+    Dependencia de FastAPI para rutas `async def` (DB_MODO=async). El código
+    escrito para Connection se reutiliza con `await conn.run_sync(funcion, ...)`.
+    """
+    async with conexion_async() as conn:
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction():
+                await conn.rollback()
+            raise
+        if conn.in_transaction():
+            await conn.commit()
+
+
+def get_connection():
+    """
+    Conexión DBAPI (pymysql) cruda, tomada del mismo pool.
+    Llamar a close() la devuelve al pool.
+    """
+    return get_engine().raw_connection()
@@ -0,0 +1,192 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, func, text, inspect
+from sqlalchemy.exc import DBAPIError
+
+from backend.config.db import conexion
+
+logger = logging.getLogger(__name__)
+
+# Tabla de control propia (no forma parte de meta)
+_meta_version = MetaData()
+schema_version = Table(
+    "schema_version", _meta_version,
+    Column("version", Integer, primary_key=True),
+    Column("descripcion", String(255), nullable=False),
+    Column("aplicada", DateTime, nullable=False)
+)
+
+
+def _agregar_columnas(conn, tabla, *nombres):
+    # Las instalaciones nuevas ya crean la tabla con la columna (migración 1 usa el modelo actual)
+    existentes = {columna["name"] for columna in inspect(conn).get_columns(tabla.name)}
+    for nombre in nombres:
+        if nombre in existentes:
+            continue
+        columna = tabla.c[nombre]
+        tipo = columna.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {tabla.name} ADD COLUMN {nombre} {tipo}"
+                          f"{'' if columna.nullable else ' NOT NULL'}"))
+
+
+# 🔹 Migraciones (en orden; nunca modificar una ya publicada, agregar una nueva)
+def _tablas_base(conn):
+    from backend.models.producto import productos
+    from backend.models.venta import ventas
+    from backend.models.historial_productos import historial_productos
+    from backend.models.historial_ventas import historial_ventas
+
+    for tabla in (productos, ventas, historial_productos, historial_ventas):
+        tabla.create(conn, checkfirst=True)
+
+
+def _indices_listados(conn):
+    from backend.models.producto import productos
+    from backend.models.venta import ventas
+    from backend.models.historial_productos import historial_productos
+    from backend.models.historial_ventas import historial_ventas
+
+    for tabla in (productos, ventas, historial_productos, historial_ventas):
+        for indice in tabla.indexes:
+            indice.create(conn, checkfirst=True)
+
+
+def _resumen_ventas_diarias(conn):
+    from backend.models.venta_diaria import ventas_diarias
+
+    # Se llena en la migración 9, cuando ventas ya tiene costo_unitario
+    ventas_diarias.create(conn, checkfirst=True)
+
+
+def _registro_cambios(conn):
+    from backend.models.cambio import cambios
+
+    cambios.create(conn, checkfirst=True)
+
+
+def _estado_imagenes(conn):
+    from backend.models.producto import productos
+
+    _agregar_columnas(conn, productos, "imagen_estado", "imagen_pendiente")
+
+
+def _variantes_imagenes(conn):
+    from backend.models.producto import productos
+
+    _agregar_columnas(conn, productos, "imagen_variantes")
+
+
+def _imagenes_por_contenido(conn):
+    from backend.models.producto import productos
+    from backend.models.imagen import imagenes
+
+    imagenes.create(conn, checkfirst=True)
+    _agregar_columnas(conn, productos, "imagen_hash")
+
+
+def _stock_fragmentado(conn):
+    from backend.models.producto import productos
+    from backend.models.stock_fragmento import stock_fragmentos
+    from backend.models.venta_diaria import ventas_diarias
+
+    stock_fragmentos.create(conn, checkfirst=True)
+    _agregar_columnas(conn, productos, "fragmentos_stock")
+    # ventas_diarias suma `fragmento` a la clave primaria: es un resumen, se recrea (y se llena en la 9)
+    if "fragmento" not in {columna["name"] for columna in inspect(conn).get_columns(ventas_diarias.name)}:
+        ventas_diarias.drop(conn)
+        ventas_diarias.create(conn)
+
+
+def _costo_en_ventas(conn):
+    from backend.models.venta import ventas
+    from backend.models.historial_ventas import historial_ventas
+    from backend.utils.costo_ventas import completar_costos
+    from backend.utils.ventas_diarias import reconstruir_todo
+
+    _agregar_columnas(conn, ventas, "costo_unitario")
+    _agregar_columnas(conn, historial_ventas, "costo_unitario")
+    conn.commit()
+    completar_costos(conn, ventas)
+    completar_costos(conn, historial_ventas)
+    for indice in ventas.indexes:
+        indice.create(conn, checkfirst=True)
+    # El resumen se (re)calcula con el costo de cada venta, no con el costo actual del producto
+    reconstruir_todo(conn)
+
+
+MIGRACIONES = [
+    (1, "tablas base", _tablas_base),
+    (2, "índices para listados paginados", _indices_listados),
+    (3, "resumen ventas_diarias", _resumen_ventas_diarias),
+    (4, "registro de cambios entre workers", _registro_cambios),
+    (5, "estado de subida de imágenes", _estado_imagenes),
+    (6, "variantes de imágenes", _variantes_imagenes),
+    (7, "imágenes deduplicadas por contenido", _imagenes_por_contenido),
+    (8, "stock fragmentado por producto", _stock_fragmentado),
+    (9, "costo unitario en ventas", _costo_en_ventas),
+]
+
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+
+def version_aplicada(conn):
+    try:
+        return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except DBAPIError:
+        # La tabla de control todavía no existe
+        conn.rollback()
+        return 0
+
+
+@contextmanager
+def _bloqueo(conn):
+    # Varios workers pueden arrancar a la vez: solo uno migra (MySQL)
+    if conn.dialect.name != "mysql":
+        yield
+        return
+    # GET_LOCK devuelve 1 (tomado), 0 (venció la espera) o NULL (error): solo con 1 se migra
+    limite = time.monotonic() + float(os.getenv("DB_MIGRACIONES_ESPERA", "600"))
+    while True:
+        tomado = conn.execute(text("SELECT GET_LOCK('backend_migraciones', 30)")).scalar()
+        if tomado == 1:
+            break
+        if tomado is None or time.monotonic() >= limite:
+            raise RuntimeError("No se pudo tomar el bloqueo de migraciones (otro proceso sigue migrando)")
+        logger.info("Otro proceso está migrando el esquema; esperando el bloqueo")
+    try:
+        yield
+    finally:
+        conn.execute(text("SELECT RELEASE_LOCK('backend_migraciones')"))
+
+
+def aplicar_migraciones(engine=None):
+    """
+    Aplica las migraciones pendientes. Si el esquema ya está al día
+    cuesta una sola consulta. Devuelve las versiones aplicadas.
+    """
+    aplicadas = []
+    with conexion(engine) as conn:
+        if version_aplicada(conn) >= VERSION_ACTUAL:
+            return aplicadas
+
+        with _bloqueo(conn):
+            schema_version.create(conn, checkfirst=True)
+            conn.commit()
+            actual = version_aplicada(conn)
+
+            for version, descripcion, migrar in MIGRACIONES:
+                if version <= actual:
+                    continue
+                logger.info("Aplicando migración %s: %s", version, descripcion)
+                migrar(conn)
+                conn.execute(schema_version.insert().values(
+                    version=version, descripcion=descripcion, aplicada=datetime.now()
+                ))
+                conn.commit()
+                aplicadas.append(version)
+
+    return aplicadas
@@ -1,28 +1,15 @@
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from backend.config.db import get_engine
 
-# Datos de conexión — cámbialos a los de tu servidor
-MYSQL_USER = "root"
-MYSQL_PASSWORD = ""
-MYSQL_HOST = "localhost"
-MYSQL_PORT = "3306"
-MYSQL_DB = "inventario_db"
-
-# URL de conexión
-DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
-
-# Crear motor de conexión
-engine = create_engine(DATABASE_URL)
-
-# Sesión de conexión
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Sesión de conexión (usa el engine compartido de config/db.py)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 # Clase base para modelos
 Base = declarative_base()
 
 # Función para obtener sesión en rutas
 def get_db():
-    db = SessionLocal()
+    db = SessionLocal(bind=get_engine())
     try:
         yield db
     finally:
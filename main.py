@@ -1,50 +1,60 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from backend.routes import productos, ventas, reportes
+from starlette.concurrency import run_in_threadpool
+from backend.routes import productos, ventas, reportes, perfiles
+from backend.config.db import cerrar_engines, cerrar_engines_async
+from backend.utils.auditoria import auditoria
+from backend.utils.coherencia import coherencia
+from backend.utils.subidas import cola_subidas
+from backend.utils.ventas_agrupadas import ventas_agrupadas
+from backend.utils.stock_fragmentado import rebalanceo_stock
+from backend.utils.reportes_memoria import reportes_memoria
+from backend.utils.logs import configurar_logs, MiddlewareLogs
+from backend.utils.metricas import MiddlewareMetricas, registro
+from backend.utils.perfil_sql import MiddlewarePerfilSQL
+from backend.utils.perfil_cpu import MiddlewarePerfilCPU, perfil_cpu
 import os
+from dotenv import load_dotenv
+load_dotenv()  # Esto carga las variables del .env
 
-app = FastAPI()
-
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # ⚠️ En producción, restringir al dominio
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Carpeta uploads
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_FOLDER), name="uploads")
-
-# Routers con prefijo
-app.include_router(productos.router, prefix="/api/productos", tags=["Productos"])
-app.include_router(ventas.router, prefix="/api/ventas", tags=["Ventas"])
-app.include_router(reportes.router, prefix="/api/reportes", tags=["Reportes"])
+# Logs estructurados y asíncronos (ver utils/logs.py)
+configurar_logs()
 
-@app.get("/")
-def root():
-    return {"mensaje": "API de Inventario funcionando"}
 
-# Ejecutar local o en Render
-if __name__ == "__main__":
-    import uvicorn
-    port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from backend.routes import productos, ventas, reportes
-from backend.routes import productos as productos_router
-from fastapi.middleware.cors import CORSMiddleware
-import os
-from dotenv import load_dotenv
-load_dotenv()  # Esto carga las variables del .env
+# 🔹 Arranque / apagado: el esquema se migra aquí (o con `python -m backend.cli migrar`), no al importar
+@asynccontextmanager
+async def lifespan(app):
+    if os.getenv("DB_MIGRAR_AL_INICIAR", "1") == "1":
+        from backend.config.migraciones import aplicar_migraciones
+        await run_in_threadpool(aplicar_migraciones)
+    # Varios workers: cada uno escucha los cambios de los demás (antes de precargar, para no perder ninguno)
+    if os.getenv("COHERENCIA_ACTIVA", "0") == "1":
+        await run_in_threadpool(coherencia.iniciar)
+    if os.getenv("CATALOGO_PRECARGAR", "1") == "1":
+        from backend.utils.catalogo import catalogo
+        await run_in_threadpool(catalogo.precargar)
+    # Reportes en memoria por defecto (REPORTES_MOTOR=memoria): la carga completa no la paga el primer request
+    if reportes.MOTOR_POR_DEFECTO == "memoria" and reportes_memoria.disponible:
+        await run_in_threadpool(reportes_memoria.cargar)
+    # Imágenes que quedaron sin subir en la ejecución anterior
+    await run_in_threadpool(cola_subidas.reanudar)
+    # Empareja los fragmentos de los productos con stock fragmentado (STOCK_REBALANCEO_INTERVALO)
+    rebalanceo_stock.iniciar()
+    yield
+    rebalanceo_stock.detener()
+    await run_in_threadpool(cola_subidas.detener, float(os.getenv("IMAGENES_ESPERA_APAGADO", "10")))
+    # Ventas agrupadas (VENTAS_AGRUPADAS=1) que siguen en cola: antes que la auditoría, que recibe sus historiales
+    await run_in_threadpool(ventas_agrupadas.detener)
+    # Historiales diferidos (AUDITORIA_MODO=diferida) que aún no se volcaron
+    await run_in_threadpool(auditoria.detener)
+    coherencia.detener()
+    await cerrar_engines_async()
+    cerrar_engines()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configuración de CORS para poder acceder desde cualquier dispositivo
 app.add_middleware(
@@ -53,7 +63,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],  # cursor de paginación y perfil de SQL
 )
+# Perfil de CPU bajo demanda (X-Perfil-CPU con PERFIL_CPU_TOKEN o PERFIL_CPU_REGLAS); sin configurar no se instala
+if perfil_cpu.activo:
+    app.add_middleware(MiddlewarePerfilCPU)
+# Perfil de SQL por request (X-Perfil-SQL: 1 o PERFIL_SQL_MUESTREO), con Server-Timing
+app.add_middleware(MiddlewarePerfilSQL)
+# Id por request y muestreo de los logs DEBUG (LOG_MUESTREO)
+app.add_middleware(MiddlewareLogs)
+# Latencia, estados y requests en curso por ruta, más tiempo de BD (GET /metrics)
+app.add_middleware(MiddlewareMetricas, router=app.router)
 
 # Carpeta para imágenes (ahora "uploads")
 UPLOAD_FOLDER = "uploads"
@@ -63,10 +83,22 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.mount("/uploads", StaticFiles(directory=UPLOAD_FOLDER), name="uploads")
 
 # Rutas de la API
-app.include_router(productos_router.router)
+app.include_router(productos.router)
 app.include_router(ventas.router)
 app.include_router(reportes.router)
+app.include_router(perfiles.router)
 
 @app.get("/")
 def root():
     return {"mensaje": "API de Inventario funcionando"}
+
+# Métricas en formato Prometheus (por proceso: con varios workers cada uno expone las suyas)
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    return Response(registro.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Ejecutar local (producción con varios workers: `python -m backend.cli servir`)
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.environ.get("PORT", 8000))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
@@ -0,0 +1,13 @@
+from sqlalchemy import Table, Column, Integer, BigInteger, String, DateTime, Index
+from backend.config.db import meta
+
+# 🔹 Registro de cambios que los demás workers leen para invalidar sus cachés
+cambios = Table(
+    "cambios", meta,
+    Column("id_cambio", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("canal", String(30), nullable=False),
+    Column("clave", String(255), nullable=True),
+    Column("origen", String(40), nullable=False),
+    Column("fecha", DateTime, nullable=False),
+    Index("ix_cambios_fecha", "fecha")
+)
@@ -1,5 +1,5 @@
-from sqlalchemy import Table, Column, Integer, String, DECIMAL, DateTime, Boolean
-from backend.config.db import meta, engine
+from sqlalchemy import Table, Column, Integer, String, DECIMAL, DateTime, Boolean, Index
+from backend.config.db import meta
 from datetime import datetime
 
 # 🔹 Tabla historial_productos
@@ -15,8 +15,8 @@ historial_productos = Table(
     Column("activo", Boolean, default=True),
     Column("inversion_acumulada", DECIMAL(12, 2), nullable=True),
     Column("accion", String(50), nullable=False),  # 🔹 crear / actualizar / eliminar / vender
-    Column("fecha_registro", DateTime, default=datetime.now)
+    Column("fecha_registro", DateTime, default=datetime.now),
+    # 🔹 Índices para paginación y filtros por acción / producto
+    Index("ix_historial_productos_accion", "accion", "id_historial"),
+    Index("ix_historial_productos_producto_fecha", "id_producto", "fecha_registro")
 )
-
-# 🔹 Crear tabla si no existe
-meta.create_all(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, Integer, Float, DateTime, ForeignKey
+from sqlalchemy import Table, Column, Integer, Float, DateTime, ForeignKey, Index
 from backend.config.db import meta
 from datetime import datetime
 
@@ -10,8 +10,9 @@ historial_ventas = Table(
     Column("cantidad", Integer, nullable=False),
     Column("precio_unitario", Float, nullable=False),
     Column("precio_total", Float, nullable=False),
-    Column("fecha_venta", DateTime, default=datetime.now)
+    Column("costo_unitario", Float, nullable=True),
+    Column("fecha_venta", DateTime, default=datetime.now),
+    # 🔹 Índices para paginación y filtros por fecha / producto
+    Index("ix_historial_ventas_fecha", "fecha_venta", "id_historial"),
+    Index("ix_historial_ventas_producto_fecha", "id_producto", "fecha_venta", "id_historial")
 )
-
-from backend.config.db import engine
-meta.create_all(engine)
@@ -0,0 +1,13 @@
+from sqlalchemy import Table, Column, Integer, String, DateTime, JSON, Index
+from backend.config.db import meta
+
+# 🔹 Imágenes ya subidas, direccionadas por contenido (sha256 del archivo original)
+imagenes = Table(
+    "imagenes", meta,
+    Column("huella", String(64), primary_key=True),
+    Column("url", String(255), nullable=False),
+    Column("variantes", JSON, nullable=True),
+    Column("referencias", Integer, nullable=False, default=0),  # productos que la usan
+    Column("fecha_registro", DateTime, nullable=False),
+    Index("ix_imagenes_referencias", "referencias")
+)
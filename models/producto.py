@@ -1,5 +1,5 @@
-from sqlalchemy import Table, Column, Integer, String, DECIMAL, Boolean, DateTime
-from backend.config.db import meta, engine
+from sqlalchemy import Table, Column, Integer, String, DECIMAL, Boolean, DateTime, JSON, Index
+from backend.config.db import meta
 from datetime import datetime
 
 productos = Table(
@@ -9,10 +9,17 @@ productos = Table(
     Column("costo", DECIMAL(10, 2), nullable=False),
     Column("precio_venta", DECIMAL(10, 2), nullable=False),
     Column("stock", Integer, nullable=False),
+    Column("fragmentos_stock", Integer, nullable=True),  # K de stock_fragmentos; NULL = stock solo en esta fila
     Column("imagen_url", String(255), nullable=True),
+    # 🔹 Subida en segundo plano: pendiente / lista / error, y el archivo que se está subiendo
+    Column("imagen_estado", String(20), nullable=True),
+    Column("imagen_pendiente", String(64), nullable=True),
+    Column("imagen_variantes", JSON, nullable=True),  # {"thumb": url, "card": url, "full": url}
+    Column("imagen_hash", String(64), nullable=True),   # -> imagenes.huella
     Column("inversion_acumulada", DECIMAL(10, 2), default=0),
     Column("activo", Boolean, default=True),
-    Column("fecha_registro", DateTime, default=datetime.now)
+    Column("fecha_registro", DateTime, default=datetime.now),
+    # 🔹 Índices para paginación y filtros por nombre / activo
+    Index("ix_productos_nombre", "nombre", "id_producto"),
+    Index("ix_productos_activo", "activo", "id_producto")
 )
-
-meta.create_all(engine)
@@ -0,0 +1,11 @@
+from sqlalchemy import Table, Column, Integer
+from backend.config.db import meta
+
+# 🔹 Stock fragmentado: con productos.fragmentos_stock = K, el stock de ese producto vive en K filas
+# (más lo que quede en productos.stock) y cada venta descuenta de una sola
+stock_fragmentos = Table(
+    "stock_fragmentos", meta,
+    Column("id_producto", Integer, primary_key=True, autoincrement=False),
+    Column("fragmento", Integer, primary_key=True, autoincrement=False),
+    Column("cantidad", Integer, nullable=False, default=0)
+)
@@ -1,5 +1,5 @@
-from sqlalchemy import Table, Column, Integer, Float, DateTime, ForeignKey
-from backend.config.db import meta, engine
+from sqlalchemy import Table, Column, Integer, Float, DateTime, ForeignKey, Index
+from backend.config.db import meta
 
 ventas = Table(
     "ventas", meta,
@@ -9,7 +9,11 @@ ventas = Table(
     Column("precio_total", Float),
     Column("precio_unitario", Float),
     Column("fecha_venta", DateTime),
+    Column("costo_unitario", Float, nullable=True),  # costo del producto al vender (los reportes no lo buscan en productos)
     # Column("fecha", DateTime)  ← ELIMINAR ESTA LÍNEA (campo duplicado)
+    # 🔹 Índices para paginación y filtros por fecha / producto
+    Index("ix_ventas_fecha", "fecha_venta", "id_venta"),
+    Index("ix_ventas_producto_fecha", "id_producto", "fecha_venta", "id_venta"),
+    # 🔹 Cubre los bordes de los reportes por rango (sin leer la fila)
+    Index("ix_ventas_fecha_totales", "fecha_venta", "id_producto", "cantidad", "precio_total", "costo_unitario")
 )
-
-meta.create_all(engine)
\ No newline at end of file
@@ -0,0 +1,14 @@
+from sqlalchemy import Table, Column, Integer, Date, DECIMAL
+from backend.config.db import meta
+
+# 🔹 Resumen diario de ventas (fecha × producto), mantenido junto con cada venta
+ventas_diarias = Table(
+    "ventas_diarias", meta,
+    Column("fecha", Date, primary_key=True),
+    Column("id_producto", Integer, primary_key=True),
+    # Las ventas de un producto con stock fragmentado suman en la fila de su fragmento (los reportes suman todas)
+    Column("fragmento", Integer, primary_key=True, autoincrement=False, default=0, server_default="0"),
+    Column("unidades", Integer, nullable=False, default=0),
+    Column("generado", DECIMAL(14, 2), nullable=False, default=0),
+    Column("inversion", DECIMAL(14, 2), nullable=False, default=0)
+)
@@ -1,36 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy import insert, select, update, delete
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import SQLAlchemyError
-from backend.config.db import conn
+from backend.config.db import get_conn
 from backend.models.producto import productos
 from backend.models.historial_productos import historial_productos
 from backend.schemas.producto import ProductoCreate, ProductoUpdate, ProductoResponse
+from backend.utils.auditoria import auditoria
+from backend.utils.cache_reportes import cache_reportes
+from backend.utils.catalogo import catalogo
+from backend.utils.coherencia import coherencia
+from backend.utils import deduplicacion
 from datetime import datetime
 
 router = APIRouter(prefix="/productos", tags=["Productos"])
 
-# 🔹 Función auxiliar: registrar en historial
-def _registrar_historial_producto(id_producto, nombre, costo=None, precio_venta=None, stock=None,
-                                  imagen_url=None, activo=True, inversion_acumulada=None, accion="actualizacion"):
-    registro = {
-        "id_producto": id_producto,
-        "nombre": nombre,
-        "costo": costo,
-        "precio_venta": precio_venta,
-        "stock": stock,
-        "imagen_url": imagen_url,
-        "activo": activo,
-        "inversion_acumulada": inversion_acumulada,
-        "accion": accion,
-        "fecha_registro": datetime.now()
-    }
-    conn.execute(historial_productos.insert().values(registro))
-    conn.commit()
-
-
 # 🔹 Crear producto
 @router.post("/", response_model=ProductoResponse)
-def create_producto(producto: ProductoCreate):
+def create_producto(producto: ProductoCreate, conn: Connection = Depends(get_conn)):
     try:
         nuevo_producto = {
             "nombre": producto.nombre,
@@ -42,19 +29,24 @@ def create_producto(producto: ProductoCreate):
         }
 
         result = conn.execute(insert(productos).values(**nuevo_producto))
-        conn.commit()
         producto_id = result.inserted_primary_key[0]
 
-        # Registrar historial
-        _registrar_historial_producto(
-            id_producto=producto_id,
-            nombre=producto.nombre,
-            costo=producto.costo,
-            precio_venta=producto.precio_venta,
-            stock=producto.stock,
-            imagen_url=producto.imagen_url,
-            accion="creacion"
-        )
+        # Registrar historial (misma transacción)
+        auditoria.registrar(conn, historial_productos, {
+            "id_producto": producto_id,
+            "nombre": producto.nombre,
+            "costo": producto.costo,
+            "precio_venta": producto.precio_venta,
+            "stock": producto.stock,
+            "imagen_url": producto.imagen_url,
+            "activo": True,
+            "inversion_acumulada": None,
+            "accion": "creacion",
+            "fecha_registro": datetime.now()
+        })
+        coherencia.publicar(conn, "producto", str(producto_id))
+        conn.commit()
+        catalogo.invalidar(producto_id)
 
         return {"id_producto": producto_id, **nuevo_producto}
 
@@ -65,27 +57,14 @@ def create_producto(producto: ProductoCreate):
 
 # 🔹 Listar productos
 @router.get("/", response_model=list[ProductoResponse])
-def listar_productos():
+def listar_productos(conn: Connection = Depends(get_conn)):
     result = conn.execute(select(productos)).fetchall()
     return [dict(row._mapping) for row in result]
 
 
-# 🔹 Obtener producto por ID
-@router.get("/{id_producto}", response_model=ProductoResponse)
-def obtener_producto(id_producto: int):
-    producto = conn.execute(
-        select(productos).where(productos.c.id_producto == id_producto)
-    ).fetchone()
-
-    if not producto:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
-
-    return dict(producto._mapping)
-
-
 # 🔹 Actualizar producto (soporte parcial)
 @router.put("/{id_producto}", response_model=ProductoResponse)
-def actualizar_producto(id_producto: int, producto: ProductoUpdate):
+def actualizar_producto(id_producto: int, producto: ProductoUpdate, conn: Connection = Depends(get_conn)):
     existente = conn.execute(
         select(productos).where(productos.c.id_producto == id_producto)
     ).fetchone()
@@ -96,6 +75,10 @@ def actualizar_producto(id_producto: int, producto: ProductoUpdate):
     # Tomar solo campos enviados
     valores_actualizados = producto.dict(exclude_unset=True)
     valores_actualizados["fecha_registro"] = datetime.now()
+    if "imagen_url" in valores_actualizados:
+        # URL externa: deja de usar la imagen deduplicada que tuviera
+        deduplicacion.referenciar(conn, None, existente._mapping["imagen_hash"])
+        valores_actualizados.update(imagen_hash=None, imagen_variantes=None, imagen_estado=None, imagen_pendiente=None)
 
     # Actualizar producto
     conn.execute(
@@ -103,20 +86,30 @@ def actualizar_producto(id_producto: int, producto: ProductoUpdate):
         .where(productos.c.id_producto == id_producto)
         .values(**valores_actualizados)
     )
-    conn.commit()
 
-    # Registrar historial
-    _registrar_historial_producto(
-        id_producto=id_producto,
-        nombre=valores_actualizados.get("nombre", existente._mapping["nombre"]),
-        costo=valores_actualizados.get("costo", existente._mapping["costo"]),
-        precio_venta=valores_actualizados.get("precio_venta", existente._mapping["precio_venta"]),
-        stock=valores_actualizados.get("stock", existente._mapping["stock"]),
-        imagen_url=valores_actualizados.get("imagen_url", existente._mapping["imagen_url"]),
-        activo=existente._mapping.get("activo", True),
-        inversion_acumulada=existente._mapping.get("inversion_acumulada", 0),
-        accion="actualizacion"
-    )
+    # Registrar historial (misma transacción)
+    auditoria.registrar(conn, historial_productos, {
+        "id_producto": id_producto,
+        "nombre": valores_actualizados.get("nombre", existente._mapping["nombre"]),
+        "costo": valores_actualizados.get("costo", existente._mapping["costo"]),
+        "precio_venta": valores_actualizados.get("precio_venta", existente._mapping["precio_venta"]),
+        "stock": valores_actualizados.get("stock", existente._mapping["stock"]),
+        "imagen_url": valores_actualizados.get("imagen_url", existente._mapping["imagen_url"]),
+        "activo": existente._mapping.get("activo", True),
+        "inversion_acumulada": existente._mapping.get("inversion_acumulada", 0),
+        "accion": "actualizacion",
+        "fecha_registro": datetime.now()
+    })
+
+    # Nombre y costo aparecen en los reportes (top 5 / inversión)
+    cambia_reportes = "nombre" in valores_actualizados or "costo" in valores_actualizados
+    coherencia.publicar(conn, "producto", str(id_producto))
+    if cambia_reportes:
+        coherencia.publicar(conn, "reportes")
+    conn.commit()
+    catalogo.invalidar(id_producto)
+    if cambia_reportes:
+        cache_reportes.limpiar()
 
     actualizado = conn.execute(
         select(productos).where(productos.c.id_producto == id_producto)
@@ -127,7 +120,7 @@ def actualizar_producto(id_producto: int, producto: ProductoUpdate):
 
 # 🔹 Eliminar producto
 @router.delete("/{id_producto}")
-def eliminar_producto(id_producto: int):
+def eliminar_producto(id_producto: int, conn: Connection = Depends(get_conn)):
     producto = conn.execute(
         select(productos).where(productos.c.id_producto == id_producto)
     ).fetchone()
@@ -136,19 +129,25 @@ def eliminar_producto(id_producto: int):
         raise HTTPException(status_code=404, detail="Producto no encontrado")
 
     conn.execute(delete(productos).where(productos.c.id_producto == id_producto))
-    conn.commit()
+    deduplicacion.referenciar(conn, None, producto._mapping["imagen_hash"])
 
-    # Registrar historial
-    _registrar_historial_producto(
-        id_producto=id_producto,
-        nombre=producto._mapping["nombre"],
-        costo=producto._mapping["costo"],
-        precio_venta=producto._mapping["precio_venta"],
-        stock=producto._mapping["stock"],
-        imagen_url=producto._mapping["imagen_url"],
-        activo=producto._mapping.get("activo", True),
-        inversion_acumulada=producto._mapping.get("inversion_acumulada", 0),
-        accion="eliminacion"
-    )
+    # Registrar historial (misma transacción)
+    auditoria.registrar(conn, historial_productos, {
+        "id_producto": id_producto,
+        "nombre": producto._mapping["nombre"],
+        "costo": producto._mapping["costo"],
+        "precio_venta": producto._mapping["precio_venta"],
+        "stock": producto._mapping["stock"],
+        "imagen_url": producto._mapping["imagen_url"],
+        "activo": producto._mapping.get("activo", True),
+        "inversion_acumulada": producto._mapping.get("inversion_acumulada", 0),
+        "accion": "eliminacion",
+        "fecha_registro": datetime.now()
+    })
+    coherencia.publicar(conn, "producto", str(id_producto))
+    coherencia.publicar(conn, "reportes")
+    conn.commit()
+    catalogo.invalidar(id_producto)
+    cache_reportes.limpiar()
 
     return {"mensaje": f"Producto {id_producto} eliminado correctamente"}
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import FileResponse
+from backend.utils.perfil_cpu import perfil_cpu
+from typing import Optional
+
+router = APIRouter(prefix="/admin/perfiles", tags=["Admin"])
+
+
+# 🔹 Solo con el mismo token que activa el perfilado (sin PERFIL_CPU_TOKEN no existen)
+def _autorizar(x_perfil_cpu: Optional[str] = Header(None)):
+    if not perfil_cpu.token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not perfil_cpu.autorizado(x_perfil_cpu.encode() if x_perfil_cpu else None):
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido")
+
+
+# 🔹 Listar perfiles de CPU guardados (el más reciente primero)
+@router.get("", dependencies=[Depends(_autorizar)])
+def listar_perfiles():
+    return perfil_cpu.listar()
+
+
+# 🔹 Descargar un perfil (abrir en https://www.speedscope.app)
+@router.get("/{nombre}", dependencies=[Depends(_autorizar)])
+def descargar_perfil(nombre: str):
+    ruta = perfil_cpu.ruta(nombre)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return FileResponse(ruta, media_type="application/json", filename=nombre)
@@ -1,35 +1,59 @@
-from fastapi import APIRouter, HTTPException, Form, File, UploadFile
+from fastapi import APIRouter, HTTPException, Form, File, UploadFile, Depends, Query, Request, Response
 from sqlalchemy import insert, select, update
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import SQLAlchemyError
-from backend.config.db import conn
+from backend.config.db import get_conn, conexion, conexion_async, modo_async
 from backend.models.producto import productos
 from backend.models.historial_productos import historial_productos
 from backend.schemas.producto import ProductoResponse
+from backend.utils.auditoria import auditoria
+from backend.utils.cache_reportes import cache_reportes
+from backend.utils.catalogo import catalogo
+from backend.utils.coherencia import coherencia
+from backend.utils.json_rapido import SerializadorFilas, dumps
+from backend.utils.paginacion import paginar, cortar_pagina, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from backend.utils.exportacion import respuesta_exportacion
 from datetime import datetime
-from backend.utils.cloudinary_service import upload_image  # 👈 NUEVO
+from typing import Optional
+from backend.utils.subidas import cola_subidas
+from backend.utils import deduplicacion
+from backend.utils import stock_fragmentado
+from backend.utils.stock_fragmentado import columnas_producto, stock_total
 
 router = APIRouter(prefix="/productos", tags=["Productos"])
 
-# 📌 Función auxiliar para registrar historial
-def _registrar_historial_producto(
-    id_producto,
-    tipo,
-    cantidad,
-    costo,
-    precio,
-    stock_anterior,
-    stock_nuevo
-):
-    registro = {
-        "id_producto": id_producto,
-        "accion": tipo,
-        "costo": costo,
-        "precio_venta": precio,
-        "stock": stock_nuevo,
-        "fecha_registro": datetime.now()
-    }
-    conn.execute(historial_productos.insert().values(registro))
-    conn.commit()
+# Columnas por las que se puede ordenar el listado
+ORDENES_PRODUCTOS = {"id": productos.c.id_producto, "nombre": productos.c.nombre}
+
+# Columnas por las que se puede ordenar el historial
+ORDENES_HISTORIAL = {"id": historial_productos.c.id_historial, "fecha": historial_productos.c.fecha_registro}
+
+# Serializador del listado: filas -> JSON con el esquema de ProductoResponse, sin validar fila por fila
+# (`stock` suma los fragmentos de los productos con stock fragmentado)
+_serializador_productos = SerializadorFilas.para_modelo(ProductoResponse, productos, {"stock": stock_total()})
+
+# 📌 Función auxiliar: imagen recibida -> columnas del producto
+# Si el mismo contenido ya se subió se reutiliza su URL; si no, se encola (devuelve el token a encolar)
+def _imagen_recibida(conn, imagen, hash_anterior=None):
+    token, huella = cola_subidas.guardar_temporal(imagen.file, imagen.filename)
+
+    existente = deduplicacion.buscar(conn, huella, bloquear=True)
+    if existente is not None:
+        cola_subidas.descartar(token)
+        cola_subidas.contar_deduplicada()
+        deduplicacion.referenciar(conn, huella, hash_anterior)
+        return {
+            "imagen_url": existente.url,
+            "imagen_variantes": existente.variantes,
+            "imagen_estado": "lista",
+            "imagen_hash": huella,
+            "imagen_pendiente": None
+        }, None, huella
+
+    if cola_subidas.lleno():
+        cola_subidas.descartar(token)
+        raise HTTPException(status_code=503, detail="Hay demasiadas imágenes pendientes de subir, reintente en unos segundos")
+    return {"imagen_estado": "pendiente", "imagen_pendiente": token}, token, huella
 
 # 🔹 Crear producto
 @router.post("", response_model=ProductoResponse)
@@ -38,48 +62,188 @@ def create_producto(
     costo: float = Form(...),
     precio_venta: float = Form(...),
     stock: int = Form(...),
-    imagen: UploadFile = File(None)
+    imagen: UploadFile = File(None),
+    conn: Connection = Depends(get_conn)
 ):
+    token = None
+    encolada = False
     try:
-        imagen_url = None
-        if imagen:
-            # Subir archivo directamente a Cloudinary
-            imagen_url = upload_image(imagen.file)
-
         nuevo_producto = {
             "nombre": nombre,
             "costo": costo,
             "precio_venta": precio_venta,
             "stock": stock,
-            "imagen_url": imagen_url,
+            "imagen_url": None,
             "fecha_registro": datetime.now()
         }
+        if imagen:
+            # La imagen se sube después del commit; el producto queda con imagen_estado="pendiente"
+            valores_imagen, token, huella = _imagen_recibida(conn, imagen)
+            nuevo_producto.update(valores_imagen)
 
         result = conn.execute(insert(productos).values(**nuevo_producto))
-        conn.commit()
         producto_id = result.inserted_primary_key[0]
-
-        _registrar_historial_producto(
-            id_producto=producto_id,
-            tipo="creacion",
-            cantidad=stock,
-            costo=costo,
-            precio=precio_venta,
-            stock_anterior=0,
-            stock_nuevo=stock
-        )
+        auditoria.registrar(conn, historial_productos, {
+            "id_producto": producto_id,
+            "nombre": nombre,
+            "accion": "creacion",
+            "costo": costo,
+            "precio_venta": precio_venta,
+            "stock": stock,
+            "fecha_registro": datetime.now()
+        })
+        coherencia.publicar(conn, "producto", str(producto_id))
+        conn.commit()
+        catalogo.invalidar(producto_id)
+        if token:
+            cola_subidas.encolar(producto_id, token, huella)
+            encolada = True
 
         return {"id_producto": producto_id, **nuevo_producto}
 
     except SQLAlchemyError as e:
         conn.rollback()
+        if token and not encolada:
+            cola_subidas.descartar(token)
         raise HTTPException(status_code=500, detail=str(e))
 
-# 🔹 Listar productos
-@router.get("", response_model=list[ProductoResponse])
-def listar_productos():
-    result = conn.execute(select(productos)).fetchall()
-    return [dict(row._mapping) for row in result]
+# 🔹 Listar productos (paginado por cursor; el siguiente va en X-Next-Cursor)
+# Responde con ETag (hash del cuerpo); If-None-Match igual -> 304. Con la respuesta en caché no se toca la BD
+def _responder(request, cuerpo, cabeceras):
+    if catalogo.coincide(request.headers.get("if-none-match"), cabeceras["ETag"]):
+        return catalogo.no_modificado(cabeceras["ETag"])
+    return Response(content=cuerpo, media_type="application/json", headers=cabeceras)
+
+
+def _listado_en_cache(request, clave):
+    encontrado, guardada = catalogo.respuesta(clave)
+    if encontrado:
+        return _responder(request, *guardada)
+    return None
+
+
+def _consulta_listado(activo, nombre, orden, direccion, cursor, limite):
+    stmt = select(*_serializador_productos.columnas)
+    if activo is not None:
+        stmt = stmt.where(productos.c.activo == activo)
+    if nombre:
+        stmt = stmt.where(productos.c.nombre.startswith(nombre, autoescape=True))
+    return paginar(stmt, ORDENES_PRODUCTOS[orden], productos.c.id_producto, cursor, limite, direccion == "desc")
+
+
+def _respuesta_listado(request, clave, filas, orden, limite):
+    filas, siguiente = cortar_pagina(filas, limite, ORDENES_PRODUCTOS[orden], productos.c.id_producto)
+    cuerpo = _serializador_productos.json(filas)
+    cabeceras = {"ETag": catalogo.etag(cuerpo)}
+    if siguiente:
+        cabeceras["X-Next-Cursor"] = siguiente
+    catalogo.guardar_respuesta(clave, cuerpo, cabeceras)
+    return _responder(request, cuerpo, cabeceras)
+
+
+if modo_async():
+    @router.get("", response_model=list[ProductoResponse])
+    async def listar_productos(
+        request: Request,
+        activo: Optional[bool] = Query(None, description="Filtrar por activo / inactivo"),
+        nombre: Optional[str] = Query(None, description="Prefijo del nombre"),
+        orden: str = Query("id", enum=list(ORDENES_PRODUCTOS)),
+        direccion: str = Query("asc", enum=["asc", "desc"]),
+        cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+        limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO)
+    ):
+        clave = catalogo.clave("productos", activo, nombre, orden, direccion, cursor, limite)
+        respuesta = _listado_en_cache(request, clave)
+        if respuesta is not None:
+            return respuesta
+
+        stmt = _consulta_listado(activo, nombre, orden, direccion, cursor, limite)
+        async with conexion_async() as conn:
+            filas = (await conn.execute(stmt)).fetchall()
+        return _respuesta_listado(request, clave, filas, orden, limite)
+else:
+    @router.get("", response_model=list[ProductoResponse])
+    def listar_productos(
+        request: Request,
+        activo: Optional[bool] = Query(None, description="Filtrar por activo / inactivo"),
+        nombre: Optional[str] = Query(None, description="Prefijo del nombre"),
+        orden: str = Query("id", enum=list(ORDENES_PRODUCTOS)),
+        direccion: str = Query("asc", enum=["asc", "desc"]),
+        cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+        limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO)
+    ):
+        clave = catalogo.clave("productos", activo, nombre, orden, direccion, cursor, limite)
+        respuesta = _listado_en_cache(request, clave)
+        if respuesta is not None:
+            return respuesta
+
+        stmt = _consulta_listado(activo, nombre, orden, direccion, cursor, limite)
+        with conexion() as conn:
+            filas = conn.execute(stmt).fetchall()
+        return _respuesta_listado(request, clave, filas, orden, limite)
+
+# 🔹 Estado de la cola de subida de imágenes
+@router.get("/imagenes/cola")
+def estado_cola_imagenes():
+    return cola_subidas.estadisticas()
+
+# 🔹 Consultar historial de productos (paginado por cursor)
+@router.get("/historial", tags=["Historial"])
+def historial(
+    response: Response,
+    accion: Optional[str] = Query(None, description="creacion / actualizacion / desactivacion / eliminacion"),
+    id_producto: Optional[int] = Query(None),
+    orden: str = Query("id", enum=list(ORDENES_HISTORIAL)),
+    direccion: str = Query("asc", enum=["asc", "desc"]),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    conn: Connection = Depends(get_conn)
+):
+    stmt = select(historial_productos)
+    if accion:
+        stmt = stmt.where(historial_productos.c.accion == accion)
+    if id_producto is not None:
+        stmt = stmt.where(historial_productos.c.id_producto == id_producto)
+
+    columna = ORDENES_HISTORIAL[orden]
+    stmt = paginar(stmt, columna, historial_productos.c.id_historial, cursor, limite, direccion == "desc")
+    filas, siguiente = cortar_pagina(conn.execute(stmt).fetchall(), limite, columna, historial_productos.c.id_historial)
+
+    if siguiente:
+        response.headers["X-Next-Cursor"] = siguiente
+    return [dict(row._mapping) for row in filas]
+
+# 🔹 Exportar historial de productos (CSV / NDJSON en streaming)
+@router.get("/historial/export", tags=["Historial"])
+def exportar_historial(
+    formato: str = Query("csv", enum=["csv", "ndjson"]),
+    desde: Optional[datetime] = Query(None, description="Fecha inicio"),
+    hasta: Optional[datetime] = Query(None, description="Fecha fin"),
+    accion: Optional[str] = Query(None),
+    comprimir: bool = Query(False, description="Devolver el archivo en gzip")
+):
+    stmt = select(historial_productos)
+    if desde is not None:
+        stmt = stmt.where(historial_productos.c.fecha_registro >= desde)
+    if hasta is not None:
+        stmt = stmt.where(historial_productos.c.fecha_registro <= hasta)
+    if accion:
+        stmt = stmt.where(historial_productos.c.accion == accion)
+    stmt = stmt.order_by(historial_productos.c.id_historial)
+    return respuesta_exportacion(stmt, "historial_productos", formato, comprimir)
+
+# 🔹 Obtener producto por ID (desde el catálogo en memoria; ETag = hash del producto)
+@router.get("/{id_producto}", response_model=ProductoResponse)
+def obtener_producto(id_producto: int, request: Request, response: Response):
+    producto = catalogo.obtener(id_producto)
+    if not producto:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+
+    etag = catalogo.etag(dumps({str(columna): valor for columna, valor in producto.items()}))
+    if catalogo.coincide(request.headers.get("if-none-match"), etag):
+        return catalogo.no_modificado(etag)
+    response.headers["ETag"] = etag
+    return producto
 
 # 🔹 Actualizar producto
 @router.put("/{id_producto}", response_model=ProductoResponse)
@@ -89,62 +253,123 @@ def actualizar_producto(
     costo: float = Form(None),
     precio_venta: float = Form(None),
     stock: int = Form(None),
-    imagen: UploadFile = File(None)
+    imagen: UploadFile = File(None),
+    conn: Connection = Depends(get_conn)
 ):
-    existente = conn.execute(
-        select(productos).where(productos.c.id_producto == id_producto)
-    ).fetchone()
+    token = None
+    encolada = False
+    try:
+        existente = conn.execute(
+            select(*columnas_producto()).where(productos.c.id_producto == id_producto)
+        ).fetchone()
 
-    if not existente:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
+        if not existente:
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
 
-    stock_anterior = existente._mapping["stock"]
+        stock_anterior = existente._mapping["stock"]
 
-    valores_actualizados = {}
-    if nombre is not None:
-        valores_actualizados["nombre"] = nombre
-    if costo is not None:
-        valores_actualizados["costo"] = costo
-    if precio_venta is not None:
-        valores_actualizados["precio_venta"] = precio_venta
-    if stock is not None:
-        valores_actualizados["stock"] = stock
-    if imagen is not None:
-        # Subir nueva imagen a Cloudinary
-        valores_actualizados["imagen_url"] = upload_image(imagen.file)
+        valores_actualizados = {}
+        if nombre is not None:
+            valores_actualizados["nombre"] = nombre
+        if costo is not None:
+            valores_actualizados["costo"] = costo
+        if precio_venta is not None:
+            valores_actualizados["precio_venta"] = precio_venta
+        if stock is not None:
+            valores_actualizados["stock"] = stock
+        fragmentos = existente._mapping["fragmentos_stock"]
+        if imagen is not None:
+            # La imagen anterior se sigue mostrando hasta que la nueva termine de subirse
+            valores_imagen, token, huella = _imagen_recibida(conn, imagen, existente._mapping["imagen_hash"])
+            valores_actualizados.update(valores_imagen)
 
-    if not valores_actualizados:
-        raise HTTPException(status_code=400, detail="No se enviaron campos para actualizar")
+        if not valores_actualizados:
+            raise HTTPException(status_code=400, detail="No se enviaron campos para actualizar")
 
-    valores_actualizados["fecha_registro"] = datetime.now()
+        valores_actualizados["fecha_registro"] = datetime.now()
 
-    conn.execute(
-        update(productos)
-        .where(productos.c.id_producto == id_producto)
-        .values(**valores_actualizados)
-    )
-    conn.commit()
+        valores_producto = dict(valores_actualizados)
+        if stock is not None and fragmentos:
+            # Con stock fragmentado el nuevo stock se reparte entre los fragmentos
+            valores_producto["stock"] = 0
+            stock_fragmentado.repartir(conn, id_producto, stock, fragmentos)
+        conn.execute(
+            update(productos)
+            .where(productos.c.id_producto == id_producto)
+            .values(**valores_producto)
+        )
+        auditoria.registrar(conn, historial_productos, {
+            "id_producto": id_producto,
+            "nombre": valores_actualizados.get("nombre", existente._mapping["nombre"]),
+            "accion": "actualizacion",
+            "costo": valores_actualizados.get("costo", existente._mapping["costo"]),
+            "precio_venta": valores_actualizados.get("precio_venta", existente._mapping["precio_venta"]),
+            "stock": valores_actualizados.get("stock", stock_anterior),
+            "fecha_registro": datetime.now()
+        })
+        # El nombre aparece en los reportes (top 5); el costo no: cada venta guarda el suyo
+        cambia_reportes = "nombre" in valores_actualizados
+        coherencia.publicar(conn, "producto", str(id_producto))
+        if cambia_reportes:
+            coherencia.publicar(conn, "reportes")
+        conn.commit()
+        catalogo.invalidar(id_producto)
+        if cambia_reportes:
+            cache_reportes.limpiar()
+        if token:
+            cola_subidas.encolar(id_producto, token, huella)
+            encolada = True
 
-    _registrar_historial_producto(
-        id_producto=id_producto,
-        tipo="actualizacion",
-        cantidad=(valores_actualizados.get("stock", stock_anterior) - stock_anterior)
-        if "stock" in valores_actualizados else 0,
-        costo=valores_actualizados.get("costo", existente._mapping["costo"]),
-        precio=valores_actualizados.get("precio_venta", existente._mapping["precio_venta"]),
-        stock_anterior=stock_anterior,
-        stock_nuevo=valores_actualizados.get("stock", stock_anterior)
-    )
+        actualizado = conn.execute(
+            select(*columnas_producto()).where(productos.c.id_producto == id_producto)
+        ).fetchone()
 
-    actualizado = conn.execute(
-        select(productos).where(productos.c.id_producto == id_producto)
+        return dict(actualizado._mapping)
+
+    except SQLAlchemyError as e:
+        conn.rollback()
+        if token and not encolada:
+            cola_subidas.descartar(token)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 🔹 Stock fragmentado (productos muy vendidos): estado y activación por producto
+def _estado_stock(conn, id_producto):
+    fila = conn.execute(
+        select(productos.c.fragmentos_stock, stock_total()).where(productos.c.id_producto == id_producto)
     ).fetchone()
+    if not fila:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return {
+        "id_producto": id_producto,
+        "stock": fila.stock,
+        "fragmentos": fila.fragmentos_stock or 0,
+        "detalle": stock_fragmentado.detalle(conn, id_producto)
+    }
+
+@router.get("/{id_producto}/stock")
+def estado_stock(id_producto: int, conn: Connection = Depends(get_conn)):
+    return _estado_stock(conn, id_producto)
 
-    return dict(actualizado._mapping)
+@router.put("/{id_producto}/stock/fragmentos")
+def fragmentar_stock(
+    id_producto: int,
+    fragmentos: int = Form(..., description="K filas de stock (0 = desactivar)"),
+    conn: Connection = Depends(get_conn)
+):
+    try:
+        total = stock_fragmentado.configurar(conn, id_producto, fragmentos)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if total is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    coherencia.publicar(conn, "producto", str(id_producto))
+    conn.commit()
+    catalogo.invalidar(id_producto)
+    return _estado_stock(conn, id_producto)
 
 # 🔹 Desactivar producto
 @router.delete("/{id_producto}")
-def eliminar_producto(id_producto: int):
+def eliminar_producto(id_producto: int, conn: Connection = Depends(get_conn)):
     producto = conn.execute(
         select(productos).where(productos.c.id_producto == id_producto)
     ).fetchone()
@@ -157,16 +382,17 @@ def eliminar_producto(id_producto: int):
         .where(productos.c.id_producto == id_producto)
         .values(activo=False, fecha_registro=datetime.now())
     )
+    auditoria.registrar(conn, historial_productos, {
+        "id_producto": id_producto,
+        "nombre": producto._mapping["nombre"],
+        "accion": "desactivacion",
+        "costo": producto._mapping["costo"],
+        "precio_venta": producto._mapping["precio_venta"],
+        "stock": 0,
+        "fecha_registro": datetime.now()
+    })
+    coherencia.publicar(conn, "producto", str(id_producto))
     conn.commit()
-
-    _registrar_historial_producto(
-        id_producto=id_producto,
-        tipo="desactivacion",
-        cantidad=-producto._mapping["stock"],
-        costo=producto._mapping["costo"],
-        precio=producto._mapping["precio_venta"],
-        stock_anterior=producto._mapping["stock"],
-        stock_nuevo=0
-    )
+    catalogo.invalidar(id_producto)
 
     return {"mensaje": f"Producto {id_producto} desactivado correctamente"}
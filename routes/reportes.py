@@ -1,96 +1,231 @@
-from fastapi import APIRouter, Query, HTTPException
-from backend.config.db import conn
+import os
+
+from fastapi import APIRouter, Query, HTTPException, Depends
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.engine import Connection
+from backend.config.db import get_conn, conexion, conexion_async, modo_async
 from backend.models.producto import productos
 from backend.models.venta import ventas
-from sqlalchemy import func, extract, and_, select
-from datetime import datetime
+from backend.models.venta_diaria import ventas_diarias
+from backend.utils.ventas_diarias import reconstruir, como_fecha
+from backend.utils.cache_reportes import cache_reportes
+from backend.utils.coherencia import coherencia, clave_rango
+from backend.utils.reportes_memoria import reportes_memoria
+from sqlalchemy import func, and_, select, union_all
+from datetime import datetime, time, timedelta
 
 router = APIRouter(prefix="/reportes", tags=["Reportes"])
 
-# 🔹 Reportes por rango de fechas (listo para frontend)
-@router.get("/rango")
-def reportes_por_rango(
-    desde: datetime = Query(..., description="Fecha inicio"),
-    hasta: datetime = Query(..., description="Fecha fin"),
-    periodo: str = Query("mes", enum=["dia", "semana", "mes", "anio"])
-):
-    # Definimos agrupador según periodo
-    if periodo == "dia":
-        agrupador = [
-            extract("year", ventas.c.fecha_venta).label("anio"),
-            extract("month", ventas.c.fecha_venta).label("mes"),
-            extract("day", ventas.c.fecha_venta).label("dia")
-        ]
-    elif periodo == "semana":
-        agrupador = [
-            extract("year", ventas.c.fecha_venta).label("anio"),
-            extract("week", ventas.c.fecha_venta).label("semana")
-        ]
-    elif periodo == "mes":
-        agrupador = [
-            extract("year", ventas.c.fecha_venta).label("anio"),
-            extract("month", ventas.c.fecha_venta).label("mes")
-        ]
-    else:  # anio
-        agrupador = [extract("year", ventas.c.fecha_venta).label("anio")]
-
-    # 🔹 Consulta principal filtrando por fechas
-    stmt = (
-        select(
-            *agrupador,
-            func.sum(productos.c.costo * ventas.c.cantidad).label("inversion"),
-            func.sum(ventas.c.precio_total).label("generado")
+# Motor de /reportes/rango cuando el request no lo elige: "sql" o "memoria" (numpy)
+MOTOR_POR_DEFECTO = os.getenv("REPORTES_MOTOR", "sql")
+
+
+# 🔹 Función auxiliar: días completos del rango (salen del resumen) y bordes parciales (salen de ventas)
+def _dividir_rango(desde, hasta):
+    primer_dia = desde.date() if desde.time() == time.min else desde.date() + timedelta(days=1)
+    ultimo_dia = hasta.date() if hasta.time() == time.max else hasta.date() - timedelta(days=1)
+
+    if primer_dia > ultimo_dia:
+        return None, [(desde, hasta)]
+
+    bordes = []
+    inicio_completo = datetime.combine(primer_dia, time.min)
+    fin_completo = datetime.combine(ultimo_dia + timedelta(days=1), time.min)
+    if desde < inicio_completo:
+        bordes.append((desde, inicio_completo - timedelta(microseconds=1)))
+    if hasta >= fin_completo:
+        bordes.append((fin_completo, hasta))
+    return (primer_dia, ultimo_dia), bordes
+
+
+# 🔹 Función auxiliar: filas (fecha, producto, unidades, generado, inversion) del rango
+def _filas_rango(desde, hasta):
+    dias, bordes = _dividir_rango(desde, hasta)
+    partes = []
+    if dias:
+        partes.append(
+            select(
+                ventas_diarias.c.fecha.label("fecha"),
+                ventas_diarias.c.id_producto,
+                ventas_diarias.c.unidades,
+                ventas_diarias.c.generado,
+                ventas_diarias.c.inversion
+            ).where(ventas_diarias.c.fecha >= dias[0], ventas_diarias.c.fecha <= dias[1])
         )
-        .select_from(ventas.join(productos, ventas.c.id_producto == productos.c.id_producto))
-        .where(and_(ventas.c.fecha_venta >= desde, ventas.c.fecha_venta <= hasta))
-        .group_by(*agrupador)
-        .order_by(*agrupador)
-    )
-    result = conn.execute(stmt).fetchall()
+    for inicio, fin in bordes:
+        partes.append(
+            select(
+                func.date(ventas.c.fecha_venta).label("fecha"),
+                ventas.c.id_producto,
+                ventas.c.cantidad.label("unidades"),
+                ventas.c.precio_total.label("generado"),
+                (ventas.c.costo_unitario * ventas.c.cantidad).label("inversion")
+            )
+            # Solo columnas de ix_ventas_fecha_totales: el costo es el de la venta, sin join a productos
+            # Sin producto tampoco entran al resumen diario
+            .where(and_(ventas.c.fecha_venta >= inicio, ventas.c.fecha_venta <= fin, ventas.c.id_producto.isnot(None)))
+        )
+    return union_all(*partes).subquery() if len(partes) > 1 else partes[0].subquery()
+
+
+# 🔹 Función auxiliar: clave del periodo (mismos valores que EXTRACT de MySQL; semana en modo 0)
+def _clave_periodo(fecha, periodo):
+    if periodo == "dia":
+        return {"anio": fecha.year, "mes": fecha.month, "dia": fecha.day}
+    if periodo == "semana":
+        return {"anio": fecha.year, "semana": int(fecha.strftime("%U"))}
+    if periodo == "mes":
+        return {"anio": fecha.year, "mes": fecha.month}
+    return {"anio": fecha.year}
+
+
+# 🔹 Función auxiliar: arma la respuesta a partir de los totales por día y el top 5 (de SQL o de memoria)
+def _armar_reporte(por_dia, top5, periodo):
+    # Agrupamos los días según el periodo
+    acumulado = {}
+    for fecha, inversion, generado in por_dia:
+        clave = _clave_periodo(como_fecha(fecha), periodo)
+        orden = tuple(clave.values())
+        if orden not in acumulado:
+            acumulado[orden] = {**clave, "inversion": 0.0, "generado": 0.0}
+        acumulado[orden]["inversion"] += float(inversion or 0)
+        acumulado[orden]["generado"] += float(generado or 0)
 
     # Métricas generales
-    inversion_total = float(sum(row.inversion or 0 for row in result))
-    generado_total = float(sum(row.generado or 0 for row in result))
+    inversion_total = float(sum(p["inversion"] for p in acumulado.values()))
+    generado_total = float(sum(p["generado"] for p in acumulado.values()))
     ganancia_neta = generado_total - inversion_total
 
-    # 🔹 Top 5 productos en ese rango
-    stmt_top5 = (
-        select(
-            productos.c.nombre,
-            func.sum(ventas.c.cantidad).label("vendidos")
-        )
-        .select_from(ventas.join(productos, ventas.c.id_producto == productos.c.id_producto))
-        .where(and_(ventas.c.fecha_venta >= desde, ventas.c.fecha_venta <= hasta))
-        .group_by(productos.c.nombre)
-        .order_by(func.sum(ventas.c.cantidad).desc())
-        .limit(5)
-    )
-    top5 = conn.execute(stmt_top5).fetchall()
-
     # Transformamos ventas por periodo a lista de dicts
     ventas_por_periodo = [
         {
-            "periodo": dict(row._mapping),
-            "inversion": float(row.inversion or 0),
-            "generado": float(row.generado or 0),
-            "ganancia_neta": float(row.generado or 0) - float(row.inversion or 0)
+            "periodo": acumulado[orden],
+            "inversion": acumulado[orden]["inversion"],
+            "generado": acumulado[orden]["generado"],
+            "ganancia_neta": acumulado[orden]["generado"] - acumulado[orden]["inversion"]
         }
-        for row in result
+        for orden in sorted(acumulado)
     ]
 
     return {
         "inversion_total": inversion_total,
         "generado_total": generado_total,
         "ganancia_neta": ganancia_neta,
-        "top5": [{"nombre": row.nombre, "vendidos": int(row.vendidos or 0)} for row in top5],
+        "top5": [{"nombre": nombre, "vendidos": int(vendidos or 0)} for nombre, vendidos in top5],
         "ventas_por_periodo": ventas_por_periodo
     }
 
+
+# 🔹 Función auxiliar: calcula el reporte desde el resumen ventas_diarias
+def _calcular_reporte(conn, desde, hasta, periodo):
+    filas = _filas_rango(desde, hasta)
+
+    # 🔹 Totales por día (como mucho un registro por día del rango)
+    stmt = (
+        select(
+            filas.c.fecha,
+            func.sum(filas.c.inversion).label("inversion"),
+            func.sum(filas.c.generado).label("generado")
+        )
+        .group_by(filas.c.fecha)
+    )
+    por_dia = conn.execute(stmt).fetchall()
+
+    # 🔹 Top 5 productos en ese rango (se agrega por producto y después se busca el nombre)
+    por_producto = (
+        select(filas.c.id_producto, func.sum(filas.c.unidades).label("unidades"))
+        .group_by(filas.c.id_producto)
+        .subquery()
+    )
+    vendidos = func.sum(por_producto.c.unidades)
+    stmt_top5 = (
+        select(productos.c.nombre, vendidos.label("vendidos"))
+        .select_from(por_producto.join(productos, por_producto.c.id_producto == productos.c.id_producto))
+        .group_by(productos.c.nombre)
+        .having(vendidos > 0)
+        .order_by(vendidos.desc(), productos.c.nombre)
+        .limit(5)
+    )
+    top5 = conn.execute(stmt_top5).fetchall()
+
+    return _armar_reporte(por_dia, top5, periodo)
+
+
+# 🔹 Función auxiliar: el mismo reporte con el motor en memoria (utils/reportes_memoria.py)
+def _calcular_reporte_memoria(desde, hasta, periodo):
+    por_dia, top5 = reportes_memoria.calcular(desde, hasta, top=5)
+    return _armar_reporte(por_dia, top5, periodo)
+
+
+def _validar_motor(motor):
+    if motor == "memoria" and not reportes_memoria.disponible:
+        raise HTTPException(status_code=400, detail="El motor 'memoria' necesita numpy instalado en el servidor")
+
+
+# 🔹 Reportes por rango de fechas (listo para frontend), con caché
+# La conexión solo se pide si hay que calcular; con DB_MODO=async el cálculo corre sobre el AsyncEngine.
+# motor=memoria calcula sobre la copia de ventas en memoria; los dos motores comparten la caché.
+if modo_async():
+    @router.get("/rango")
+    async def reportes_por_rango(
+        desde: datetime = Query(..., description="Fecha inicio"),
+        hasta: datetime = Query(..., description="Fecha fin"),
+        periodo: str = Query("mes", enum=["dia", "semana", "mes", "anio"]),
+        motor: str = Query(MOTOR_POR_DEFECTO, enum=["sql", "memoria"], description="Motor de cálculo")
+    ):
+        _validar_motor(motor)
+        encontrado, reporte = cache_reportes.obtener(desde, hasta, periodo)
+        if encontrado:
+            return reporte
+
+        generacion = cache_reportes.generacion
+        if motor == "memoria":
+            reporte = await run_in_threadpool(_calcular_reporte_memoria, desde, hasta, periodo)
+        else:
+            async with conexion_async() as conn:
+                reporte = await conn.run_sync(_calcular_reporte, desde, hasta, periodo)
+        cache_reportes.guardar(desde, hasta, periodo, reporte, generacion)
+        return reporte
+else:
+    @router.get("/rango")
+    def reportes_por_rango(
+        desde: datetime = Query(..., description="Fecha inicio"),
+        hasta: datetime = Query(..., description="Fecha fin"),
+        periodo: str = Query("mes", enum=["dia", "semana", "mes", "anio"]),
+        motor: str = Query(MOTOR_POR_DEFECTO, enum=["sql", "memoria"], description="Motor de cálculo")
+    ):
+        _validar_motor(motor)
+        encontrado, reporte = cache_reportes.obtener(desde, hasta, periodo)
+        if encontrado:
+            return reporte
+
+        generacion = cache_reportes.generacion
+        if motor == "memoria":
+            reporte = _calcular_reporte_memoria(desde, hasta, periodo)
+        else:
+            with conexion() as conn:
+                reporte = _calcular_reporte(conn, desde, hasta, periodo)
+        cache_reportes.guardar(desde, hasta, periodo, reporte, generacion)
+        return reporte
+
+
+# 🔹 Estado de la caché de reportes
+@router.get("/cache")
+def estado_cache_reportes():
+    return cache_reportes.estadisticas()
+
+
+# 🔹 Estado del motor en memoria
+@router.get("/memoria")
+def estado_reportes_memoria():
+    return reportes_memoria.estadisticas()
+
 # 🔹 Reiniciar reportes por rango de fechas
 @router.delete("/reiniciar")
 def reiniciar_reportes(
     desde: datetime = Query(..., description="Fecha inicio"),
-    hasta: datetime = Query(..., description="Fecha fin")
+    hasta: datetime = Query(..., description="Fecha fin"),
+    conn: Connection = Depends(get_conn)
 ):
     # Validación de fechas
     if desde > hasta:
@@ -99,7 +234,13 @@ def reiniciar_reportes(
     # Eliminamos las ventas en el rango especificado
     delete_stmt = ventas.delete().where(and_(ventas.c.fecha_venta >= desde, ventas.c.fecha_venta <= hasta))
     result = conn.execute(delete_stmt)
+
+    # Recalculamos el resumen de los días afectados en la misma transacción
+    reconstruir(conn, desde.date(), hasta.date())
+    coherencia.publicar(conn, "reportes", clave_rango(desde, hasta))
     conn.commit()
+    reportes_memoria.eliminar_rango(desde, hasta)
+    cache_reportes.invalidar_rango(desde, hasta)
 
     return {
         "mensaje": f"Se eliminaron {result.rowcount} ventas entre {desde} y {hasta}."
@@ -1,274 +1,413 @@
-from fastapi import APIRouter, HTTPException
-from sqlalchemy import insert, select, update, delete
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy import insert, select, delete
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import SQLAlchemyError
-from backend.config.db import conn
+from sqlalchemy.ext.asyncio import AsyncConnection
+from backend.config.db import get_conn, get_conn_async, modo_async
 from backend.models.venta import ventas
 from backend.models.producto import productos
 from backend.models.historial_ventas import historial_ventas
-from backend.schemas.venta import VentaCreate, VentaResponse
+from backend.schemas.venta import VentaCreate, VentaResponse, VentaLoteResponse
+from backend.utils.paginacion import paginar, cortar_pagina, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from backend.utils.exportacion import respuesta_exportacion
+from backend.utils.json_rapido import SerializadorFilas, respuesta_filas
+from backend.utils.ventas_diarias import acumular, fila_resumen
+from backend.utils.auditoria import auditoria
+from backend.utils.cache_reportes import cache_reportes
+from backend.utils.catalogo import catalogo
+from backend.utils.coherencia import coherencia, clave_ventas
+from backend.utils.reportes_memoria import reportes_memoria
+from backend.utils.ventas_agrupadas import ventas_agrupadas, insertar_ventas
+from backend.utils.stock_fragmentado import descontar, descontar_varios, devolver, disponibles, stock_de
 from datetime import datetime
+from typing import Optional
 import logging
-import traceback
 
-# Configurar logging detallado
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Niveles, formato y muestreo se configuran en utils/logs.py (LOG_LEVEL, LOG_NIVELES, LOG_MUESTREO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/ventas", tags=["Ventas"])
 
+# Columnas por las que se pueden ordenar los listados
+ORDENES_VENTAS = {"id": ventas.c.id_venta, "fecha": ventas.c.fecha_venta}
+ORDENES_HISTORIAL = {"id": historial_ventas.c.id_historial, "fecha": historial_ventas.c.fecha_venta}
+
+# Listados: filas -> JSON sin validar fila por fila (mismo esquema que response_model)
+_serializador_ventas = SerializadorFilas.para_modelo(VentaResponse, ventas)
+_serializador_historial = SerializadorFilas.para_tabla(historial_ventas)
 
-# 🔹 Función auxiliar: registrar en historial (con manejo de errores)
-def _registrar_historial_venta(venta_registro):
-    try:
-        logger.info(f"🔍 Registrando historial para venta: {venta_registro}")
-        
-        # Verificar que venta_registro tenga los atributos necesarios
-        required_attrs = ['id_venta', 'id_producto', 'cantidad', 'precio_unitario', 'precio_total', 'fecha_venta']
-        for attr in required_attrs:
-            if not hasattr(venta_registro, attr):
-                logger.error(f"❌ Atributo faltante en venta_registro: {attr}")
-                return False
-        
-        registro = {
-            "id_venta": venta_registro.id_venta,
-            "id_producto": venta_registro.id_producto,
-            "cantidad": venta_registro.cantidad,
-            "precio_unitario": venta_registro.precio_unitario,
-            "precio_total": venta_registro.precio_total,
-            "fecha_venta": venta_registro.fecha_venta
-        }
-        
-        logger.info(f"🔍 Datos del historial: {registro}")
-        conn.execute(historial_ventas.insert().values(registro))
-        conn.commit()
-        logger.info("✅ Historial registrado exitosamente")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Error registrando historial: {str(e)}")
-        logger.error(f"❌ Traceback completo: {traceback.format_exc()}")
-        return False
 
+# 🔹 Crear venta: descuento de stock atómico y una sola transacción
+def _validar_venta(venta):
+    if not venta.id_producto or venta.id_producto <= 0:
+        raise HTTPException(status_code=400, detail="ID de producto inválido")
+    if not venta.cantidad or venta.cantidad <= 0:
+        raise HTTPException(status_code=400, detail="Cantidad inválida")
+
+
+def _crear_venta(conn, venta):
+    logger.debug("🚀 INICIO - Creando venta", extra={"id_producto": venta.id_producto, "cantidad": venta.cantidad})
 
-# 🔹 Crear venta con manejo de errores exhaustivo
-@router.post("/", response_model=VentaResponse)
-def create_venta(venta: VentaCreate):
-    logger.info(f"🚀 INICIO - Creando venta: {venta.dict()}")
-    
     try:
         # PASO 1: Validar entrada
-        logger.info(f"🔍 PASO 1 - Validando datos de entrada")
-        if not venta.id_producto or venta.id_producto <= 0:
-            raise HTTPException(status_code=400, detail="ID de producto inválido")
-        if not venta.cantidad or venta.cantidad <= 0:
-            raise HTTPException(status_code=400, detail="Cantidad inválida")
-        
-        # PASO 2: Buscar producto
-        logger.info(f"🔍 PASO 2 - Buscando producto ID: {venta.id_producto}")
-        producto = conn.execute(
-            select(productos).where(productos.c.id_producto == venta.id_producto)
-        ).fetchone()
+        _validar_venta(venta)
+
+        # PASO 2: Precio y costo del producto (catálogo en memoria; el stock lo decide el UPDATE)
+        producto = catalogo.obtener(venta.id_producto, conn, con_stock=False)
 
         if not producto:
-            logger.error(f"❌ Producto {venta.id_producto} no encontrado")
+            logger.warning("❌ Producto %s no encontrado", venta.id_producto)
             raise HTTPException(status_code=404, detail="Producto no encontrado")
-        
-        producto_data = dict(producto._mapping)
-        logger.info(f"✅ Producto encontrado: {producto_data}")
 
-        # PASO 3: Verificar stock
-        logger.info(f"🔍 PASO 3 - Verificando stock")
-        stock_actual = producto_data["stock"]
-        logger.info(f"Stock actual: {stock_actual}, Cantidad solicitada: {venta.cantidad}")
-        
-        if stock_actual < venta.cantidad:
-            logger.error(f"❌ Stock insuficiente")
+        precio_unitario = float(producto["precio_venta"])
+        precio_total = precio_unitario * venta.cantidad
+        costo_unitario = float(producto["costo"])
+
+        # PASO 3: Descontar stock solo si alcanza (el rowcount decide; con stock fragmentado, de un fragmento)
+        fragmento = descontar(conn, venta.id_producto, venta.cantidad, producto.get("fragmentos_stock"))
+        if fragmento is None:
+            stock_actual = stock_de(conn, venta.id_producto)
+            logger.warning("❌ Stock insuficiente", extra={
+                "id_producto": venta.id_producto, "disponible": stock_actual, "solicitado": venta.cantidad
+            })
             raise HTTPException(status_code=400, detail=f"Stock insuficiente. Disponible: {stock_actual}, Solicitado: {venta.cantidad}")
 
-        # PASO 4: Calcular precios
-        logger.info(f"🔍 PASO 4 - Calculando precios")
-        precio_unitario = float(producto_data["precio_venta"])
-        precio_total = precio_unitario * venta.cantidad
-        logger.info(f"Precio unitario: {precio_unitario}, Precio total: {precio_total}")
+        logger.debug("PASO 3 - Stock descontado", extra={"id_producto": venta.id_producto})
 
-        # PASO 5: Actualizar stock
-        logger.info(f"🔍 PASO 5 - Actualizando stock")
-        nuevo_stock = stock_actual - venta.cantidad
-        logger.info(f"Nuevo stock será: {nuevo_stock}")
-        
-        conn.execute(
-            update(productos)
-            .where(productos.c.id_producto == venta.id_producto)
-            .values(stock=nuevo_stock)
-        )
-        logger.info("✅ Stock actualizado")
-
-        # PASO 6: Crear registro de venta
-        logger.info(f"🔍 PASO 6 - Insertando venta en BD")
-        fecha_actual = datetime.now()
+        # PASO 4: Insertar venta, historial y resumen diario en la misma transacción
         nueva_venta = {
             "id_producto": venta.id_producto,
             "cantidad": venta.cantidad,
             "precio_unitario": precio_unitario,
             "precio_total": precio_total,
-            "fecha_venta": fecha_actual
+            "fecha_venta": datetime.now(),
+            "costo_unitario": costo_unitario
         }
-        
-        logger.info(f"Datos a insertar: {nueva_venta}")
         result = conn.execute(insert(ventas).values(**nueva_venta))
-        conn.commit()
-        
         venta_id = result.inserted_primary_key[0]
-        logger.info(f"✅ Venta insertada con ID: {venta_id}")
 
-        # PASO 7: Obtener venta creada
-        logger.info(f"🔍 PASO 7 - Obteniendo venta creada")
-        venta_creada = conn.execute(
-            select(ventas).where(ventas.c.id_venta == venta_id)
-        ).fetchone()
-        
-        if not venta_creada:
-            logger.error("❌ No se pudo obtener la venta recién creada")
-            raise HTTPException(status_code=500, detail="Error al obtener venta creada")
-        
-        venta_creada_data = dict(venta_creada._mapping)
-        logger.info(f"✅ Venta creada obtenida: {venta_creada_data}")
-
-        # PASO 8: Registrar en historial (opcional - si falla no interrumpe)
-        logger.info(f"🔍 PASO 8 - Registrando historial")
-        try:
-            _registrar_historial_venta(venta_creada)
-        except Exception as hist_error:
-            logger.warning(f"⚠️ Error en historial (no crítico): {str(hist_error)}")
-
-        # PASO 9: Preparar respuesta
-        logger.info(f"🔍 PASO 9 - Preparando respuesta")
-        respuesta = {
-            "id_venta": venta_id,
-            "id_producto": venta.id_producto,
-            "cantidad": venta.cantidad,
-            "precio_unitario": precio_unitario,
-            "precio_total": precio_total,
-            "fecha_venta": fecha_actual
-        }
-        
-        logger.info(f"✅ Respuesta preparada: {respuesta}")
-        logger.info(f"🎉 ÉXITO - Venta creada exitosamente")
-        
-        return respuesta
+        auditoria.registrar(conn, historial_ventas, {"id_venta": venta_id, **nueva_venta})
+        acumular(conn, [fila_resumen(
+            nueva_venta["fecha_venta"], venta.id_producto, venta.cantidad, precio_total, costo_unitario, fragmento
+        )])
+        coherencia.publicar(conn, "ventas", clave_ventas(nueva_venta["fecha_venta"], [venta.id_producto]))
+        conn.commit()
+        cache_reportes.invalidar_fecha(nueva_venta["fecha_venta"])
+        catalogo.stock_modificado([venta.id_producto])
+
+        logger.info("🎉 Venta creada", extra={
+            "id_venta": venta_id, "id_producto": venta.id_producto, "cantidad": venta.cantidad
+        })
+        return {"id_venta": venta_id, **nueva_venta}
 
     except HTTPException as he:
-        logger.error(f"❌ HTTPException: {he.detail}")
+        logger.debug("Venta rechazada: %s", he.detail, extra={"status": he.status_code})
         conn.rollback()
         raise he
-        
+
     except SQLAlchemyError as se:
-        logger.error(f"❌ Error de base de datos: {str(se)}")
-        logger.error(f"❌ Traceback SQLAlchemy: {traceback.format_exc()}")
+        # El traceback se formatea en el hilo de logs, no en el del request
+        logger.exception("❌ Error de base de datos creando venta")
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {str(se)}")
-        
+
     except Exception as e:
-        logger.error(f"❌ Error inesperado: {str(e)}")
-        logger.error(f"❌ Traceback completo: {traceback.format_exc()}")
+        logger.exception("❌ Error inesperado creando venta")
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 
-# 🔹 Listar todas las ventas
-@router.get("/", response_model=list[VentaResponse])
-def listar_ventas():
+# VENTAS_AGRUPADAS=1: la venta se encola y un solo escritor confirma varias por commit (utils/ventas_agrupadas.py)
+# DB_MODO=async: el mismo código corre sobre el AsyncEngine (run_sync), sin ocupar un hilo del threadpool
+if ventas_agrupadas.activo:
+    @router.post("/", response_model=VentaResponse)
+    async def create_venta(venta: VentaCreate):
+        _validar_venta(venta)
+        return await ventas_agrupadas.crear(venta)
+elif modo_async():
+    @router.post("/", response_model=VentaResponse)
+    async def create_venta(venta: VentaCreate, conn: AsyncConnection = Depends(get_conn_async)):
+        return await conn.run_sync(_crear_venta, venta)
+else:
+    @router.post("/", response_model=VentaResponse)
+    def create_venta(venta: VentaCreate, conn: Connection = Depends(get_conn)):
+        return _crear_venta(conn, venta)
+
+
+# 🔹 Estado del group commit de ventas
+@router.get("/agrupadas")
+def estado_ventas_agrupadas():
+    return ventas_agrupadas.estadisticas()
+
+
+# 🔹 Checkout de carrito: varias líneas, todo o nada, un solo commit
+@router.post("/lote", response_model=VentaLoteResponse)
+def create_ventas_lote(lineas: list[VentaCreate], conn: Connection = Depends(get_conn)):
+    logger.debug("🚀 INICIO - Creando lote", extra={"lineas": len(lineas)})
+
+    if not lineas:
+        raise HTTPException(status_code=400, detail="El lote no tiene líneas")
+    for i, linea in enumerate(lineas, start=1):
+        if not linea.id_producto or linea.id_producto <= 0:
+            raise HTTPException(status_code=400, detail=f"Línea {i}: ID de producto inválido")
+        if not linea.cantidad or linea.cantidad <= 0:
+            raise HTTPException(status_code=400, detail=f"Línea {i}: Cantidad inválida")
+
+    # Cantidad total pedida por producto
+    pedidos = {}
+    for linea in lineas:
+        pedidos[linea.id_producto] = pedidos.get(linea.id_producto, 0) + linea.cantidad
+    ids = sorted(pedidos)
+
     try:
-        logger.info("🔍 Obteniendo todas las ventas")
-        result = conn.execute(select(ventas)).fetchall()
-        ventas_list = [dict(row._mapping) for row in result]
-        logger.info(f"✅ {len(ventas_list)} ventas obtenidas")
-        return ventas_list
+        # PASO 1: Bloquear los productos siempre en el mismo orden (evita deadlocks entre lotes)
+        filas = conn.execute(
+            select(productos.c.id_producto, productos.c.precio_venta, productos.c.costo, productos.c.stock,
+                   productos.c.fragmentos_stock)
+            .where(productos.c.id_producto.in_(ids))
+            .order_by(productos.c.id_producto)
+            .with_for_update()
+        ).fetchall()
+        encontrados = {fila.id_producto: fila for fila in filas}
+
+        faltantes = [id_producto for id_producto in ids if id_producto not in encontrados]
+        if faltantes:
+            raise HTTPException(status_code=404, detail=f"Productos no encontrados: {faltantes}")
+
+        stock = disponibles(conn, filas)
+        sin_stock = [
+            f"producto {id_producto} (disponible: {stock[id_producto]}, solicitado: {cantidad})"
+            for id_producto, cantidad in pedidos.items()
+            if stock[id_producto] < cantidad
+        ]
+        if sin_stock:
+            raise HTTPException(status_code=400, detail=f"Stock insuficiente para {', '.join(sin_stock)}")
+
+        # PASO 2: Descontar todo el stock con una sola sentencia (los fragmentados, de sus fragmentos)
+        descontar_varios(conn, pedidos, filas)
+
+        # PASO 3: Insertar ventas e historial
+        fecha_actual = datetime.now()
+        nuevas_ventas = []
+        for linea in lineas:
+            precio_unitario = float(encontrados[linea.id_producto].precio_venta)
+            nuevas_ventas.append({
+                "id_producto": linea.id_producto,
+                "cantidad": linea.cantidad,
+                "precio_unitario": precio_unitario,
+                "precio_total": precio_unitario * linea.cantidad,
+                "fecha_venta": fecha_actual,
+                "costo_unitario": float(encontrados[linea.id_producto].costo)
+            })
+        ids_venta = insertar_ventas(conn, nuevas_ventas)
+
+        registros = [{"id_venta": id_venta, **fila} for id_venta, fila in zip(ids_venta, nuevas_ventas)]
+        auditoria.registrar(conn, historial_ventas, registros)
+        acumular(conn, [
+            fila_resumen(fecha_actual, fila["id_producto"], fila["cantidad"], fila["precio_total"],
+                         fila["costo_unitario"])
+            for fila in nuevas_ventas
+        ])
+        coherencia.publicar(conn, "ventas", clave_ventas(fecha_actual, ids))
+        conn.commit()
+        cache_reportes.invalidar_fecha(fecha_actual)
+        catalogo.stock_modificado(ids)
+
+        logger.info("🎉 Lote de ventas creado", extra={"ventas": len(registros), "productos": len(ids)})
+        return {
+            "ventas": registros,
+            "cantidad_total": sum(fila["cantidad"] for fila in registros),
+            "precio_total": sum(fila["precio_total"] for fila in registros)
+        }
+
+    except HTTPException as he:
+        logger.debug("Lote rechazado: %s", he.detail, extra={"status": he.status_code})
+        conn.rollback()
+        raise he
+
+    except SQLAlchemyError as se:
+        logger.exception("❌ Error de base de datos creando lote")
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error de base de datos: {str(se)}")
+
+
+# 🔹 Función auxiliar: filtros comunes de ventas / historial
+def _filtrar_ventas(stmt, tabla, desde, hasta, id_producto):
+    if desde is not None:
+        stmt = stmt.where(tabla.c.fecha_venta >= desde)
+    if hasta is not None:
+        stmt = stmt.where(tabla.c.fecha_venta <= hasta)
+    if id_producto is not None:
+        stmt = stmt.where(tabla.c.id_producto == id_producto)
+    return stmt
+
+
+# 🔹 Listar ventas (paginado por cursor; el siguiente va en X-Next-Cursor)
+def _listar_ventas(conn, desde, hasta, id_producto, orden, direccion, cursor, limite):
+    try:
+        stmt = _filtrar_ventas(select(*_serializador_ventas.columnas), ventas, desde, hasta, id_producto)
+        columna = ORDENES_VENTAS[orden]
+        stmt = paginar(stmt, columna, ventas.c.id_venta, cursor, limite, direccion == "desc")
+        filas, siguiente = cortar_pagina(conn.execute(stmt).fetchall(), limite, columna, ventas.c.id_venta)
+
+        return respuesta_filas(_serializador_ventas, filas, {"X-Next-Cursor": siguiente} if siguiente else None)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Error listando ventas: {str(e)}")
+        logger.exception("❌ Error listando ventas")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+if modo_async():
+    @router.get("/", response_model=list[VentaResponse])
+    async def listar_ventas(
+        desde: Optional[datetime] = Query(None, description="Fecha inicio"),
+        hasta: Optional[datetime] = Query(None, description="Fecha fin"),
+        id_producto: Optional[int] = Query(None),
+        orden: str = Query("id", enum=list(ORDENES_VENTAS)),
+        direccion: str = Query("asc", enum=["asc", "desc"]),
+        cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+        limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+        conn: AsyncConnection = Depends(get_conn_async)
+    ):
+        return await conn.run_sync(_listar_ventas, desde, hasta, id_producto, orden, direccion, cursor, limite)
+else:
+    @router.get("/", response_model=list[VentaResponse])
+    def listar_ventas(
+        desde: Optional[datetime] = Query(None, description="Fecha inicio"),
+        hasta: Optional[datetime] = Query(None, description="Fecha fin"),
+        id_producto: Optional[int] = Query(None),
+        orden: str = Query("id", enum=list(ORDENES_VENTAS)),
+        direccion: str = Query("asc", enum=["asc", "desc"]),
+        cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+        limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+        conn: Connection = Depends(get_conn)
+    ):
+        return _listar_ventas(conn, desde, hasta, id_producto, orden, direccion, cursor, limite)
+
+
+# 🔹 Exportar ventas completas (CSV / NDJSON en streaming)
+@router.get("/export")
+def exportar_ventas(
+    formato: str = Query("csv", enum=["csv", "ndjson"]),
+    desde: Optional[datetime] = Query(None, description="Fecha inicio"),
+    hasta: Optional[datetime] = Query(None, description="Fecha fin"),
+    id_producto: Optional[int] = Query(None),
+    comprimir: bool = Query(False, description="Devolver el archivo en gzip")
+):
+    stmt = _filtrar_ventas(select(ventas), ventas, desde, hasta, id_producto).order_by(ventas.c.id_venta)
+    return respuesta_exportacion(stmt, "ventas", formato, comprimir)
+
+
 # 🔹 Obtener venta por ID
 @router.get("/{id_venta}", response_model=VentaResponse)
-def obtener_venta(id_venta: int):
+def obtener_venta(id_venta: int, conn: Connection = Depends(get_conn)):
     try:
-        logger.info(f"🔍 Obteniendo venta ID: {id_venta}")
+        logger.debug("🔍 Obteniendo venta %s", id_venta)
         venta = conn.execute(
             select(ventas).where(ventas.c.id_venta == id_venta)
         ).fetchone()
         
         if not venta:
-            logger.error(f"❌ Venta {id_venta} no encontrada")
+            logger.debug("❌ Venta %s no encontrada", id_venta)
             raise HTTPException(status_code=404, detail="Venta no encontrada")
-        
-        venta_data = dict(venta._mapping)
-        logger.info(f"✅ Venta obtenida: {venta_data}")
-        return venta_data
+
+        return dict(venta._mapping)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error obteniendo venta: {str(e)}")
+        logger.exception("❌ Error obteniendo venta %s", id_venta)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# 🔹 Consultar historial de ventas
+# 🔹 Consultar historial de ventas (paginado por cursor)
 @router.get("/historial/", tags=["Historial"])
-def historial():
+def historial(
+    desde: Optional[datetime] = Query(None, description="Fecha inicio"),
+    hasta: Optional[datetime] = Query(None, description="Fecha fin"),
+    id_producto: Optional[int] = Query(None),
+    orden: str = Query("id", enum=list(ORDENES_HISTORIAL)),
+    direccion: str = Query("asc", enum=["asc", "desc"]),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    conn: Connection = Depends(get_conn)
+):
     try:
-        logger.info("🔍 Obteniendo historial de ventas")
-        result = conn.execute(select(historial_ventas)).fetchall()
-        historial_list = [dict(row._mapping) for row in result]
-        logger.info(f"✅ {len(historial_list)} registros de historial obtenidos")
-        return historial_list
+        stmt = _filtrar_ventas(select(historial_ventas), historial_ventas, desde, hasta, id_producto)
+        columna = ORDENES_HISTORIAL[orden]
+        stmt = paginar(stmt, columna, historial_ventas.c.id_historial, cursor, limite, direccion == "desc")
+        filas, siguiente = cortar_pagina(conn.execute(stmt).fetchall(), limite, columna, historial_ventas.c.id_historial)
+
+        return respuesta_filas(_serializador_historial, filas, {"X-Next-Cursor": siguiente} if siguiente else None)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Error obteniendo historial: {str(e)}")
+        logger.exception("❌ Error obteniendo historial")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 🔹 Exportar historial de ventas (CSV / NDJSON en streaming)
+@router.get("/historial/export", tags=["Historial"])
+def exportar_historial(
+    formato: str = Query("csv", enum=["csv", "ndjson"]),
+    desde: Optional[datetime] = Query(None, description="Fecha inicio"),
+    hasta: Optional[datetime] = Query(None, description="Fecha fin"),
+    id_producto: Optional[int] = Query(None),
+    comprimir: bool = Query(False, description="Devolver el archivo en gzip")
+):
+    stmt = _filtrar_ventas(select(historial_ventas), historial_ventas, desde, hasta, id_producto)
+    stmt = stmt.order_by(historial_ventas.c.id_historial)
+    return respuesta_exportacion(stmt, "historial_ventas", formato, comprimir)
+
+
 # 🔹 Eliminar una venta
 @router.delete("/{id_venta}")
-def eliminar_venta(id_venta: int):
+def eliminar_venta(id_venta: int, conn: Connection = Depends(get_conn)):
     try:
-        logger.info(f"🔍 Eliminando venta ID: {id_venta}")
-        
+        logger.debug("🔍 Eliminando venta %s", id_venta)
+
         venta = conn.execute(
-            select(ventas).where(ventas.c.id_venta == id_venta)
+            select(
+                ventas.c.id_producto, ventas.c.cantidad, ventas.c.precio_total,
+                ventas.c.fecha_venta, ventas.c.costo_unitario, productos.c.fragmentos_stock
+            )
+            .select_from(ventas.outerjoin(productos, ventas.c.id_producto == productos.c.id_producto))
+            .where(ventas.c.id_venta == id_venta)
+            # Dos DELETE concurrentes de la misma venta: el segundo espera y ya no la encuentra
+            .with_for_update(of=ventas)
         ).fetchone()
 
-        if not venta:
-            logger.error(f"❌ Venta {id_venta} no encontrada")
+        # Primero se borra: solo quien borró la fila devuelve el stock y la descuenta del resumen
+        borradas = conn.execute(delete(ventas).where(ventas.c.id_venta == id_venta)).rowcount if venta else 0
+        if borradas != 1:
+            conn.rollback()
+            logger.warning("❌ Venta %s no encontrada", id_venta)
             raise HTTPException(status_code=404, detail="Venta no encontrada")
 
-        # Restaurar stock
-        logger.info("🔍 Restaurando stock")
-        producto = conn.execute(
-            select(productos).where(productos.c.id_producto == venta.id_producto)
-        ).fetchone()
+        # Restaurar stock con un incremento atómico (sin leer el producto)
+        devolver(conn, venta.id_producto, venta.cantidad, venta.fragmentos_stock)
 
-        if producto:
-            stock_actual = producto._mapping["stock"]
-            nuevo_stock = stock_actual + venta.cantidad
-            conn.execute(
-                update(productos)
-                .where(productos.c.id_producto == venta.id_producto)
-                .values(stock=nuevo_stock)
-            )
-            logger.info(f"✅ Stock restaurado: {stock_actual} + {venta.cantidad} = {nuevo_stock}")
-
-        # Eliminar la venta
-        conn.execute(delete(ventas).where(ventas.c.id_venta == id_venta))
+        # Descontarla del resumen diario igual que la cuenta reconstruir (sin costo ni cantidad, 0)
+        if venta.fecha_venta is not None and venta.id_producto is not None:
+            acumular(conn, [fila_resumen(
+                venta.fecha_venta, venta.id_producto, -(venta.cantidad or 0), -(venta.precio_total or 0),
+                venta.costo_unitario
+            )])
+        # Antes que "ventas": los demás workers sacan la venta de memoria antes de invalidar sus reportes
+        coherencia.publicar(conn, "venta_eliminada", str(id_venta))
+        coherencia.publicar(conn, "ventas", clave_ventas(venta.fecha_venta, [venta.id_producto]))
         conn.commit()
-        
-        logger.info(f"✅ Venta {id_venta} eliminada exitosamente")
+        reportes_memoria.eliminar(id_venta)
+        if venta.fecha_venta is not None:
+            cache_reportes.invalidar_fecha(venta.fecha_venta)
+        catalogo.stock_modificado([venta.id_producto])
+
+        logger.info("✅ Venta eliminada", extra={"id_venta": id_venta, "id_producto": venta.id_producto})
         return {"mensaje": f"Venta {id_venta} eliminada correctamente y stock restaurado"}
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error eliminando venta: {str(e)}")
+        logger.exception("❌ Error eliminando venta %s", id_venta)
         conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
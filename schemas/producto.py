@@ -30,6 +30,8 @@ class ProductoResponse(BaseModel):
     precio_venta: float
     stock: int
     imagen_url: Optional[str] = None
+    imagen_estado: Optional[str] = None          # pendiente / lista / error
+    imagen_variantes: Optional[dict[str, str]] = None  # thumb / card / full
     inversion_acumulada: Optional[float] = None  # 🔥 Agregado
     activo: Optional[bool] = None                # 🔥 Agregado
     fecha_registro: Optional[datetime] = None
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Optional
 
 class VentaCreate(BaseModel):
     id_producto: int
@@ -12,7 +13,13 @@ class VentaResponse(BaseModel):
     precio_total: float
     precio_unitario: float
     fecha_venta: datetime
+    costo_unitario: Optional[float] = None  # costo del producto al momento de la venta
     # fecha: datetime  ← ELIMINAR ESTA LÍNEA (campo duplicado)
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class VentaLoteResponse(BaseModel):
+    ventas: list[VentaResponse]
+    cantidad_total: int
+    precio_total: float
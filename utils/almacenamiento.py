@@ -0,0 +1,68 @@
+import os
+import re
+import shutil
+
+
+class Almacenamiento:
+    """
+    Destino final de las imágenes. `subir` recibe la ruta de un archivo local
+    y devuelve la URL pública.
+    """
+
+    def subir(self, ruta, nombre):
+        raise NotImplementedError
+
+    def eliminar(self, url):
+        """Borra una imagen ya subida. Devuelve False si este backend no sabe borrarla."""
+        return False
+
+
+class AlmacenamientoCloudinary(Almacenamiento):
+    def subir(self, ruta, nombre):
+        # Import perezoso: el backend local no necesita el SDK de Cloudinary
+        from backend.utils.cloudinary_service import upload_image
+
+        with open(ruta, "rb") as archivo:
+            return upload_image(archivo)
+
+    def eliminar(self, url):
+        import cloudinary.uploader
+
+        # .../image/upload/v123/<public_id>.<ext>
+        partes = url.split("/upload/", 1)
+        if len(partes) != 2:
+            return False
+        ruta = partes[1].split("/", 1)[1] if re.match(r"v\d+/", partes[1]) else partes[1]
+        public_id = os.path.splitext(ruta)[0]
+        return cloudinary.uploader.destroy(public_id).get("result") == "ok"
+
+
+class AlmacenamientoLocal(Almacenamiento):
+    """Copia a una carpeta servida por la app (por defecto uploads/imagenes). Útil en desarrollo y pruebas."""
+
+    def __init__(self, carpeta=os.path.join("uploads", "imagenes"), url_base="/uploads/imagenes"):
+        self.carpeta = carpeta
+        self.url_base = url_base.rstrip("/")
+
+    def subir(self, ruta, nombre):
+        os.makedirs(self.carpeta, exist_ok=True)
+        shutil.copyfile(ruta, os.path.join(self.carpeta, nombre))
+        return f"{self.url_base}/{nombre}"
+
+    def eliminar(self, url):
+        if not url.startswith(self.url_base + "/"):
+            return False
+        try:
+            os.remove(os.path.join(self.carpeta, os.path.basename(url)))
+        except FileNotFoundError:
+            pass
+        return True
+
+
+def crear_almacenamiento(tipo=None):
+    tipo = tipo or os.getenv("IMAGENES_ALMACENAMIENTO", "cloudinary")
+    if tipo == "local":
+        return AlmacenamientoLocal(url_base=os.getenv("IMAGENES_URL_BASE", "/uploads/imagenes"))
+    if tipo == "cloudinary":
+        return AlmacenamientoCloudinary()
+    raise ValueError(f"IMAGENES_ALMACENAMIENTO desconocido: {tipo}")
@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from backend.config.db import conexion
+
+logger = logging.getLogger(__name__)
+
+_PENDIENTES = "auditoria_pendiente"
+
+
+class Auditoria:
+    """
+    Escritura de los historiales (historial_productos, historial_ventas).
+
+    - "transaccional" (por defecto): la fila va en la misma transacción que la
+      escritura de negocio; sin commit propio.
+    - "diferida": las filas se juntan en memoria al hacer commit la transacción
+      que las generó (si hace rollback se descartan) y se insertan en lotes de
+      varias filas cada `max_lote` filas o `intervalo` segundos. Un corte del
+      proceso puede perder como mucho lo que no se haya volcado.
+    """
+
+    def __init__(self, modo="transaccional", max_lote=500, intervalo=1.0, max_pendientes=50000):
+        if modo not in ("transaccional", "diferida"):
+            raise ValueError(f"AUDITORIA_MODO desconocido: {modo}")
+        self.modo = modo
+        self.max_lote = max_lote
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._volcado = threading.Lock()
+        self._hay_trabajo = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.volcadas = 0
+        self.descartadas = 0
+
+    def registrar(self, conn, tabla, registros):
+        """registros: un dict o una lista de dicts con las columnas de `tabla`."""
+        if isinstance(registros, dict):
+            registros = [registros]
+        if not registros:
+            return
+        if self.modo == "transaccional":
+            conn.execute(insert(tabla), registros)
+            return
+        conn.info.setdefault(_PENDIENTES, []).extend((tabla, registro) for registro in registros)
+
+    # 🔹 Modo diferido
+    def _confirmadas(self, filas):
+        with self._lock:
+            self._buffer.extend(filas)
+            sobrantes = len(self._buffer) - self.max_pendientes
+            if sobrantes > 0:
+                # La BD no acepta los volcados: se pierde lo más viejo antes que la memoria
+                del self._buffer[:sobrantes]
+                self.descartadas += sobrantes
+                logger.error("Auditoría: se descartaron %s filas por acumulación", sobrantes)
+            lleno = len(self._buffer) >= self.max_lote
+        self._iniciar()
+        if lleno:
+            self._hay_trabajo.set()
+
+    def _iniciar(self):
+        if self._hilo is not None:
+            return
+        with self._lock:
+            # El hilo nace en el proceso que atiende (después del fork si hay varios workers)
+            if self._hilo is None:
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._bucle, name="auditoria", daemon=True)
+                self._hilo.start()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._hay_trabajo.wait(self.intervalo)
+            self._hay_trabajo.clear()
+            self.volcar()
+
+    def volcar(self):
+        """Inserta todo lo acumulado (un INSERT de varias filas por tabla y lote)."""
+        with self._volcado:
+            with self._lock:
+                filas, self._buffer = self._buffer, []
+            if not filas:
+                return 0
+
+            grupos = {}
+            for tabla, registro in filas:
+                grupos.setdefault((tabla, tuple(sorted(registro))), []).append(registro)
+            try:
+                with conexion() as conn:
+                    for (tabla, _), registros in grupos.items():
+                        for inicio in range(0, len(registros), self.max_lote):
+                            conn.execute(insert(tabla), registros[inicio:inicio + self.max_lote])
+                    conn.commit()
+            except SQLAlchemyError as e:
+                logger.error("Auditoría: no se pudieron volcar %s filas, se reintenta: %s", len(filas), e)
+                with self._lock:
+                    self._buffer[:0] = filas
+                return 0
+            self.volcadas += len(filas)
+            return len(filas)
+
+    def detener(self):
+        """Vuelca lo pendiente y para el hilo (llamar al apagar)."""
+        self._detener.set()
+        self._hay_trabajo.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self.intervalo * 2 + 5)
+            self._hilo = None
+        self.volcar()
+
+    def estadisticas(self):
+        return {
+            "modo": self.modo,
+            "pendientes": len(self._buffer),
+            "volcadas": self.volcadas,
+            "descartadas": self.descartadas
+        }
+
+
+auditoria = Auditoria(
+    modo=os.getenv("AUDITORIA_MODO", "transaccional"),
+    max_lote=int(os.getenv("AUDITORIA_MAX_LOTE", "500")),
+    intervalo=float(os.getenv("AUDITORIA_INTERVALO", "1"))
+)
+
+
+# 🔹 Las filas diferidas solo se aceptan si la transacción que las generó hace commit
+@event.listens_for(Engine, "commit")
+def _al_confirmar(conn):
+    filas = conn.info.pop(_PENDIENTES, None)
+    if filas:
+        auditoria._confirmadas(filas)
+
+
+@event.listens_for(Engine, "rollback")
+def _al_deshacer(conn):
+    conn.info.pop(_PENDIENTES, None)
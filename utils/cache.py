@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class BackendCache:
+    """
+    Interfaz mínima de un almacén de caché. Cualquier backend (memoria, Redis, ...)
+    que implemente estos métodos se puede usar en su lugar.
+    """
+
+    def obtener(self, clave):
+        """Devuelve (encontrado, valor)."""
+        raise NotImplementedError
+
+    def guardar(self, clave, valor, ttl=None):
+        """ttl en segundos; None = sin vencimiento."""
+        raise NotImplementedError
+
+    def eliminar(self, clave):
+        raise NotImplementedError
+
+    def claves(self):
+        raise NotImplementedError
+
+    def limpiar(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.claves())
+
+
+class CacheLRU(BackendCache):
+    """
+    Caché en memoria del proceso, acotada por número de entradas (LRU) y con TTL por entrada.
+    """
+
+    def __init__(self, max_entradas=256):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return False, None
+            valor, vence = entrada
+            if vence is not None and vence < time.monotonic():
+                del self._datos[clave]
+                return False, None
+            self._datos.move_to_end(clave)
+            return True, valor
+
+    def guardar(self, clave, valor, ttl=None):
+        vence = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._datos[clave] = (valor, vence)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def claves(self):
+        with self._lock:
+            return list(self._datos)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from backend.utils.cache import CacheLRU
+from backend.utils.coherencia import coherencia, leer_clave_ventas, leer_clave_rango
+
+
+class CacheReportes:
+    """
+    Caché de GET /reportes/rango por (desde, hasta, periodo).
+
+    - Rangos cerrados (hasta < ahora) no vencen: solo se invalidan por escrituras.
+    - Rangos abiertos vencen a los `ttl_abierto` segundos como red de seguridad.
+    - Cada invalidación sube `generacion` y queda anotada con su rango; un
+      resultado calculado antes de una invalidación que se cruza con su rango no
+      se guarda (evita cachear datos de antes del commit). Las que no se cruzan
+      (p. ej. una venta de hoy y un rango del año pasado) no lo descartan.
+    """
+
+    def __init__(self, backend=None, ttl_abierto=30, max_invalidaciones=1024):
+        self.backend = backend if backend is not None else CacheLRU()
+        self.ttl_abierto = ttl_abierto
+        self.generacion = 0
+        # (generacion, inicio, fin) de las últimas invalidaciones; inicio None = todo
+        self._invalidaciones = deque(maxlen=max_invalidaciones)
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _local(fecha):
+        # Fechas con zona horaria -> hora local sin zona, como se guardan en la BD
+        return fecha.astimezone().replace(tzinfo=None) if fecha.tzinfo else fecha
+
+    def clave(self, desde, hasta, periodo):
+        return (self._local(desde), self._local(hasta), periodo)
+
+    def obtener(self, desde, hasta, periodo):
+        encontrado, valor = self.backend.obtener(self.clave(desde, hasta, periodo))
+        with self._lock:
+            if encontrado:
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+        return encontrado, valor
+
+    def guardar(self, desde, hasta, periodo, valor, generacion):
+        """`generacion` es la leída antes de calcular `valor`."""
+        ttl = None if self._local(hasta) < datetime.now() else self.ttl_abierto
+        with self._lock:
+            if self._vigente(self._local(desde), self._local(hasta), generacion):
+                self.backend.guardar(self.clave(desde, hasta, periodo), valor, ttl)
+
+    def _vigente(self, inicio, fin, generacion):
+        # Ninguna invalidación posterior a `generacion` toca [inicio, fin] (llamar con el lock)
+        if generacion == self.generacion:
+            return True
+        if not self._invalidaciones or self._invalidaciones[0][0] > generacion + 1:
+            return False  # ya no están anotadas todas las posteriores
+        for numero, desde, hasta in reversed(self._invalidaciones):
+            if numero <= generacion:
+                break
+            if desde is None or (desde <= fin and hasta >= inicio):
+                return False
+        return True
+
+    def invalidar_rango(self, desde, hasta):
+        """Descarta los reportes cuyo rango se cruza con [desde, hasta]."""
+        inicio, fin = self._local(desde), self._local(hasta)
+        with self._lock:
+            self.generacion += 1
+            self._invalidaciones.append((self.generacion, inicio, fin))
+        for clave in self.backend.claves():
+            if clave[0] <= fin and clave[1] >= inicio:
+                self.backend.eliminar(clave)
+
+    def invalidar_fecha(self, fecha):
+        self.invalidar_rango(fecha, fecha)
+
+    def limpiar(self):
+        with self._lock:
+            self.generacion += 1
+            self._invalidaciones.append((self.generacion, None, None))
+        self.backend.limpiar()
+
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / total if total else 0.0,
+            "entradas": len(self.backend),
+            "generacion": self.generacion
+        }
+
+
+cache_reportes = CacheReportes(
+    CacheLRU(max_entradas=int(os.getenv("REPORTES_CACHE_MAX", "256"))),
+    ttl_abierto=float(os.getenv("REPORTES_CACHE_TTL", "30"))
+)
+
+
+# 🔹 Cambios hechos por otros workers
+def _ventas_cambiadas(clave):
+    fecha = leer_clave_ventas(clave)[0] if clave else None
+    if fecha is None:
+        cache_reportes.limpiar()
+    else:
+        cache_reportes.invalidar_fecha(fecha)
+
+
+def _reportes_cambiados(clave):
+    if clave is None:
+        cache_reportes.limpiar()
+    else:
+        cache_reportes.invalidar_rango(*leer_clave_rango(clave))
+
+
+coherencia.suscribir("ventas", _ventas_cambiadas)
+coherencia.suscribir("reportes", _reportes_cambiados)
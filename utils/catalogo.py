@@ -0,0 +1,143 @@
+import hashlib
+import os
+import threading
+
+from fastapi import Response
+from sqlalchemy import select
+
+from backend.config.db import conexion
+from backend.models.producto import productos
+from backend.utils.cache import CacheLRU
+from backend.utils.coherencia import coherencia, leer_clave_ventas
+from backend.utils.stock_fragmentado import columnas_producto
+
+
+class CatalogoProductos:
+    """
+    Caché de lectura de productos por id_producto, más las respuestas ya
+    serializadas de los listados.
+
+    `version` sube con cada escritura sobre productos (incluido el stock de las
+    ventas) y forma parte de la clave de las respuestas cacheadas. Los ETag son
+    un hash del cuerpo: iguales en todos los workers para los mismos datos.
+    `version_productos` sube solo con las escrituras que no son ventas (altas,
+    ediciones, bajas).
+    """
+
+    def __init__(self, max_productos=10000, max_respuestas=64):
+        self.max_productos = max_productos
+        self._filas = CacheLRU(max_productos)
+        self._respuestas = CacheLRU(max_respuestas)
+        # Productos cuyo stock cambió desde que se cachearon (precio / costo siguen valiendo)
+        self._stock_vencido = set()
+        self.version = 0
+        self.version_productos = 0
+        self._lock = threading.Lock()
+
+    # 🔹 ETag (hash del contenido) y clave de las respuestas cacheadas
+    @staticmethod
+    def etag(cuerpo):
+        return f'"{hashlib.sha1(cuerpo).hexdigest()[:32]}"'
+
+    def clave(self, *partes):
+        # Con la versión de antes de consultar: lo leído antes de una invalidación no se reutiliza
+        return (self.version, partes)
+
+    @staticmethod
+    def coincide(if_none_match, etag):
+        if not if_none_match:
+            return False
+        candidatos = [valor.strip() for valor in if_none_match.split(",")]
+        return "*" in candidatos or etag in candidatos
+
+    @staticmethod
+    def no_modificado(etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # 🔹 Filas por id
+    def obtener(self, id_producto, conn=None, con_stock=True):
+        """
+        Read-through por id. Con con_stock=False se acepta una fila cuyo stock
+        ya no está al día (basta para leer precio y costo).
+        """
+        encontrado, fila = self._filas.obtener(id_producto)
+        if encontrado and (not con_stock or id_producto not in self._stock_vencido):
+            return fila
+
+        version = self.version
+        if conn is None:
+            with conexion() as conn:
+                row = conn.execute(select(*columnas_producto()).where(productos.c.id_producto == id_producto)).fetchone()
+        else:
+            row = conn.execute(select(*columnas_producto()).where(productos.c.id_producto == id_producto)).fetchone()
+        if row is None:
+            return None
+
+        fila = dict(row._mapping)
+        with self._lock:
+            if version == self.version:
+                self._filas.guardar(id_producto, fila)
+                self._stock_vencido.discard(id_producto)
+        return fila
+
+    def precargar(self):
+        with conexion() as conn:
+            result = conn.execute(
+                select(*columnas_producto()).order_by(productos.c.id_producto).limit(self.max_productos)
+            )
+            for row in result:
+                self._filas.guardar(row.id_producto, dict(row._mapping))
+        return len(self._filas)
+
+    # 🔹 Respuestas serializadas de listados
+    def respuesta(self, clave):
+        return self._respuestas.obtener(clave)
+
+    def guardar_respuesta(self, clave, cuerpo, cabeceras):
+        self._respuestas.guardar(clave, (cuerpo, cabeceras))
+
+    # 🔹 Invalidación (llamar después del commit)
+    def invalidar(self, id_producto=None):
+        with self._lock:
+            self.version += 1
+            self.version_productos += 1
+            if id_producto is None:
+                self._filas.limpiar()
+                self._stock_vencido.clear()
+            else:
+                self._filas.eliminar(id_producto)
+                self._stock_vencido.discard(id_producto)
+            self._respuestas.limpiar()
+
+    def stock_modificado(self, ids_producto):
+        """Una venta movió el stock: el precio cacheado sigue sirviendo, el stock no."""
+        with self._lock:
+            self.version += 1
+            self._stock_vencido.update(ids_producto)
+            self._respuestas.limpiar()
+
+    def estadisticas(self):
+        return {"version": self.version, "productos": len(self._filas), "respuestas": len(self._respuestas)}
+
+
+catalogo = CatalogoProductos(
+    max_productos=int(os.getenv("CATALOGO_MAX_PRODUCTOS", "10000")),
+    max_respuestas=int(os.getenv("CATALOGO_MAX_RESPUESTAS", "64"))
+)
+
+
+# 🔹 Cambios hechos por otros workers
+def _producto_cambiado(clave):
+    catalogo.invalidar(int(clave) if clave else None)
+
+
+def _ventas_cambiadas(clave):
+    ids_producto = leer_clave_ventas(clave)[1] if clave else None
+    if ids_producto is None:
+        catalogo.invalidar()
+    else:
+        catalogo.stock_modificado(ids_producto)
+
+
+coherencia.suscribir("producto", _producto_cambiado)
+coherencia.suscribir("ventas", _ventas_cambiadas)
@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from backend.config.db import conexion
+from backend.models.cambio import cambios
+
+logger = logging.getLogger(__name__)
+
+
+class Coherencia:
+    """
+    Canal de invalidación entre workers usando solo la BD.
+
+    Cada escritura inserta una fila en `cambios` dentro de su propia transacción
+    (`publicar`); un hilo por worker lee las filas nuevas cada `intervalo`
+    segundos y llama a los suscriptores del canal. Las filas del propio worker
+    se ignoran: ese worker ya invalidó localmente después del commit.
+
+    Los ids autoincrementales pueden hacerse visibles fuera de orden (una
+    transacción con un id menor que confirma después), así que los huecos se
+    siguen consultando durante `espera_huecos` segundos.
+    """
+
+    def __init__(self, intervalo=1.0, retencion=3600, espera_huecos=30, limite=1000):
+        self.intervalo = intervalo
+        self.retencion = retencion
+        self.espera_huecos = espera_huecos
+        self.limite = limite
+        self.activa = False
+        self.origen = None
+        self.ultimo = 0
+        self.aplicados = 0
+        self._huecos = {}
+        self._suscriptores = {}
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def suscribir(self, canal, funcion):
+        """funcion(clave) se llama por cada cambio ajeno; clave=None significa 'todo'."""
+        self._suscriptores.setdefault(canal, []).append(funcion)
+
+    # 🔹 Escritura (antes del commit del llamador)
+    def publicar(self, conn, canal, clave=None):
+        if not self.activa:
+            return
+        conn.execute(cambios.insert().values(
+            canal=canal, clave=clave, origen=self.origen, fecha=datetime.now()
+        ))
+
+    # 🔹 Lectura
+    def iniciar(self):
+        if self.activa:
+            return
+        # Por proceso: con preload los workers heredan el módulo ya importado del master
+        self.origen = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        with conexion() as conn:
+            self.ultimo = conn.execute(select(func.max(cambios.c.id_cambio))).scalar() or 0
+        self.activa = True
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="coherencia", daemon=True)
+        self._hilo.start()
+        logger.info("Coherencia entre workers activa (origen %s, desde cambio %s)", self.origen, self.ultimo)
+
+    def detener(self):
+        self.activa = False
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self.intervalo * 2)
+            self._hilo = None
+
+    def _bucle(self):
+        ultima_purga = time.monotonic()
+        while not self._detener.wait(self.intervalo):
+            try:
+                self.sondear()
+                if time.monotonic() - ultima_purga > self.retencion / 10:
+                    self.purgar()
+                    ultima_purga = time.monotonic()
+            except SQLAlchemyError as e:
+                # Los cambios siguen en la tabla: se recogen en la próxima vuelta
+                logger.warning("No se pudieron leer los cambios: %s", e)
+
+    def sondear(self):
+        ahora = time.monotonic()
+        self._huecos = {id_cambio: vence for id_cambio, vence in self._huecos.items() if vence > ahora}
+
+        condicion = cambios.c.id_cambio > self.ultimo
+        if self._huecos:
+            condicion = or_(condicion, cambios.c.id_cambio.in_(list(self._huecos)))
+        with conexion() as conn:
+            filas = conn.execute(
+                select(cambios.c.id_cambio, cambios.c.canal, cambios.c.clave, cambios.c.origen)
+                .where(condicion)
+                .order_by(cambios.c.id_cambio)
+                .limit(self.limite)
+            ).fetchall()
+        if not filas:
+            return 0
+
+        if len(filas) == self.limite:
+            # Demasiado atrasado para aplicar uno por uno: se invalida todo
+            logger.warning("Más de %s cambios pendientes; se invalidan todas las cachés", self.limite)
+            for canal in self._suscriptores:
+                self._notificar(canal, None)
+            self.ultimo = max(self.ultimo, filas[-1].id_cambio)
+            self._huecos.clear()
+            return len(filas)
+
+        vistos = set()
+        for fila in filas:
+            vistos.add(fila.id_cambio)
+            self._huecos.pop(fila.id_cambio, None)
+            if fila.origen != self.origen:
+                self._notificar(fila.canal, fila.clave)
+
+        maximo = filas[-1].id_cambio
+        if maximo > self.ultimo:
+            vence = ahora + self.espera_huecos
+            for id_cambio in range(self.ultimo + 1, min(maximo, self.ultimo + self.limite)):
+                if id_cambio not in vistos:
+                    self._huecos[id_cambio] = vence
+            self.ultimo = maximo
+        return len(filas)
+
+    def _notificar(self, canal, clave):
+        self.aplicados += 1
+        for funcion in self._suscriptores.get(canal, []):
+            try:
+                funcion(clave)
+            except Exception:
+                logger.exception("Error aplicando el cambio %s:%s", canal, clave)
+
+    def purgar(self):
+        with conexion() as conn:
+            conn.execute(delete(cambios).where(cambios.c.fecha < datetime.now() - timedelta(seconds=self.retencion)))
+            conn.commit()
+
+    def estadisticas(self):
+        return {
+            "activa": self.activa,
+            "origen": self.origen,
+            "ultimo": self.ultimo,
+            "aplicados": self.aplicados,
+            "huecos": len(self._huecos)
+        }
+
+
+# 🔹 Formato de las claves
+def clave_ventas(fecha, ids_producto):
+    ids = ",".join(str(i) for i in ids_producto)
+    if len(ids) > 200:
+        ids = "*"  # demasiados productos para la columna: se invalidan todos
+    return f"{fecha.isoformat() if fecha else ''}|{ids}"
+
+
+def leer_clave_ventas(clave):
+    """Devuelve (fecha o None, ids de producto o None = todos)."""
+    fecha, ids = clave.split("|", 1)
+    fecha = datetime.fromisoformat(fecha) if fecha else None
+    return fecha, (None if ids == "*" else [int(i) for i in ids.split(",") if i])
+
+
+def clave_rango(desde, hasta):
+    return f"{desde.isoformat()}|{hasta.isoformat()}"
+
+
+def leer_clave_rango(clave):
+    desde, hasta = clave.split("|", 1)
+    return datetime.fromisoformat(desde), datetime.fromisoformat(hasta)
+
+
+coherencia = Coherencia(
+    intervalo=float(os.getenv("COHERENCIA_INTERVALO", "1")),
+    retencion=int(os.getenv("COHERENCIA_RETENCION", "3600"))
+)
@@ -0,0 +1,48 @@
+from sqlalchemy import func, select, update
+
+from backend.models.historial_productos import historial_productos
+from backend.models.producto import productos
+
+LOTE = 10000
+
+
+def costo_vigente(tabla):
+    """
+    Costo del producto al momento de cada fila de `tabla` (ventas / historial_ventas):
+    la última foto de historial_productos hasta fecha_venta o, si no hay, el costo actual.
+    """
+    h = historial_productos
+    foto = (
+        select(h.c.costo)
+        .where(h.c.id_producto == tabla.c.id_producto, h.c.fecha_registro <= tabla.c.fecha_venta,
+               h.c.costo.isnot(None))
+        .order_by(h.c.fecha_registro.desc(), h.c.id_historial.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    actual = select(productos.c.costo).where(productos.c.id_producto == tabla.c.id_producto).scalar_subquery()
+    return func.coalesce(foto, actual)
+
+
+def completar_costos(conn, tabla, lote=LOTE):
+    """
+    Backfill de costo_unitario en las filas que no lo tienen, por tramos de la
+    clave primaria (un commit por tramo). Devuelve las filas completadas.
+    """
+    clave = tabla.primary_key.columns[0]
+    minimo, maximo = conn.execute(
+        select(func.min(clave), func.max(clave)).where(tabla.c.costo_unitario.is_(None))
+    ).one()
+    if minimo is None:
+        return 0
+
+    completadas = 0
+    for inicio in range(minimo, maximo + 1, lote):
+        result = conn.execute(
+            update(tabla)
+            .where(clave >= inicio, clave < inicio + lote, tabla.c.costo_unitario.is_(None))
+            .values(costo_unitario=costo_vigente(tabla))
+        )
+        conn.commit()
+        completadas += result.rowcount
+    return completadas
@@ -0,0 +1,84 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from backend.models.imagen import imagenes
+
+TAMANO_BLOQUE = 1024 * 1024
+
+
+def copiar_con_huella(origen, destino):
+    """Copia en bloques calculando el sha256 al vuelo (sin cargar el archivo entero)."""
+    huella = hashlib.sha256()
+    while True:
+        bloque = origen.read(TAMANO_BLOQUE)
+        if not bloque:
+            return huella.hexdigest()
+        huella.update(bloque)
+        destino.write(bloque)
+
+
+def huella_archivo(ruta):
+    huella = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b""):
+            huella.update(bloque)
+    return huella.hexdigest()
+
+
+def buscar(conn, huella, bloquear=False):
+    """Con bloquear=True la fila no puede borrarse como huérfana antes del commit."""
+    if not huella:
+        return None
+    stmt = select(imagenes.c.url, imagenes.c.variantes).where(imagenes.c.huella == huella)
+    if bloquear:
+        stmt = stmt.with_for_update()
+    return conn.execute(stmt).fetchone()
+
+
+def registrar(conn, huella, url, variantes):
+    """
+    Guarda la imagen recién subida. Si otra subida del mismo contenido ganó la
+    carrera, se conserva la suya. Devuelve la fila vigente (url, variantes).
+    """
+    valores = {"huella": huella, "url": url, "variantes": variantes, "referencias": 0,
+               "fecha_registro": datetime.now()}
+    if conn.dialect.name == "mysql":
+        stmt = mysql.insert(imagenes).prefix_with("IGNORE")
+    else:
+        insertar = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+        stmt = insertar(imagenes).on_conflict_do_nothing(index_elements=[imagenes.c.huella])
+    conn.execute(stmt, valores)
+    return buscar(conn, huella, bloquear=True)
+
+
+def referenciar(conn, nueva=None, anterior=None):
+    """Un producto pasó de la imagen `anterior` a `nueva` (cualquiera puede ser None)."""
+    if nueva == anterior:
+        return
+    if nueva:
+        conn.execute(update(imagenes).where(imagenes.c.huella == nueva)
+                     .values(referencias=imagenes.c.referencias + 1))
+    if anterior:
+        conn.execute(update(imagenes).where(imagenes.c.huella == anterior)
+                     .values(referencias=imagenes.c.referencias - 1))
+
+
+def huerfanas(conn, antiguedad=timedelta(hours=1)):
+    """
+    Imágenes sin productos. Las recién registradas se excluyen: su producto
+    puede estar por apuntarlas.
+    """
+    return conn.execute(
+        select(imagenes.c.huella, imagenes.c.url, imagenes.c.variantes)
+        .where(imagenes.c.referencias <= 0, imagenes.c.fecha_registro < datetime.now() - antiguedad)
+    ).fetchall()
+
+
+def eliminar(conn, huella):
+    # Solo si sigue huérfana (otro producto pudo reutilizarla mientras tanto)
+    return conn.execute(
+        delete(imagenes).where(imagenes.c.huella == huella, imagenes.c.referencias <= 0)
+    ).rowcount
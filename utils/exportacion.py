@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+import zlib
+
+from fastapi.responses import StreamingResponse
+
+from backend.config.db import conexion
+from backend.utils.json_rapido import valor_json
+
+# Filas que se traen del cursor del servidor en cada vuelta
+TAMANO_LOTE = 2000
+
+TIPOS_CONTENIDO = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _trozos_csv(result, columnas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(columnas)
+    for particion in result.partitions():
+        escritor.writerows(particion)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _trozos_ndjson(result, columnas):
+    for particion in result.partitions():
+        yield "".join(
+            json.dumps(dict(zip(columnas, fila)), default=valor_json, ensure_ascii=False) + "\n"
+            for fila in particion
+        )
+
+
+def _comprimir(trozos):
+    # wbits=31 -> formato gzip (cabecera + CRC), compresión en streaming
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for trozo in trozos:
+        datos = compresor.compress(trozo.encode())
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+def _generar(stmt, formato, comprimir):
+    # El generador abre su propia conexión: la del request ya se liberó
+    # cuando empieza a enviarse el cuerpo
+    with conexion() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=TAMANO_LOTE).execute(stmt)
+        columnas = list(result.keys())
+        trozos = _trozos_csv(result, columnas) if formato == "csv" else _trozos_ndjson(result, columnas)
+        if comprimir:
+            yield from _comprimir(trozos)
+        else:
+            for trozo in trozos:
+                yield trozo.encode()
+
+
+def respuesta_exportacion(stmt, nombre, formato="csv", comprimir=False):
+    """
+    StreamingResponse que recorre stmt con un cursor del lado del servidor
+    y emite CSV o NDJSON (opcionalmente gzip) en memoria constante.
+    """
+    # Sin límite de max_execution_time para la exportación (solo MySQL)
+    stmt = stmt.prefix_with("/*+ MAX_EXECUTION_TIME(0) */", dialect="mysql")
+
+    archivo = f"{nombre}.{formato}"
+    tipo = TIPOS_CONTENIDO[formato]
+    if comprimir:
+        archivo += ".gz"
+        tipo = "application/gzip"
+
+    return StreamingResponse(
+        _generar(stmt, formato, comprimir),
+        media_type=tipo,
+        headers={"Content-Disposition": f'attachment; filename="{archivo}"'}
+    )
@@ -0,0 +1,101 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow es opcional: sin él se sube el original
+    Image = None
+
+# 🔹 Variantes: lado mayor en píxeles (nunca se agranda)
+VARIANTES = {"full": 1600, "card": 480, "thumb": 160}
+CALIDAD = int(os.getenv("IMAGENES_CALIDAD", "80"))
+
+
+class ImagenInvalida(Exception):
+    pass
+
+
+def disponible():
+    return Image is not None
+
+
+def _formato():
+    return ("WEBP", ".webp") if features.check("webp") else ("JPEG", ".jpg")
+
+
+def generar_variantes(ruta, carpeta, base):
+    """
+    Decodifica una vez, corrige la orientación EXIF y guarda cada variante sin
+    metadatos. Corre en un proceso aparte. Devuelve {variante: ruta}.
+    """
+    formato, extension = _formato()
+    try:
+        with Image.open(ruta) as original:
+            # JPEG: decodificar ya reducido cuando la foto es mucho más grande que la variante mayor
+            original.draft("RGB", (max(VARIANTES.values()),) * 2)
+            imagen = ImageOps.exif_transpose(original)
+            imagen.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ImagenInvalida(str(e))
+
+    transparente = imagen.mode in ("RGBA", "LA") or (imagen.mode == "P" and "transparency" in imagen.info)
+    if formato == "WEBP" and transparente:
+        imagen = imagen.convert("RGBA")
+    else:
+        imagen = imagen.convert("RGB")
+
+    rutas = {}
+    # De mayor a menor: cada variante se reduce a partir de la anterior
+    for variante, lado in sorted(VARIANTES.items(), key=lambda item: -item[1]):
+        imagen.thumbnail((lado, lado), Image.LANCZOS)
+        destino = os.path.join(carpeta, f"{base}_{variante}{extension}")
+        if formato == "WEBP":
+            imagen.save(destino, "WEBP", quality=CALIDAD, method=4)
+        else:
+            imagen.save(destino, "JPEG", quality=CALIDAD, optimize=True, progressive=True)
+        rutas[variante] = destino
+    return rutas
+
+
+class ProcesadorImagenes:
+    """Pool de procesos para generar variantes sin ocupar el event loop ni los hilos de requests."""
+
+    def __init__(self, procesos=2):
+        self.procesos = procesos
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _obtener_pool(self):
+        with self._lock:
+            # Se crea en el worker que lo usa (no en el master antes del fork)
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+            return self._pool
+
+    def _descartar(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def procesar(self, ruta, carpeta, base):
+        # Un proceso que muere (p. ej. Pillow con una imagen hostil) rompe todo el pool: se reemplaza.
+        # Pudo romperlo otra imagen en curso, así que se reintenta una vez antes de dar esta por inválida
+        for _ in range(2):
+            pool = self._obtener_pool()
+            try:
+                return pool.submit(generar_variantes, ruta, carpeta, base).result()
+            except BrokenProcessPool:
+                self._descartar(pool)
+        raise ImagenInvalida("El proceso que generaba las variantes terminó inesperadamente")
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+
+procesador = ProcesadorImagenes(procesos=int(os.getenv("IMAGENES_PROCESOS", "2")))
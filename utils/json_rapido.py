@@ -0,0 +1,115 @@
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Union, get_args, get_origin
+
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import Boolean, Float, Numeric
+
+try:
+    import orjson
+except ImportError:  # sin orjson se usa el json de la stdlib (más lento, mismo resultado)
+    orjson = None
+
+# Páginas con más filas que esto se envían en trozos (StreamingResponse)
+FILAS_POR_TROZO = int(os.getenv("JSON_FILAS_POR_TROZO", "500"))
+
+
+def valor_json(valor):
+    """`default` de json/orjson: fechas -> ISO 8601, Decimal -> número."""
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def dumps(datos):
+    """JSON compacto en bytes; Decimal -> número, fechas -> ISO 8601 (como pydantic)."""
+    if orjson is not None:
+        return orjson.dumps(datos, default=valor_json)
+    return json.dumps(datos, default=valor_json, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _conversor_anotacion(anotacion):
+    # Optional[float] -> float
+    if get_origin(anotacion) is Union:
+        tipos = [t for t in get_args(anotacion) if t is not type(None)]
+        anotacion = tipos[0] if len(tipos) == 1 else None
+    if anotacion is float:
+        return float
+    if anotacion is bool:
+        return bool  # SQLite devuelve 0/1
+    return None
+
+
+def _conversor_columna(columna):
+    if isinstance(columna.type, Boolean):
+        return bool
+    if isinstance(columna.type, (Numeric, Float)):
+        return float
+    return None
+
+
+class SerializadorFilas:
+    """
+    Filas del cursor -> JSON sin instanciar un modelo por fila. El mapeo
+    columna -> campo y las conversiones (Decimal, 0/1 -> bool) se calculan una
+    sola vez; la salida es la misma que la del response_model.
+    """
+
+    def __init__(self, columnas, conversores):
+        self.columnas = list(columnas)
+        self._nombres = [str(c.name) for c in self.columnas]  # quoted_name -> str (orjson no acepta subclases)
+        self._conversiones = [(str(c.name), f) for c, f in zip(self.columnas, conversores) if f is not None]
+
+    @classmethod
+    def para_modelo(cls, modelo, tabla, calculadas=None):
+        """
+        Columnas de `tabla` que son campos de `modelo`, en el orden del modelo.
+        `calculadas` reemplaza columnas por expresiones con el mismo nombre.
+        """
+        calculadas = calculadas or {}
+        columnas, conversores = [], []
+        for nombre, campo in modelo.model_fields.items():
+            if nombre not in tabla.c:
+                raise ValueError(f"{modelo.__name__}.{nombre} no es una columna de {tabla.name}")
+            columnas.append(calculadas.get(nombre, tabla.c[nombre]))
+            conversores.append(_conversor_anotacion(campo.annotation))
+        return cls(columnas, conversores)
+
+    @classmethod
+    def para_tabla(cls, tabla):
+        return cls(tabla.c, [_conversor_columna(c) for c in tabla.c])
+
+    def dicts(self, filas):
+        nombres = self._nombres
+        resultado = []
+        for fila in filas:
+            datos = dict(zip(nombres, fila))
+            for nombre, conversor in self._conversiones:
+                valor = datos[nombre]
+                if valor is not None:
+                    datos[nombre] = conversor(valor)
+            resultado.append(datos)
+        return resultado
+
+    def json(self, filas):
+        return dumps(self.dicts(filas))
+
+    def trozos(self, filas, tamanio=FILAS_POR_TROZO):
+        # "[" + lotes separados por coma + "]": el mismo documento que json(), por partes
+        yield b"["
+        for inicio in range(0, len(filas), tamanio):
+            lote = self.json(filas[inicio:inicio + tamanio])[1:-1]
+            yield (b"," + lote) if inicio else lote
+        yield b"]"
+
+
+def respuesta_filas(serializador, filas, cabeceras=None, tamanio=FILAS_POR_TROZO):
+    """Response JSON de las filas; en trozos si la página es grande."""
+    if len(filas) > tamanio:
+        return StreamingResponse(serializador.trozos(filas, tamanio), media_type="application/json",
+                                 headers=cabeceras)
+    return Response(content=serializador.json(filas), media_type="application/json", headers=cabeceras)
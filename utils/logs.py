@@ -0,0 +1,151 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+from datetime import datetime
+
+# 🔹 Contexto del request actual (lo fija MiddlewareLogs)
+id_peticion = contextvars.ContextVar("id_peticion", default=None)
+_muestreada = contextvars.ContextVar("muestreada", default=True)
+
+# Atributos estándar de LogRecord: todo lo demás llegó por `extra=` y va como campo del JSON
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro: ts, nivel, logger, msg, id_peticion y los campos de `extra=`."""
+
+    def format(self, record):
+        datos = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_ESTANDAR and not clave.startswith("_"):
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    """
+    Encola el registro sin formatearlo: el mensaje (y el traceback) se arma en
+    el hilo del listener, no en el del request. Los argumentos deben ser valores
+    que no cambien después (ids, números, textos).
+    """
+
+    def prepare(self, record):
+        record.id_peticion = id_peticion.get()
+        return record
+
+
+class FiltroMuestreo(logging.Filter):
+    """Los DEBUG (pasos) solo pasan en los requests elegidos por el muestreo."""
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or _muestreada.get()
+
+
+def tasas_por_prefijo(texto):
+    # "/ventas=0.01,/productos=0.1" -> [("/ventas", 0.01), ("/productos", 0.1)] (prefijo más largo primero)
+    tasas = []
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        prefijo, _, tasa = parte.partition("=")
+        tasas.append((prefijo.strip(), float(tasa)))
+    return sorted(tasas, key=lambda item: -len(item[0]))
+
+
+def tasa_para(tasas, ruta, defecto):
+    for prefijo, tasa in tasas:
+        if ruta.startswith(prefijo):
+            return tasa
+    return defecto
+
+
+class MiddlewareLogs:
+    """
+    Middleware ASGI: asigna un id a cada request (X-Request-ID si viene) y decide
+    una sola vez si sus logs DEBUG se emiten, según LOG_MUESTREO por prefijo de ruta.
+    """
+
+    def __init__(self, app, tasas=None, tasa_defecto=1.0):
+        self.app = app
+        self.tasas = tasas_por_prefijo(tasas if tasas is not None else os.getenv("LOG_MUESTREO", ""))
+        self.tasa_defecto = float(os.getenv("LOG_MUESTREO_DEFECTO", tasa_defecto))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        recibido = dict(scope["headers"]).get(b"x-request-id")
+        token_id = id_peticion.set(recibido.decode("latin-1")[:64] if recibido else uuid.uuid4().hex[:16])
+        tasa = tasa_para(self.tasas, scope["path"], self.tasa_defecto)
+        token_muestreo = _muestreada.set(tasa >= 1.0 or random.random() < tasa)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            id_peticion.reset(token_id)
+            _muestreada.reset(token_muestreo)
+
+
+def _niveles(texto):
+    # "backend.routes.ventas=DEBUG,sqlalchemy.engine=WARNING"
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        nombre, _, nivel = parte.partition("=")
+        logging.getLogger(nombre.strip()).setLevel(nivel.strip().upper())
+
+
+def configurar_logs():
+    """
+    Configura el logger raíz una sola vez: nivel LOG_LEVEL (INFO), formato
+    LOG_FORMATO=json|texto (json) y niveles por logger en LOG_NIVELES. La
+    escritura a stderr la hace un hilo aparte (QueueHandler + QueueListener).
+    """
+    if _listener is not None:
+        return
+
+    salida = logging.StreamHandler()
+    salida.setFormatter(FormatoTexto() if os.getenv("LOG_FORMATO", "json") == "texto" else FormatoJSON())
+
+    cola = queue.SimpleQueue()
+    manejador = _ManejadorCola(cola)
+    manejador.addFilter(FiltroMuestreo())
+
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers):
+        raiz.removeHandler(anterior)
+    raiz.addHandler(manejador)
+    raiz.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    _niveles(os.getenv("LOG_NIVELES", ""))
+
+    def _iniciar_listener():
+        global _listener
+        _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+        _listener.start()
+
+    _iniciar_listener()
+    # Con --preload el hilo del listener no sobrevive al fork: cada worker arranca el suyo
+    os.register_at_fork(after_in_child=_iniciar_listener)
+    atexit.register(detener_logs)
+
+
+def detener_logs():
+    """Vacía la cola de logs (al apagar)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
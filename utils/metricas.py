@@ -0,0 +1,185 @@
+import contextvars
+import threading
+import time
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Límites de los histogramas (segundos)
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_BD = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+SIN_RUTA = "sin_ruta"  # 404: no se usa la ruta cruda como etiqueta (cardinalidad)
+
+
+class _Peticion:
+    """Acumulado del request en curso; lo comparten el middleware y los hilos del threadpool."""
+    __slots__ = ("consultas", "tiempo_bd")
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo_bd = 0.0
+
+
+peticion_actual = contextvars.ContextVar("peticion_metricas", default=None)
+
+
+class Registro:
+    """
+    Contadores, gauges e histogramas en memoria del proceso, exportados en el
+    formato de texto de Prometheus. Con varios workers cada uno expone los suyos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}  # nombre -> (tipo, ayuda, etiquetas, buckets, valores)
+
+    def _definir(self, tipo, nombre, ayuda, etiquetas=(), buckets=None):
+        self._metricas[nombre] = (tipo, ayuda, tuple(etiquetas), buckets, {})
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        self._definir("counter", nombre, ayuda, etiquetas)
+
+    def gauge(self, nombre, ayuda, etiquetas=()):
+        self._definir("gauge", nombre, ayuda, etiquetas)
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self._definir("histogram", nombre, ayuda, etiquetas, buckets)
+
+    def sumar(self, nombre, valor=1, *etiquetas):
+        valores = self._metricas[nombre][4]
+        with self._lock:
+            valores[etiquetas] = valores.get(etiquetas, 0) + valor
+
+    def observar(self, nombre, valor, *etiquetas):
+        _, _, _, buckets, valores = self._metricas[nombre]
+        with self._lock:
+            serie = valores.get(etiquetas)
+            if serie is None:
+                serie = valores[etiquetas] = [[0] * len(buckets), 0.0, 0]
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    @staticmethod
+    def _etiquetas(nombres, valores, extra=""):
+        partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+        if extra:
+            partes.append(extra)
+        return "{" + ",".join(partes) + "}" if partes else ""
+
+    def exportar(self):
+        lineas = []
+        with self._lock:
+            copia = {nombre: (tipo, ayuda, etiquetas, buckets, {k: _copiar(v) for k, v in valores.items()})
+                     for nombre, (tipo, ayuda, etiquetas, buckets, valores) in self._metricas.items()}
+        for nombre, (tipo, ayuda, etiquetas, buckets, valores) in copia.items():
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for claves, valor in sorted(valores.items()):
+                if tipo != "histogram":
+                    lineas.append(f"{nombre}{self._etiquetas(etiquetas, claves)} {valor}")
+                    continue
+                conteos, suma, total = valor
+                acumulado = 0
+                for limite, conteo in zip(buckets, conteos):
+                    acumulado += conteo
+                    le = self._etiquetas(etiquetas, claves, 'le="%s"' % limite)
+                    lineas.append(f"{nombre}_bucket{le} {acumulado}")
+                le = self._etiquetas(etiquetas, claves, 'le="+Inf"')
+                lineas.append(f"{nombre}_bucket{le} {total}")
+                lineas.append(f"{nombre}_sum{self._etiquetas(etiquetas, claves)} {suma}")
+                lineas.append(f"{nombre}_count{self._etiquetas(etiquetas, claves)} {total}")
+        return "\n".join(lineas) + "\n"
+
+
+def _copiar(valor):
+    return [list(valor[0]), valor[1], valor[2]] if isinstance(valor, list) else valor
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registro = Registro()
+registro.contador("http_requests_total", "Requests atendidos", ("method", "route", "status"))
+registro.histograma("http_request_duration_seconds", "Latencia de los requests", ("method", "route"))
+registro.gauge("http_requests_in_flight", "Requests en curso", ("method", "route"))
+registro.contador("db_queries_total", "Sentencias SQL ejecutadas", ("route",))
+registro.contador("db_query_seconds_total", "Tiempo total en sentencias SQL", ("route",))
+registro.histograma("db_request_seconds", "Tiempo de BD por request", ("route",), BUCKETS_BD)
+registro.histograma("db_pool_checkout_seconds", "Espera para obtener una conexión del pool", (), BUCKETS_BD)
+
+
+# 🔹 Middleware ASGI (puro, sin BaseHTTPMiddleware)
+class MiddlewareMetricas:
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    def _ruta(self, scope):
+        # Plantilla de la ruta (/ventas/{id_venta}), no la URL concreta. Como el
+        # router: si solo coincide la ruta y no el método (405), vale la primera así
+        parcial = SIN_RUTA
+        for ruta in self.router.routes:
+            coincide, _ = ruta.matches(scope)
+            if coincide == Match.FULL:
+                return ruta.path
+            if coincide == Match.PARTIAL and parcial == SIN_RUTA:
+                parcial = ruta.path
+        return parcial
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metodo = scope["method"]
+        ruta = self._ruta(scope)
+        estado = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+            await send(mensaje)
+
+        acumulado = _Peticion()
+        token = peticion_actual.set(acumulado)
+        registro.sumar("http_requests_in_flight", 1, metodo, ruta)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            peticion_actual.reset(token)
+            registro.sumar("http_requests_in_flight", -1, metodo, ruta)
+            registro.sumar("http_requests_total", 1, metodo, ruta, str(estado[0]))
+            registro.observar("http_request_duration_seconds", duracion, metodo, ruta)
+            if acumulado.consultas:
+                registro.sumar("db_queries_total", acumulado.consultas, ruta)
+                registro.sumar("db_query_seconds_total", acumulado.tiempo_bd, ruta)
+                registro.observar("db_request_seconds", acumulado.tiempo_bd, ruta)
+
+
+# 🔹 Hooks del engine (los registra config/db.crear_engine)
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    context._inicio_metricas = time.perf_counter()
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    acumulado = peticion_actual.get()
+    if acumulado is None:
+        return  # hilos de fondo (subidas, auditoría, coherencia): no son de un request
+    acumulado.consultas += 1
+    acumulado.tiempo_bd += time.perf_counter() - context._inicio_metricas
+
+
+def instrumentar_engine(engine):
+    event.listen(engine, "before_cursor_execute", _antes_de_ejecutar)
+    event.listen(engine, "after_cursor_execute", _despues_de_ejecutar)
+
+
+def observar_checkout(segundos):
+    registro.observar("db_pool_checkout_seconds", segundos)
@@ -0,0 +1,65 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+
+
+def codificar_cursor(valor, id_fila):
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    crudo = json.dumps([valor, id_fila], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor, columna_orden):
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valor, id_fila = json.loads(crudo)
+        if valor is not None and columna_orden.type.python_type is datetime:
+            valor = datetime.fromisoformat(valor)
+        return valor, int(id_fila)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def paginar(stmt, columna_orden, columna_id, cursor=None, limite=LIMITE_POR_DEFECTO, descendente=False):
+    """
+    Paginación por keyset: ordena por (columna_orden, columna_id) y continúa
+    después de la última fila del cursor. Pide una fila extra para saber
+    si hay más páginas.
+    """
+    if cursor:
+        valor, id_fila = decodificar_cursor(cursor, columna_orden)
+        if columna_orden is columna_id:
+            condicion = columna_id < id_fila if descendente else columna_id > id_fila
+        elif descendente:
+            condicion = or_(columna_orden < valor, and_(columna_orden == valor, columna_id < id_fila))
+        else:
+            condicion = or_(columna_orden > valor, and_(columna_orden == valor, columna_id > id_fila))
+        stmt = stmt.where(condicion)
+
+    if descendente:
+        orden = [columna_orden.desc(), columna_id.desc()]
+    else:
+        orden = [columna_orden.asc(), columna_id.asc()]
+    if columna_orden is columna_id:
+        orden = orden[1:]
+
+    return stmt.order_by(*orden).limit(limite + 1)
+
+
+def cortar_pagina(filas, limite, columna_orden, columna_id):
+    """
+    Devuelve (filas de la página, next_cursor o None).
+    """
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    ultima = filas[-1]._mapping
+    return filas, codificar_cursor(ultima[columna_orden.name], ultima[columna_id.name])
@@ -0,0 +1,214 @@
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from starlette.concurrency import run_in_threadpool
+
+from backend.utils.logs import tasas_por_prefijo, tasa_para
+
+logger = logging.getLogger(__name__)
+
+CABECERA = b"x-perfil-cpu"
+EXTENSION = ".speedscope.json"
+
+
+class _Muestreador(threading.Thread):
+    """
+    Cada `intervalo` segundos toma la pila de los hilos que están trabajando
+    para el request: el del event loop mientras ejecuta su coroutine (`marco`)
+    y los del threadpool mientras ejecutan su endpoint (código de la ruta).
+    Si hay requests concurrentes al mismo endpoint sync, sus muestras se mezclan.
+    """
+
+    def __init__(self, marco, scope, intervalo):
+        super().__init__(name="perfil-cpu", daemon=True)
+        self.marco = marco
+        self.scope = scope
+        self.intervalo = intervalo
+        self.frames = []
+        self._indices = {}
+        self.muestras = []
+        self.pesos = []
+        self._fin = threading.Event()
+
+    def _indice(self, codigo):
+        clave = (codigo.co_name, codigo.co_filename, codigo.co_firstlineno)
+        indice = self._indices.get(clave)
+        if indice is None:
+            indice = self._indices[clave] = len(self.frames)
+            nombre = getattr(codigo, "co_qualname", codigo.co_name)  # co_qualname existe desde Python 3.11
+            self.frames.append({"name": nombre, "file": codigo.co_filename, "line": codigo.co_firstlineno})
+        return indice
+
+    def _pila(self, frame, endpoint):
+        pila = []
+        while frame is not None:
+            pila.append(frame.f_code)
+            if frame is self.marco or frame.f_code is endpoint:
+                return [self._indice(codigo) for codigo in reversed(pila)]
+            frame = frame.f_back
+        return None
+
+    def run(self):
+        propio = threading.get_ident()
+        anterior = time.perf_counter()
+        while not self._fin.wait(self.intervalo):
+            ahora = time.perf_counter()
+            ruta = self.scope.get("route")
+            endpoint = getattr(getattr(ruta, "endpoint", None), "__code__", None)
+            for hilo, frame in sys._current_frames().items():
+                if hilo == propio:
+                    continue
+                pila = self._pila(frame, endpoint)
+                if pila:
+                    self.muestras.append(pila)
+                    self.pesos.append(round((ahora - anterior) * 1000, 3))
+            anterior = ahora
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+class PerfilCPU:
+    """
+    Perfilado de CPU bajo demanda de requests concretos, sin redeploy.
+
+    Un request se perfila si trae `X-Perfil-CPU: <PERFIL_CPU_TOKEN>` o si lo elige
+    una regla de `PERFIL_CPU_REGLAS` (p. ej. "/reportes/rango=0.05"). El resultado
+    (perfil por muestreo en formato speedscope) se guarda en `carpeta`, que
+    conserva solo los `maximo` más recientes. Sin token ni reglas el middleware
+    no se instala.
+    """
+
+    def __init__(self, token="", reglas="", carpeta="perfiles", maximo=20, intervalo=0.005):
+        self.token = token.encode()
+        self.reglas = tasas_por_prefijo(reglas)
+        self.carpeta = carpeta
+        self.maximo = maximo
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+
+    @property
+    def activo(self):
+        return bool(self.token or self.reglas)
+
+    def autorizado(self, valor):
+        return bool(self.token) and valor is not None and hmac.compare_digest(valor, self.token)
+
+    def debe_perfilar(self, scope):
+        if scope["path"].startswith("/admin/perfiles"):
+            return False  # descargar un perfil no genera otro
+        if self.autorizado(dict(scope["headers"]).get(CABECERA)):
+            return True
+        tasa = tasa_para(self.reglas, scope["path"], 0.0)
+        return tasa > 0 and random.random() < tasa
+
+    # 🔹 Anillo de perfiles en disco
+    def guardar(self, nombre, muestreador, scope, duracion):
+        ruta = scope.get("route")
+        perfil = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f'{scope["method"]} {scope["path"]}',
+            "exporter": "ClaudStore-Backend",
+            "shared": {"frames": muestreador.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f'{scope["method"]} {getattr(ruta, "path", scope["path"])}',
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(duracion * 1000, 3),
+                "samples": muestreador.muestras,
+                "weights": muestreador.pesos
+            }]
+        }
+        with self._lock:
+            os.makedirs(self.carpeta, exist_ok=True)
+            temporal = os.path.join(self.carpeta, f".{nombre}.tmp")
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                json.dump(perfil, archivo)
+            os.replace(temporal, os.path.join(self.carpeta, nombre))
+            for viejo in self.listar()[self.maximo:]:
+                os.remove(os.path.join(self.carpeta, viejo["nombre"]))
+
+    def listar(self):
+        """Perfiles guardados, el más reciente primero."""
+        try:
+            nombres = [n for n in os.listdir(self.carpeta) if n.endswith(EXTENSION)]
+        except FileNotFoundError:
+            return []
+        perfiles = []
+        for nombre in nombres:
+            try:
+                info = os.stat(os.path.join(self.carpeta, nombre))
+            except FileNotFoundError:
+                continue
+            perfiles.append({
+                "nombre": nombre,
+                "bytes": info.st_size,
+                "fecha": datetime.fromtimestamp(info.st_mtime).isoformat(timespec="seconds")
+            })
+        return sorted(perfiles, key=lambda p: p["nombre"], reverse=True)
+
+    def ruta(self, nombre):
+        """Ruta del perfil si existe (solo nombres de la carpeta, sin subdirectorios)."""
+        if os.path.basename(nombre) != nombre or not nombre.endswith(EXTENSION):
+            return None
+        ruta = os.path.join(self.carpeta, nombre)
+        return ruta if os.path.isfile(ruta) else None
+
+
+def _nombre(scope):
+    # 20240101T120000-GET-reportes-rango-<id>.speedscope.json: el orden alfabético es el cronológico
+    ruta = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-")[:60] or "raiz"
+    fecha = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    return f'{fecha}-{scope["method"]}-{ruta}-{uuid.uuid4().hex[:6]}{EXTENSION}'
+
+
+perfil_cpu = PerfilCPU(
+    token=os.getenv("PERFIL_CPU_TOKEN", ""),
+    reglas=os.getenv("PERFIL_CPU_REGLAS", ""),
+    carpeta=os.getenv("PERFIL_CPU_CARPETA", "perfiles"),
+    maximo=int(os.getenv("PERFIL_CPU_MAX", "20")),
+    intervalo=float(os.getenv("PERFIL_CPU_INTERVALO_MS", "5")) / 1000
+)
+
+
+# 🔹 Middleware ASGI (solo se instala si perfil_cpu.activo)
+class MiddlewarePerfilCPU:
+    def __init__(self, app, perfil=perfil_cpu):
+        self.app = app
+        self.perfil = perfil
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.perfil.debe_perfilar(scope):
+            return await self.app(scope, receive, send)
+
+        nombre = _nombre(scope)
+        muestreador = _Muestreador(sys._getframe(), scope, self.perfil.intervalo)
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje["headers"] = list(mensaje.get("headers", [])) + [(b"x-perfil-cpu-archivo", nombre.encode())]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        muestreador.start()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            await run_in_threadpool(muestreador.detener)
+            try:
+                await run_in_threadpool(self.perfil.guardar, nombre, muestreador, scope, duracion)
+                logger.info("Perfil de CPU guardado: %s (%s muestras)", nombre, len(muestreador.muestras))
+            except OSError:
+                logger.exception("No se pudo guardar el perfil de CPU %s", nombre)
@@ -0,0 +1,174 @@
+import contextvars
+import logging
+import os
+import random
+import re
+import time
+from functools import lru_cache
+
+from sqlalchemy import event
+
+logger = logging.getLogger("backend.sql.perfil")
+logger_lentas = logging.getLogger("backend.sql.lentas")
+
+CABECERA = b"x-perfil-sql"
+
+# Sentencias del request perfilado (None = el request no se perfila)
+_sentencias = contextvars.ContextVar("perfil_sql", default=None)
+
+
+def _milisegundos(nombre, defecto):
+    return float(os.getenv(nombre, defecto)) / 1000
+
+
+# 🔹 Normalización: misma forma de sentencia -> mismo texto, sin valores
+_LITERALES = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|:\w+"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?+)"),   # IN (?, ?, ?) / VALUES (?, ?)
+    (re.compile(r"(\(\?\+\))(?:\s*,\s*\(\?\+\))+"), r"\1+"),  # VALUES (...), (...), ...
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=1024)
+def normalizar(sql):
+    for patron, reemplazo in _LITERALES:
+        sql = patron.sub(reemplazo, sql)
+    return sql.strip()
+
+
+def _forma(parametros, executemany):
+    # Tipos de los parámetros, nunca sus valores
+    if executemany:
+        return {"filas": len(parametros), "forma": _forma(parametros[0], False) if parametros else None}
+    if isinstance(parametros, dict):
+        return {clave: type(valor).__name__ for clave, valor in parametros.items()}
+    if isinstance(parametros, (list, tuple)):
+        return [type(valor).__name__ for valor in parametros]
+    return None
+
+
+class PerfilSQL:
+    """
+    Perfilado de SQL por request (opt-in) y log de consultas lentas.
+
+    - Un request se perfila si trae `X-Perfil-SQL: 1` (con `PERFIL_SQL_CABECERA=1`)
+      o si lo elige el muestreo `PERFIL_SQL_MUESTREO` (0 a 1). Se registra cada
+      sentencia (SQL normalizado, forma de los parámetros, duración, filas) y al
+      terminar se loguea el detalle y se responde un resumen en `Server-Timing`.
+    - Las sentencias que se repiten `PERFIL_SQL_REPETIDAS` veces o más en el mismo
+      request se marcan como posible N+1.
+    - Cualquier sentencia (perfilada o no, también de hilos de fondo) que tarde
+      más de `PERFIL_SQL_LENTA_MS` va al logger backend.sql.lentas.
+    """
+
+    def __init__(self, muestreo=0.0, cabecera=True, lenta=0.2, repetidas=5):
+        self.muestreo = muestreo
+        self.cabecera = cabecera
+        self.lenta = lenta
+        self.repetidas = repetidas
+
+    def debe_perfilar(self, scope):
+        if self.cabecera and dict(scope["headers"]).get(CABECERA) in (b"1", b"true"):
+            return True
+        return self.muestreo > 0 and random.random() < self.muestreo
+
+    # 🔹 Hooks del engine
+    def _antes(self, conn, cursor, statement, parameters, context, executemany):
+        context._inicio_perfil = time.perf_counter()
+
+    def _despues(self, conn, cursor, statement, parameters, context, executemany):
+        duracion = time.perf_counter() - context._inicio_perfil
+        sentencias = _sentencias.get()
+        if sentencias is not None:
+            sentencias.append({
+                "sql": normalizar(statement),
+                "parametros": _forma(parameters, executemany),
+                "ms": round(duracion * 1000, 3),
+                "filas": cursor.rowcount
+            })
+        if self.lenta and duracion >= self.lenta:
+            logger_lentas.warning(
+                "Consulta lenta (%.1f ms): %s", duracion * 1000, normalizar(statement),
+                extra={"ms": round(duracion * 1000, 3), "filas": cursor.rowcount,
+                       "parametros": _forma(parameters, executemany)}
+            )
+
+    def _commit(self, conn):
+        sentencias = _sentencias.get()
+        if sentencias is not None:
+            sentencias.append({"sql": "COMMIT", "parametros": None, "ms": None, "filas": None})
+
+    def instrumentar_engine(self, engine):
+        event.listen(engine, "before_cursor_execute", self._antes)
+        event.listen(engine, "after_cursor_execute", self._despues)
+        event.listen(engine, "commit", self._commit)
+
+    # 🔹 Resumen del request
+    def resumir(self, sentencias):
+        conteo = {}
+        for sentencia in sentencias:
+            if sentencia["sql"] != "COMMIT":
+                conteo[sentencia["sql"]] = conteo.get(sentencia["sql"], 0) + 1
+        repetidas = {sql: veces for sql, veces in conteo.items() if veces >= self.repetidas}
+        return {
+            "consultas": sum(conteo.values()),
+            "ms": round(sum(s["ms"] for s in sentencias if s["ms"] is not None), 3),
+            "repetidas": repetidas
+        }
+
+
+def server_timing(resumen):
+    # Server-Timing: sql;dur=12.5;desc="7 consultas", sql-repetidas;desc="2"
+    valor = f'sql;dur={resumen["ms"]};desc="{resumen["consultas"]} consultas"'
+    if resumen["repetidas"]:
+        valor += f', sql-repetidas;desc="{len(resumen["repetidas"])}"'
+    return valor.encode("latin-1")
+
+
+perfil_sql = PerfilSQL(
+    muestreo=float(os.getenv("PERFIL_SQL_MUESTREO", "0")),
+    cabecera=os.getenv("PERFIL_SQL_CABECERA", "1") == "1",
+    lenta=_milisegundos("PERFIL_SQL_LENTA_MS", "200"),
+    repetidas=int(os.getenv("PERFIL_SQL_REPETIDAS", "5"))
+)
+
+
+# 🔹 Middleware ASGI: activa el perfil y agrega Server-Timing a la respuesta
+class MiddlewarePerfilSQL:
+    def __init__(self, app, perfil=perfil_sql):
+        self.app = app
+        self.perfil = perfil
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.perfil.debe_perfilar(scope):
+            return await self.app(scope, receive, send)
+
+        sentencias = []
+        token = _sentencias.set(sentencias)
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                # Lo ejecutado hasta que empieza la respuesta (en streaming puede haber más después)
+                resumen = self.perfil.resumir(sentencias)
+                mensaje.setdefault("headers", [])
+                mensaje["headers"] = list(mensaje["headers"]) + [(b"server-timing", server_timing(resumen))]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _sentencias.reset(token)
+            resumen = self.perfil.resumir(sentencias)
+            total_ms = round((time.perf_counter() - inicio) * 1000, 3)
+            logger.info(
+                "Perfil SQL %s %s: %s consultas, %s ms de BD, %s ms en total",
+                scope["method"], scope["path"], resumen["consultas"], resumen["ms"], total_ms,
+                extra={"sentencias": sentencias, "total_ms": total_ms}
+            )
+            for sql, veces in resumen["repetidas"].items():
+                logger.warning("Posible N+1 en %s: %s veces %s", scope["path"], veces, sql,
+                               extra={"veces": veces, "sql": sql})
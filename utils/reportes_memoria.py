@@ -0,0 +1,349 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, or_, select
+
+from backend.config.db import conexion
+from backend.models.producto import productos
+from backend.models.venta import ventas
+from backend.utils.cache_reportes import cache_reportes
+from backend.utils.catalogo import catalogo
+from backend.utils.coherencia import coherencia, leer_clave_rango
+
+try:
+    import numpy as np
+except ImportError:  # sin numpy solo queda el motor SQL de los reportes
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_US_POR_DIA = 86400 * 1000000
+_EPOCA = date(1970, 1, 1)
+_EPOCA_HORA = datetime(1970, 1, 1)
+_UN_US = timedelta(microseconds=1)
+_COLUMNAS = ("ts", "id_venta", "id_producto", "cantidad", "total", "costo")
+
+
+def _microsegundos(fecha):
+    # Hora local sin zona, como se guarda fecha_venta
+    if fecha.tzinfo:
+        fecha = fecha.astimezone().replace(tzinfo=None)
+    return (fecha - _EPOCA_HORA) // _UN_US
+
+
+# 🔹 Bloques: columnas de ventas en arrays ordenados por fecha
+class _Bloque:
+    __slots__ = _COLUMNAS
+
+    def __init__(self, ts, id_venta, id_producto, cantidad, total, costo):
+        self.ts = ts
+        self.id_venta = id_venta
+        self.id_producto = id_producto
+        self.cantidad = cantidad
+        self.total = total
+        self.costo = costo
+
+    @classmethod
+    def de_filas(cls, filas):
+        """filas: (fecha_venta, id_venta, id_producto, cantidad, precio_total, costo_unitario)."""
+        columnas = list(zip(*filas)) if filas else [()] * len(_COLUMNAS)
+        costo = np.array(columnas[5], dtype=np.float64)
+        return cls(
+            # Varias veces más rápido que np.array(..., dtype="datetime64[us]") sobre objetos datetime
+            np.fromiter(((fecha - _EPOCA_HORA) // _UN_US for fecha in columnas[0]), dtype=np.int64,
+                        count=len(columnas[0])),
+            np.array(columnas[1], dtype=np.int64),
+            np.array(columnas[2], dtype=np.int32),
+            np.array(columnas[3], dtype=np.int32),
+            np.array(columnas[4], dtype=np.float64),
+            # Ventas previas al backfill de costo_unitario: suman 0, igual que en SQL
+            np.nan_to_num(costo, copy=False)
+        )
+
+    @classmethod
+    def unir(cls, bloques):
+        """Concatena y ordena por fecha (si ya venían en orden, no reordena)."""
+        bloques = [bloque for bloque in bloques if bloque is not None and len(bloque)]
+        if not bloques:
+            return cls.de_filas([])
+        if len(bloques) == 1:
+            unido = bloques[0]
+        else:
+            unido = cls(*(np.concatenate([getattr(b, nombre) for b in bloques]) for nombre in _COLUMNAS))
+        if len(unido) > 1 and not (unido.ts[1:] >= unido.ts[:-1]).all():
+            orden = np.argsort(unido.ts, kind="stable")
+            unido = cls(*(getattr(unido, nombre)[orden] for nombre in _COLUMNAS))
+        return unido
+
+    def sin(self, desde, hasta):
+        """Copia sin las filas de [desde, hasta] (µs)."""
+        lo, hi = self.rango(desde, hasta)
+        if lo == hi:
+            return self
+        return _Bloque(*(np.concatenate([getattr(self, n)[:lo], getattr(self, n)[hi:]]) for n in _COLUMNAS))
+
+    def rango(self, desde, hasta):
+        return int(np.searchsorted(self.ts, desde, "left")), int(np.searchsorted(self.ts, hasta, "right"))
+
+    def __len__(self):
+        return len(self.ts)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, nombre).nbytes for nombre in _COLUMNAS)
+
+
+class ReportesMemoria:
+    """
+    Motor en memoria de GET /reportes/rango (`motor=memoria`, necesita numpy).
+
+    Guarda una copia columnar de `ventas` ordenada por fecha (timestamps en µs
+    como int64, producto, cantidad, total y costo unitario) en dos bloques: el
+    principal y uno chico de ventas recientes, que se funde con el principal
+    cuando crece. Se carga entera la primera vez y después trae solo las ventas
+    con id_venta mayor al último visto (más los huecos de ids de transacciones
+    que pueden confirmar tarde, como en `Coherencia`). Se pone al día cuando la
+    caché de reportes cambia de generación o cada `intervalo` segundos.
+
+    Un reporte es un `searchsorted` por bloque para cortar el rango y `bincount`
+    por día y por producto; los días se agrupan por periodo igual que en SQL.
+    """
+
+    def __init__(self, intervalo=1.0, lote=50000, max_reciente=65536, espera_huecos=30, max_huecos=10000):
+        self.intervalo = intervalo
+        self.lote = lote
+        self.max_reciente = max_reciente
+        self.espera_huecos = espera_huecos
+        self.max_huecos = max_huecos
+        self._bloques = None   # (principal, reciente); None = sin cargar
+        self._ultimo_id = 0
+        self._huecos = {}
+        self._generacion = None
+        self._ultimo_refresco = 0.0
+        self._nombres = None   # (version del catálogo, id_producto -> índice, nombres)
+        self._lock = threading.Lock()
+        self.cargas = 0
+        self.refrescos = 0
+        self.segundos_carga = None
+
+    @property
+    def disponible(self):
+        return np is not None
+
+    # 🔹 Carga y puesta al día
+    @staticmethod
+    def _select():
+        # Sin producto no entran al resumen diario; sin cantidad o total cuentan 0 (los arrays no admiten NULL)
+        return select(
+            ventas.c.fecha_venta, ventas.c.id_venta, ventas.c.id_producto,
+            func.coalesce(ventas.c.cantidad, 0), func.coalesce(ventas.c.precio_total, 0), ventas.c.costo_unitario
+        ).where(ventas.c.fecha_venta.isnot(None), ventas.c.id_producto.isnot(None))
+
+    def _leer(self, conn, stmt):
+        result = conn.execution_options(yield_per=self.lote).execute(stmt)
+        return _Bloque.unir([_Bloque.de_filas(filas) for filas in result.partitions()])
+
+    def cargar(self):
+        with self._lock:
+            self._cargar()
+        return len(self._bloques[0])
+
+    def _cargar(self):
+        inicio = time.perf_counter()
+        generacion = cache_reportes.generacion
+        with conexion() as conn:
+            # En el orden de ix_ventas_fecha: el bloque llega ya ordenado
+            principal = self._leer(conn, self._select().order_by(ventas.c.fecha_venta))
+        self._bloques = (principal, _Bloque.de_filas([]))
+        self._ultimo_id = 0
+        self._huecos = {}
+        self._registrar_ids(principal.id_venta)
+        self._generacion = generacion
+        self._ultimo_refresco = time.monotonic()
+        self.cargas += 1
+        self.segundos_carga = round(time.perf_counter() - inicio, 3)
+        logger.info("Ventas cargadas en memoria para los reportes", extra={
+            "filas": len(principal), "segundos": self.segundos_carga, "mb": round(principal.nbytes / 2 ** 20, 1)
+        })
+
+    def _registrar_ids(self, ids):
+        """Sube el último id visto y anota los huecos por debajo (ventas que pueden confirmar tarde)."""
+        if self._huecos:
+            for id_venta in np.intersect1d(ids, list(self._huecos)).tolist():
+                self._huecos.pop(id_venta, None)
+        if not len(ids):
+            return
+        maximo = int(ids.max())
+        if maximo > self._ultimo_id:
+            desde = max(self._ultimo_id + 1, maximo - self.max_huecos)
+            vence = time.monotonic() + self.espera_huecos
+            for id_venta in np.setdiff1d(np.arange(desde, maximo, dtype=np.int64), ids, assume_unique=True).tolist():
+                self._huecos[id_venta] = vence
+            self._ultimo_id = maximo
+
+    def _refrescar(self):
+        ahora = time.monotonic()
+        generacion = cache_reportes.generacion
+        self._huecos = {id_venta: vence for id_venta, vence in self._huecos.items() if vence > ahora}
+        condicion = ventas.c.id_venta > self._ultimo_id
+        if self._huecos:
+            condicion = or_(condicion, ventas.c.id_venta.in_(list(self._huecos)))
+        with conexion() as conn:
+            nuevas = self._leer(conn, self._select().where(condicion))
+        self._generacion = generacion
+        self._ultimo_refresco = ahora
+        if not len(nuevas):
+            return
+        self._registrar_ids(nuevas.id_venta)
+
+        principal, reciente = self._bloques
+        reciente = _Bloque.unir([reciente, nuevas])
+        if len(reciente) > max(self.max_reciente, len(principal) // 16):
+            principal, reciente = _Bloque.unir([principal, reciente]), _Bloque.de_filas([])
+        self._bloques = (principal, reciente)
+        self.refrescos += 1
+
+    def _al_dia(self):
+        with self._lock:
+            if self._bloques is None:
+                self._cargar()
+            elif (self._generacion != cache_reportes.generacion
+                  or time.monotonic() - self._ultimo_refresco >= self.intervalo):
+                self._refrescar()
+            return self._bloques
+
+    # 🔹 Reporte
+    def calcular(self, desde, hasta, top=5):
+        """
+        Totales del rango [desde, hasta]: ([(fecha, inversion, generado)] por día con
+        ventas, [(nombre, vendidos)] de los `top` productos más vendidos).
+        """
+        bloques = self._al_dia()
+        inicio, fin = _microsegundos(desde), _microsegundos(hasta)
+        if inicio > fin:
+            return [], []
+        primer_dia = inicio // _US_POR_DIA
+        dias = fin // _US_POR_DIA - primer_dia + 1
+
+        filas = np.zeros(dias, dtype=np.int64)
+        inversion = np.zeros(dias)
+        generado = np.zeros(dias)
+        unidades = np.zeros(0)
+        for bloque in bloques:
+            lo, hi = bloque.rango(inicio, fin)
+            if lo == hi:
+                continue
+            dia = bloque.ts[lo:hi] // _US_POR_DIA - primer_dia
+            cantidad = bloque.cantidad[lo:hi]
+            filas += np.bincount(dia, minlength=dias)
+            generado += np.bincount(dia, weights=bloque.total[lo:hi], minlength=dias)
+            inversion += np.bincount(dia, weights=bloque.costo[lo:hi] * cantidad, minlength=dias)
+            por_producto = np.bincount(bloque.id_producto[lo:hi], weights=cantidad)
+            if len(por_producto) > len(unidades):
+                por_producto[:len(unidades)] += unidades
+                unidades = por_producto
+            else:
+                unidades[:len(por_producto)] += por_producto
+
+        por_dia = [
+            (_EPOCA + timedelta(days=int(primer_dia + d)), float(inversion[d]), float(generado[d]))
+            for d in np.flatnonzero(filas).tolist()
+        ]
+        return por_dia, self._top(unidades, top)
+
+    def _top(self, unidades, top):
+        # Como el SQL: se suma por nombre de producto y se descartan las ventas sin producto
+        ids = np.flatnonzero(unidades)
+        if not len(ids):
+            return []
+        indice, nombres = self._nombres_para(len(unidades))
+        grupo = indice[ids]
+        validos = grupo >= 0
+        por_nombre = np.bincount(grupo[validos], weights=unidades[ids][validos], minlength=len(nombres))
+        mejores = np.argsort(-por_nombre, kind="stable")[:top]
+        return [(nombres[i], int(por_nombre[i])) for i in mejores.tolist() if por_nombre[i] > 0]
+
+    def _nombres_para(self, tamanio):
+        # catalogo.version_productos sube con cada alta / edición de productos (también de otros workers)
+        nombres = self._nombres
+        if nombres is not None and nombres[0] == catalogo.version_productos and len(nombres[1]) >= tamanio:
+            return nombres[1], nombres[2]
+        version = catalogo.version_productos
+        with conexion() as conn:
+            filas = conn.execute(select(productos.c.id_producto, productos.c.nombre)).fetchall()
+        indice = np.full(max([tamanio] + [fila.id_producto + 1 for fila in filas]), -1, dtype=np.int64)
+        # Índices en orden alfabético: los empates del top salen por nombre, como en el SQL
+        nombres = sorted({fila.nombre for fila in filas})
+        posiciones = {nombre: i for i, nombre in enumerate(nombres)}
+        for fila in filas:
+            indice[fila.id_producto] = posiciones[fila.nombre]
+        self._nombres = (version, indice, nombres)
+        return indice, nombres
+
+    # 🔹 Ventas borradas (llamar después del commit, antes de invalidar la caché de reportes)
+    def eliminar(self, id_venta):
+        """La venta queda en cero, igual que su fila de ventas_diarias."""
+        with self._lock:
+            for bloque in self._bloques or ():
+                posicion = np.flatnonzero(bloque.id_venta == id_venta)
+                bloque.cantidad[posicion] = 0
+                bloque.total[posicion] = 0
+                bloque.costo[posicion] = 0
+
+    def eliminar_rango(self, desde, hasta):
+        """DELETE /reportes/reiniciar: las ventas del rango desaparecen (y sus días del reporte)."""
+        with self._lock:
+            if self._bloques is not None:
+                inicio, fin = _microsegundos(desde), _microsegundos(hasta)
+                self._bloques = tuple(bloque.sin(inicio, fin) for bloque in self._bloques)
+
+    def invalidar(self):
+        """Se recarga todo en el próximo reporte."""
+        with self._lock:
+            self._bloques = None
+            self._nombres = None
+
+    def estadisticas(self):
+        bloques = self._bloques
+        return {
+            "disponible": self.disponible,
+            "cargada": bloques is not None,
+            "filas": sum(len(bloque) for bloque in bloques) if bloques else 0,
+            "recientes": len(bloques[1]) if bloques else 0,
+            "mb": round(sum(bloque.nbytes for bloque in bloques) / 2 ** 20, 1) if bloques else 0,
+            "ultimo_id": self._ultimo_id,
+            "huecos": len(self._huecos),
+            "cargas": self.cargas,
+            "refrescos": self.refrescos,
+            "segundos_ultima_carga": self.segundos_carga
+        }
+
+
+reportes_memoria = ReportesMemoria(
+    intervalo=float(os.getenv("REPORTES_MEMORIA_INTERVALO", "1")),
+    lote=int(os.getenv("REPORTES_MEMORIA_LOTE", "50000"))
+)
+
+
+# 🔹 Cambios hechos por otros workers
+def _venta_eliminada(clave):
+    if clave is None:
+        reportes_memoria.invalidar()
+    else:
+        reportes_memoria.eliminar(int(clave))
+
+
+def _reportes_cambiados(clave):
+    # Sin clave es un cambio de nombre o costo de un producto: los nombres se releen por el catálogo
+    if clave is not None:
+        desde, hasta = leer_clave_rango(clave)
+        reportes_memoria.eliminar_rango(desde, hasta)
+        # La caché ya se invalidó antes (se suscribió primero): otra vez, por lo calculado en el medio
+        cache_reportes.invalidar_rango(desde, hasta)
+
+
+coherencia.suscribir("venta_eliminada", _venta_eliminada)
+coherencia.suscribir("reportes", _reportes_cambiados)
@@ -0,0 +1,291 @@
+import logging
+import os
+import random
+import threading
+
+from sqlalchemy import Integer, case, cast, delete, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from backend.config.db import conexion
+from backend.models.producto import productos
+from backend.models.stock_fragmento import stock_fragmentos
+
+logger = logging.getLogger(__name__)
+
+MAX_FRAGMENTOS = int(os.getenv("STOCK_MAX_FRAGMENTOS", "64"))
+
+# Stock fragmentado (opcional, por producto): con productos.fragmentos_stock = K el stock
+# del producto es productos.stock (normalmente 0) más sus K filas de stock_fragmentos.
+# Cada venta descuenta de un fragmento al azar, así las ventas concurrentes de un mismo
+# producto no esperan todas el bloqueo de la misma fila.
+_f = stock_fragmentos
+
+
+# 🔹 Lecturas: el stock que ve la API es siempre el total
+def stock_total():
+    """Columna `stock` con productos.stock + sus fragmentos (para cualquier select sobre productos)."""
+    fragmentos = (
+        select(func.coalesce(func.sum(_f.c.cantidad), 0))
+        .where(_f.c.id_producto == productos.c.id_producto)
+        .scalar_subquery()
+    )
+    # SUM devuelve DECIMAL en MySQL: se vuelve a entero para que la respuesta no cambie
+    return cast(
+        case((productos.c.fragmentos_stock > 0, productos.c.stock + fragmentos), else_=productos.c.stock),
+        Integer
+    ).label("stock")
+
+
+def columnas_producto():
+    """Las columnas de productos, con `stock` ya sumado."""
+    return [stock_total() if columna.name == "stock" else columna for columna in productos.c]
+
+
+def stock_de(conn, id_producto):
+    return conn.execute(select(stock_total()).where(productos.c.id_producto == id_producto)).scalar()
+
+
+def detalle(conn, id_producto):
+    filas = conn.execute(
+        select(_f.c.fragmento, _f.c.cantidad).where(_f.c.id_producto == id_producto).order_by(_f.c.fragmento)
+    ).fetchall()
+    return [{"fragmento": fila.fragmento, "cantidad": fila.cantidad} for fila in filas]
+
+
+# 🔹 Escrituras de una venta
+def descontar(conn, id_producto, cantidad, fragmentos=None):
+    """
+    Descuenta `cantidad` si el stock alcanza. Devuelve el fragmento usado (0 si
+    el producto no está fragmentado) o None si no alcanza. `fragmentos` es el K
+    conocido por el llamador (catálogo); si quedó viejo, el camino exacto lo corrige.
+    """
+    if fragmentos:
+        # Lectura sin bloqueo para elegir un fragmento que alcance por sí solo
+        candidatos = conn.execute(
+            select(_f.c.fragmento).where(_f.c.id_producto == id_producto, _f.c.cantidad >= cantidad)
+        ).scalars().all()
+        if candidatos:
+            elegido = random.choice(candidatos)
+            result = conn.execute(
+                update(_f)
+                .where(_f.c.id_producto == id_producto, _f.c.fragmento == elegido, _f.c.cantidad >= cantidad)
+                .values(cantidad=_f.c.cantidad - cantidad)
+            )
+            if result.rowcount:
+                return elegido
+    else:
+        result = conn.execute(
+            update(productos)
+            .where(productos.c.id_producto == id_producto, productos.c.stock >= cantidad)
+            .values(stock=productos.c.stock - cantidad)
+        )
+        if result.rowcount:
+            return 0
+    # Ningún fragmento alcanza solo (o K cambió): se junta de todos, bloqueando en orden
+    return 0 if _tomar(conn, id_producto, cantidad) else None
+
+
+def _tomar(conn, id_producto, cantidad):
+    stock = conn.execute(
+        select(productos.c.stock).where(productos.c.id_producto == id_producto).with_for_update()
+    ).scalar()
+    if stock is None:
+        return False
+    filas = conn.execute(
+        select(_f.c.fragmento, _f.c.cantidad)
+        .where(_f.c.id_producto == id_producto)
+        .order_by(_f.c.fragmento)
+        .with_for_update()
+    ).fetchall()
+    if stock + sum(fila.cantidad for fila in filas) < cantidad:
+        return False
+
+    restante = cantidad
+    desde_producto = min(max(stock, 0), restante)
+    if desde_producto:
+        conn.execute(
+            update(productos)
+            .where(productos.c.id_producto == id_producto)
+            .values(stock=productos.c.stock - desde_producto)
+        )
+        restante -= desde_producto
+    for fila in filas:
+        if not restante:
+            break
+        tomado = min(fila.cantidad, restante)
+        if tomado > 0:
+            conn.execute(
+                update(_f)
+                .where(_f.c.id_producto == id_producto, _f.c.fragmento == fila.fragmento)
+                .values(cantidad=_f.c.cantidad - tomado)
+            )
+            restante -= tomado
+    return True
+
+
+def devolver(conn, id_producto, cantidad, fragmentos=None):
+    """Suma `cantidad` al stock (venta eliminada): a un fragmento al azar o a productos.stock."""
+    if fragmentos:
+        result = conn.execute(
+            update(_f)
+            .where(_f.c.id_producto == id_producto, _f.c.fragmento == random.randrange(fragmentos))
+            .values(cantidad=_f.c.cantidad + cantidad)
+        )
+        if result.rowcount:
+            return
+    conn.execute(
+        update(productos)
+        .where(productos.c.id_producto == id_producto)
+        .values(stock=productos.c.stock + cantidad)
+    )
+
+
+# 🔹 Varias ventas sobre filas de productos ya bloqueadas (/ventas/lote, ventas agrupadas)
+def disponibles(conn, filas):
+    """Stock total por producto; `filas` trae id_producto, stock y fragmentos_stock (con FOR UPDATE)."""
+    totales = {fila.id_producto: fila.stock for fila in filas}
+    fragmentados = [fila.id_producto for fila in filas if fila.fragmentos_stock]
+    if fragmentados:
+        for id_producto, cantidad in conn.execute(
+            select(_f.c.id_producto, _f.c.cantidad)
+            .where(_f.c.id_producto.in_(fragmentados))
+            .order_by(_f.c.id_producto, _f.c.fragmento)
+            .with_for_update()
+        ):
+            totales[id_producto] += cantidad
+    return totales
+
+
+def descontar_varios(conn, pedidos, filas):
+    """Descuenta {id_producto: cantidad}, ya validado contra `disponibles(conn, filas)`."""
+    fragmentados = {fila.id_producto for fila in filas if fila.fragmentos_stock}
+    normales = {id_producto: cantidad for id_producto, cantidad in pedidos.items() if id_producto not in fragmentados}
+    if normales:
+        conn.execute(
+            update(productos)
+            .where(productos.c.id_producto.in_(sorted(normales)))
+            .values(stock=productos.c.stock - case(normales, value=productos.c.id_producto))
+        )
+    for id_producto in sorted(fragmentados & pedidos.keys()):
+        _tomar(conn, id_producto, pedidos[id_producto])
+
+
+# 🔹 Activar / desactivar, fijar y rebalancear
+def _partes(total, fragmentos):
+    base, resto = divmod(max(total, 0), fragmentos)
+    return [base + (1 if i < resto else 0) for i in range(fragmentos)]
+
+
+def repartir(conn, id_producto, total, fragmentos):
+    """Reemplaza los fragmentos del producto por `fragmentos` filas parejas que suman `total`."""
+    conn.execute(delete(_f).where(_f.c.id_producto == id_producto))
+    conn.execute(insert(_f), [
+        {"id_producto": id_producto, "fragmento": i, "cantidad": cantidad}
+        for i, cantidad in enumerate(_partes(total, fragmentos))
+    ])
+
+
+def configurar(conn, id_producto, fragmentos):
+    """
+    Activa (K > 0) o desactiva (0) el stock fragmentado de un producto sin
+    cambiar su total. Devuelve el total, o None si el producto no existe.
+    """
+    if not 0 <= fragmentos <= MAX_FRAGMENTOS:
+        raise ValueError(f"fragmentos debe estar entre 0 y {MAX_FRAGMENTOS}")
+    stock = conn.execute(
+        select(productos.c.stock).where(productos.c.id_producto == id_producto).with_for_update()
+    ).scalar()
+    if stock is None:
+        return None
+    total = stock + sum(conn.execute(
+        select(_f.c.cantidad).where(_f.c.id_producto == id_producto).order_by(_f.c.fragmento).with_for_update()
+    ).scalars())
+
+    if fragmentos:
+        repartir(conn, id_producto, total, fragmentos)
+    else:
+        conn.execute(delete(_f).where(_f.c.id_producto == id_producto))
+    conn.execute(
+        update(productos)
+        .where(productos.c.id_producto == id_producto)
+        .values(stock=0 if fragmentos else total, fragmentos_stock=fragmentos or None)
+    )
+    return total
+
+
+def rebalancear(conn, id_producto):
+    """
+    Empareja los fragmentos si alguno quedó por debajo de la mitad de su parte
+    (las ventas al azar y el camino exacto los desparejan). Devuelve si cambió algo.
+    """
+    filas = conn.execute(
+        select(_f.c.fragmento, _f.c.cantidad)
+        .where(_f.c.id_producto == id_producto)
+        .order_by(_f.c.fragmento)
+        .with_for_update()
+    ).fetchall()
+    if len(filas) < 2:
+        return False
+    total = sum(fila.cantidad for fila in filas)
+    if min(fila.cantidad for fila in filas) * 2 >= total // len(filas):
+        return False
+    for fila, cantidad in zip(filas, _partes(total, len(filas))):
+        if fila.cantidad != cantidad:
+            conn.execute(
+                update(_f)
+                .where(_f.c.id_producto == id_producto, _f.c.fragmento == fila.fragmento)
+                .values(cantidad=cantidad)
+            )
+    return True
+
+
+def rebalancear_todos():
+    """Una transacción corta por producto fragmentado. Devuelve los ids rebalanceados."""
+    rebalanceados = []
+    with conexion() as conn:
+        ids = conn.execute(
+            select(productos.c.id_producto).where(productos.c.fragmentos_stock > 0).order_by(productos.c.id_producto)
+        ).scalars().all()
+        conn.rollback()
+        for id_producto in ids:
+            if rebalancear(conn, id_producto):
+                rebalanceados.append(id_producto)
+            conn.commit()
+    return rebalanceados
+
+
+class RebalanceoStock:
+    """Hilo que corre `rebalancear_todos` cada `intervalo` segundos (0 = desactivado)."""
+
+    def __init__(self, intervalo=10.0):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+        self.rebalanceos = 0
+
+    def iniciar(self):
+        if self.intervalo <= 0 or self._hilo is not None:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="rebalanceo-stock", daemon=True)
+        self._hilo.start()
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                rebalanceados = rebalancear_todos()
+            except SQLAlchemyError:
+                logger.exception("❌ Error rebalanceando el stock fragmentado")
+                continue
+            if rebalanceados:
+                self.rebalanceos += len(rebalanceados)
+                logger.info("Stock fragmentado rebalanceado", extra={"productos": rebalanceados})
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
+
+
+rebalanceo_stock = RebalanceoStock(intervalo=float(os.getenv("STOCK_REBALANCEO_INTERVALO", "10")))
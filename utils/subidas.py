@@ -0,0 +1,271 @@
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from backend.config.db import conexion
+from backend.models.producto import productos
+from backend.utils import deduplicacion, imagenes
+from backend.utils.almacenamiento import crear_almacenamiento
+from backend.utils.catalogo import catalogo
+from backend.utils.coherencia import coherencia
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class ColaSubidas:
+    """
+    Sube las imágenes de productos fuera del request.
+
+    El request guarda el archivo en `carpeta` (no pública) y deja el producto con
+    imagen_estado="pendiente" e imagen_pendiente=<token>. Un pool acotado de hilos
+    lo sube con reintentos y actualiza imagen_url solo si imagen_pendiente sigue
+    siendo ese token (una imagen más nueva no se pisa con una vieja).
+    """
+
+    def __init__(self, almacenamiento=None, carpeta="subidas_pendientes", hilos=2,
+                 max_pendientes=100, reintentos=3, espera_reintento=1.0):
+        self.almacenamiento = almacenamiento
+        self.carpeta = carpeta
+        self.hilos = hilos
+        self.reintentos = reintentos
+        self.espera_reintento = espera_reintento
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._detener = threading.Event()
+        self._trabajadores = []
+        self._lock = threading.Lock()
+        self.en_curso = 0
+        self.completadas = 0
+        self.fallidas = 0
+        self.deduplicadas = 0
+        self.latencia_total = 0.0
+        self.latencia_maxima = 0.0
+        self.latencia_ultima = None
+
+    # 🔹 Lado del request
+    def guardar_temporal(self, archivo, nombre_original=None):
+        """Copia el upload a disco (en bloques) y devuelve (token del archivo, sha256 del contenido)."""
+        extension = os.path.splitext(nombre_original or "")[1].lower()
+        token = uuid.uuid4().hex + (extension if extension in EXTENSIONES else "")
+        os.makedirs(self.carpeta, exist_ok=True)
+        with open(self._ruta(token), "wb") as destino:
+            huella = deduplicacion.copiar_con_huella(archivo, destino)
+        return token, huella
+
+    def encolar(self, id_producto, token, huella, ruta=None):
+        """Llamar después del commit que dejó el producto en estado pendiente."""
+        self.iniciar()
+        try:
+            self._cola.put_nowait((id_producto, token, huella, ruta or self._ruta(token)))
+        except queue.Full:
+            # Queda pendiente en disco y en la BD: se retoma al reiniciar
+            logger.warning("Cola de imágenes llena; el producto %s se subirá al reiniciar", id_producto)
+
+    def descartar(self, token):
+        """El producto no llegó a guardarse: borrar el archivo temporal."""
+        try:
+            os.remove(self._ruta(token))
+        except OSError:
+            pass
+
+    def contar_deduplicada(self):
+        with self._lock:
+            self.deduplicadas += 1
+
+    def lleno(self):
+        return self._cola.full()
+
+    def _ruta(self, token):
+        return os.path.join(self.carpeta, token)
+
+    # 🔹 Trabajadores
+    def iniciar(self):
+        # Los hilos se crean en el proceso que atiende (después del fork si hay varios workers)
+        with self._lock:
+            if self._trabajadores:
+                return
+            if self.almacenamiento is None:
+                self.almacenamiento = crear_almacenamiento()
+            self._detener.clear()
+            for i in range(self.hilos):
+                hilo = threading.Thread(target=self._trabajar, name=f"subidas-{i}", daemon=True)
+                hilo.start()
+                self._trabajadores.append(hilo)
+
+    def _trabajar(self):
+        while not self._detener.is_set():
+            try:
+                id_producto, token, huella, ruta = self._cola.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self.en_curso += 1
+            try:
+                self._procesar(id_producto, token, huella, ruta)
+            except Exception:
+                logger.exception("Error inesperado subiendo la imagen del producto %s", id_producto)
+            finally:
+                with self._lock:
+                    self.en_curso -= 1
+                self._cola.task_done()
+
+    def _variantes(self, token, ruta):
+        """{variante: (ruta, nombre)} a subir; None si el archivo no es una imagen válida."""
+        if not imagenes.disponible():
+            return {"original": (ruta, token)}
+        try:
+            rutas = imagenes.procesador.procesar(ruta, self.carpeta, token.split(".")[0])
+        except imagenes.ImagenInvalida as e:
+            logger.warning("La imagen %s no se pudo procesar: %s", token, e)
+            return None
+        return {variante: (ruta_variante, os.path.basename(ruta_variante)) for variante, ruta_variante in rutas.items()}
+
+    def _subir(self, id_producto, ruta, nombre):
+        for intento in range(1, self.reintentos + 1):
+            try:
+                return self.almacenamiento.subir(ruta, nombre)
+            except Exception as e:
+                logger.warning("Subida de imagen %s (producto %s) falló, intento %s/%s: %s",
+                               nombre, id_producto, intento, self.reintentos, e)
+                if intento < self.reintentos:
+                    time.sleep(self.espera_reintento * 2 ** (intento - 1))
+        return None
+
+    def _procesar(self, id_producto, token, huella, ruta):
+        inicio = time.perf_counter()
+        archivos = {}
+        with conexion() as conn:
+            existente = deduplicacion.buscar(conn, huella)
+        if existente is not None:
+            # Mismo contenido ya subido (p. ej. por otra subida en curso cuando llegó el request)
+            url, variantes = existente.url, existente.variantes
+            with self._lock:
+                self.deduplicadas += 1
+        else:
+            archivos = self._variantes(token, ruta) or {}
+            urls = {}
+            for variante, (ruta_variante, nombre) in archivos.items():
+                urls[variante] = self._subir(id_producto, ruta_variante, nombre)
+                if urls[variante] is None:
+                    urls = {}
+                    break
+            url = urls.get("full") or urls.get("original")
+            variantes = {variante: url_variante for variante, url_variante in urls.items() if variante != "original"} or None
+
+        duracion = time.perf_counter() - inicio
+        try:
+            with conexion() as conn:
+                if url:
+                    # Si otra subida del mismo contenido se registró antes, se usa la suya
+                    vigente = deduplicacion.registrar(conn, huella, url, variantes)
+                    url, variantes = vigente.url, vigente.variantes
+                producto = conn.execute(
+                    select(productos.c.imagen_hash)
+                    .where(productos.c.id_producto == id_producto, productos.c.imagen_pendiente == token)
+                    .with_for_update()
+                ).fetchone()
+                if producto is not None:
+                    if url:
+                        valores = {"imagen_estado": "lista", "imagen_url": url, "imagen_variantes": variantes,
+                                   "imagen_hash": huella, "imagen_pendiente": None}
+                        deduplicacion.referenciar(conn, huella, producto.imagen_hash)
+                    else:
+                        valores = {"imagen_estado": "error", "imagen_pendiente": None}
+                    conn.execute(update(productos).where(productos.c.id_producto == id_producto).values(**valores))
+                    coherencia.publicar(conn, "producto", str(id_producto))
+                conn.commit()
+        except SQLAlchemyError as e:
+            # El archivo se conserva: se reintenta al reiniciar
+            logger.error("No se pudo registrar la imagen del producto %s: %s", id_producto, e)
+            return
+        if producto is not None:
+            catalogo.invalidar(id_producto)
+
+        with self._lock:
+            if url:
+                self.completadas += 1
+            else:
+                self.fallidas += 1
+            self.latencia_total += duracion
+            self.latencia_maxima = max(self.latencia_maxima, duracion)
+            self.latencia_ultima = duracion
+        for archivo in {ruta, *(ruta_variante for ruta_variante, _ in archivos.values())}:
+            try:
+                os.remove(archivo)
+            except OSError:
+                pass
+
+    def reanudar(self):
+        """Encola los productos que quedaron pendientes (p. ej. por un reinicio)."""
+        with conexion() as conn:
+            filas = conn.execute(
+                select(productos.c.id_producto, productos.c.imagen_pendiente)
+                .where(productos.c.imagen_estado == "pendiente", productos.c.imagen_pendiente.is_not(None))
+            ).fetchall()
+        reanudadas = 0
+        for fila in filas:
+            ruta = self._ruta(fila.imagen_pendiente)
+            # También los reclamados por un proceso que murió antes de terminar (token.<pid>)
+            for candidata in [ruta] + glob.glob(glob.escape(ruta) + ".*"):
+                if candidata != ruta and _proceso_vivo(candidata.rsplit(".", 1)[1]):
+                    continue
+                reclamada = f"{ruta}.{os.getpid()}"
+                try:
+                    # rename es atómico: con varios workers solo uno se queda con cada archivo
+                    os.rename(candidata, reclamada)
+                except OSError:
+                    continue
+                self.encolar(fila.id_producto, fila.imagen_pendiente, deduplicacion.huella_archivo(reclamada), reclamada)
+                reanudadas += 1
+                break
+        return reanudadas
+
+    def detener(self, espera=10.0):
+        """Espera (como mucho `espera` segundos) a que se vacíe la cola y para los hilos."""
+        limite = time.monotonic() + espera
+        while self._cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.1)
+        self._detener.set()
+        for hilo in self._trabajadores:
+            hilo.join(timeout=1.0)
+        self._trabajadores = []
+        imagenes.procesador.cerrar()
+
+    def estadisticas(self):
+        terminadas = self.completadas + self.fallidas
+        return {
+            "en_cola": self._cola.qsize(),
+            "en_curso": self.en_curso,
+            "completadas": self.completadas,
+            "fallidas": self.fallidas,
+            "deduplicadas": self.deduplicadas,
+            "latencia_promedio": self.latencia_total / terminadas if terminadas else None,
+            "latencia_maxima": self.latencia_maxima,
+            "latencia_ultima": self.latencia_ultima
+        }
+
+
+cola_subidas = ColaSubidas(
+    carpeta=os.getenv("IMAGENES_PENDIENTES", "subidas_pendientes"),
+    hilos=int(os.getenv("IMAGENES_HILOS", "2")),
+    max_pendientes=int(os.getenv("IMAGENES_MAX_PENDIENTES", "100")),
+    reintentos=int(os.getenv("IMAGENES_REINTENTOS", "3"))
+)
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from backend.config.db import conexion
+from backend.models.historial_ventas import historial_ventas
+from backend.models.producto import productos
+from backend.models.venta import ventas
+from backend.utils.auditoria import auditoria
+from backend.utils.cache_reportes import cache_reportes
+from backend.utils.catalogo import catalogo
+from backend.utils.coherencia import coherencia, clave_ventas
+from backend.utils.stock_fragmentado import descontar_varios, disponibles
+from backend.utils.ventas_diarias import acumular, fila_resumen
+
+logger = logging.getLogger(__name__)
+
+
+def insertar_ventas(conn, filas):
+    """Inserta varias ventas y devuelve sus IDs en el mismo orden."""
+    if conn.dialect.insert_executemany_returning_sort_by_parameter_order:
+        # SQLite / MariaDB: un solo executemany con RETURNING
+        result = conn.execute(
+            insert(ventas).returning(ventas.c.id_venta, sort_by_parameter_order=True),
+            filas
+        )
+        return list(result.scalars())
+    # MySQL no tiene RETURNING: un INSERT por fila, dentro de la misma transacción
+    return [conn.execute(insert(ventas).values(**fila)).inserted_primary_key[0] for fila in filas]
+
+
+class VentasAgrupadas:
+    """
+    Group commit de `POST /ventas/` (opcional, VENTAS_AGRUPADAS=1).
+
+    Cada request encola su venta y espera un Future. Un único hilo escritor junta
+    las que llegan durante `espera` segundos (o hasta `max_lote`) y las aplica en
+    una sola transacción: bloquea los productos en orden, reparte el stock por
+    orden de llegada, descuenta con un UPDATE, inserta ventas, historial y
+    resumen diario y hace un commit. Cada Future recibe su venta o su error
+    (404, stock insuficiente); un error de BD falla el lote entero con 500.
+    """
+
+    def __init__(self, activo=False, max_lote=100, espera=0.005, max_pendientes=10000):
+        self.activo = activo
+        self.max_lote = max_lote
+        self.espera = espera
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.lotes = 0
+        self.confirmadas = 0
+        self.rechazadas = 0
+        self.fallidas = 0
+        self.lote_maximo = 0
+
+    # 🔹 Lado del request
+    def encolar(self, venta):
+        futuro = Future()
+        self._iniciar()
+        try:
+            self._cola.put_nowait((venta, futuro))
+        except queue.Full:
+            raise HTTPException(status_code=503, detail="Hay demasiadas ventas pendientes, reintente en unos segundos")
+        return futuro
+
+    async def crear(self, venta):
+        return await asyncio.wrap_future(self.encolar(venta))
+
+    def _iniciar(self):
+        if self._hilo is not None:
+            return
+        with self._lock:
+            # El hilo nace en el proceso que atiende (después del fork si hay varios workers)
+            if self._hilo is None:
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._bucle, name="ventas-agrupadas", daemon=True)
+                self._hilo.start()
+
+    # 🔹 Hilo escritor
+    def _juntar(self):
+        try:
+            lote = [self._cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        limite = time.monotonic() + self.espera
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while not (self._detener.is_set() and self._cola.empty()):
+            lote = self._juntar()
+            if lote:
+                self._procesar(lote)
+
+    def _procesar(self, lote):
+        # Los requests que ya se cancelaron (cliente desconectado) no entran al lote
+        lote = [pedido for pedido in lote if pedido[1].set_running_or_notify_cancel()]
+        if not lote:
+            return
+        try:
+            with conexion() as conn:
+                try:
+                    resultados = self._aplicar(conn, lote)
+                except Exception:
+                    if conn.in_transaction():
+                        conn.rollback()
+                    raise
+        except SQLAlchemyError as se:
+            logger.exception("❌ Error de base de datos aplicando un lote de ventas", extra={"ventas": len(lote)})
+            self._fallar(lote, HTTPException(status_code=500, detail=f"Error de base de datos: {str(se)}"))
+            return
+        except Exception as e:
+            logger.exception("❌ Error inesperado aplicando un lote de ventas", extra={"ventas": len(lote)})
+            self._fallar(lote, HTTPException(status_code=500, detail=f"Error interno: {str(e)}"))
+            return
+
+        for (_, futuro), resultado in zip(lote, resultados):
+            if isinstance(resultado, HTTPException):
+                futuro.set_exception(resultado)
+            else:
+                futuro.set_result(resultado)
+
+    def _fallar(self, lote, error):
+        self.fallidas += len(lote)
+        for _, futuro in lote:
+            futuro.set_exception(error)
+
+    def _aplicar(self, conn, lote):
+        """Una transacción para todo el lote; devuelve la venta o el HTTPException de cada pedido."""
+        ids = sorted({venta.id_producto for venta, _ in lote})
+
+        # PASO 1: Bloquear los productos siempre en el mismo orden (como /ventas/lote)
+        filas = conn.execute(
+            select(productos.c.id_producto, productos.c.precio_venta, productos.c.costo, productos.c.stock,
+                   productos.c.fragmentos_stock)
+            .where(productos.c.id_producto.in_(ids))
+            .order_by(productos.c.id_producto)
+            .with_for_update()
+        ).fetchall()
+        encontrados = {fila.id_producto: fila for fila in filas}
+        stock = disponibles(conn, filas)
+
+        # PASO 2: Repartir el stock por orden de llegada
+        fecha_actual = datetime.now()
+        resultados, nuevas_ventas, descuentos = [], [], {}
+        for venta, _ in lote:
+            producto = encontrados.get(venta.id_producto)
+            if producto is None:
+                resultados.append(HTTPException(status_code=404, detail="Producto no encontrado"))
+                continue
+            disponible = stock[venta.id_producto]
+            if disponible < venta.cantidad:
+                logger.warning("❌ Stock insuficiente", extra={
+                    "id_producto": venta.id_producto, "disponible": disponible, "solicitado": venta.cantidad
+                })
+                resultados.append(HTTPException(
+                    status_code=400, detail=f"Stock insuficiente. Disponible: {disponible}, Solicitado: {venta.cantidad}"
+                ))
+                continue
+            stock[venta.id_producto] = disponible - venta.cantidad
+            descuentos[venta.id_producto] = descuentos.get(venta.id_producto, 0) + venta.cantidad
+            precio_unitario = float(producto.precio_venta)
+            nueva_venta = {
+                "id_producto": venta.id_producto,
+                "cantidad": venta.cantidad,
+                "precio_unitario": precio_unitario,
+                "precio_total": precio_unitario * venta.cantidad,
+                "fecha_venta": fecha_actual,
+                "costo_unitario": float(producto.costo)
+            }
+            nuevas_ventas.append(nueva_venta)
+            resultados.append(nueva_venta)
+
+        self.lotes += 1
+        self.lote_maximo = max(self.lote_maximo, len(lote))
+        self.rechazadas += len(lote) - len(nuevas_ventas)
+        if not nuevas_ventas:
+            conn.rollback()
+            return resultados
+
+        # PASO 3: Un UPDATE de stock, ventas, historial y resumen diario; un solo commit
+        descontar_varios(conn, descuentos, filas)
+        ids_venta = insertar_ventas(conn, nuevas_ventas)
+        for nueva_venta, id_venta in zip(nuevas_ventas, ids_venta):
+            nueva_venta["id_venta"] = id_venta
+
+        auditoria.registrar(conn, historial_ventas, nuevas_ventas)
+        acumular(conn, [
+            fila_resumen(fecha_actual, fila["id_producto"], fila["cantidad"], fila["precio_total"],
+                         fila["costo_unitario"])
+            for fila in nuevas_ventas
+        ])
+        coherencia.publicar(conn, "ventas", clave_ventas(fecha_actual, sorted(descuentos)))
+        conn.commit()
+        cache_reportes.invalidar_fecha(fecha_actual)
+        catalogo.stock_modificado(sorted(descuentos))
+
+        self.confirmadas += len(nuevas_ventas)
+        logger.info("🎉 Lote de ventas agrupadas confirmado", extra={
+            "ventas": len(nuevas_ventas), "rechazadas": len(lote) - len(nuevas_ventas), "productos": len(descuentos)
+        })
+        return resultados
+
+    def detener(self):
+        """Aplica lo que quede en la cola y para el hilo (llamar al apagar)."""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=30)
+            self._hilo = None
+
+    def estadisticas(self):
+        return {
+            "activo": self.activo,
+            "en_cola": self._cola.qsize(),
+            "lotes": self.lotes,
+            "confirmadas": self.confirmadas,
+            "rechazadas": self.rechazadas,
+            "fallidas": self.fallidas,
+            "ventas_por_lote": (self.confirmadas + self.rechazadas) / self.lotes if self.lotes else None,
+            "lote_maximo": self.lote_maximo
+        }
+
+
+ventas_agrupadas = VentasAgrupadas(
+    activo=os.getenv("VENTAS_AGRUPADAS", "0") == "1",
+    max_lote=int(os.getenv("VENTAS_LOTE_MAX", "100")),
+    espera=float(os.getenv("VENTAS_LOTE_ESPERA_MS", "5")) / 1000,
+    max_pendientes=int(os.getenv("VENTAS_MAX_PENDIENTES", "10000"))
+)
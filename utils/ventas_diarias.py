@@ -0,0 +1,122 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from backend.models.venta import ventas
+from backend.models.venta_diaria import ventas_diarias
+
+
+def fila_resumen(fecha, id_producto, cantidad, precio_total, costo, fragmento=0):
+    """
+    Delta de una venta para ventas_diarias (cantidades negativas para restar).
+    """
+    return {
+        "fecha": fecha.date() if isinstance(fecha, datetime) else fecha,
+        "id_producto": id_producto,
+        "fragmento": fragmento,
+        "unidades": cantidad,
+        "generado": precio_total,
+        "inversion": float(costo or 0) * cantidad
+    }
+
+
+def _upsert(conn):
+    t = ventas_diarias
+    if conn.dialect.name == "mysql":
+        stmt = mysql.insert(t)
+        return stmt.on_duplicate_key_update(
+            unidades=t.c.unidades + stmt.inserted.unidades,
+            generado=t.c.generado + stmt.inserted.generado,
+            inversion=t.c.inversion + stmt.inserted.inversion
+        )
+    insertar = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    stmt = insertar(t)
+    return stmt.on_conflict_do_update(
+        index_elements=[t.c.fecha, t.c.id_producto, t.c.fragmento],
+        set_={
+            "unidades": t.c.unidades + stmt.excluded.unidades,
+            "generado": t.c.generado + stmt.excluded.generado,
+            "inversion": t.c.inversion + stmt.excluded.inversion
+        }
+    )
+
+
+def acumular(conn, filas):
+    """
+    Suma los deltas al resumen dentro de la transacción actual.
+    Se agrupan por (fecha, producto, fragmento) y se ordenan para bloquear siempre en el mismo orden.
+    """
+    agrupadas = {}
+    for fila in filas:
+        clave = (fila["fecha"], fila["id_producto"], fila["fragmento"])
+        actual = agrupadas.get(clave)
+        if actual is None:
+            agrupadas[clave] = dict(fila)
+        else:
+            for campo in ("unidades", "generado", "inversion"):
+                actual[campo] += fila[campo]
+    if agrupadas:
+        conn.execute(_upsert(conn), [agrupadas[clave] for clave in sorted(agrupadas)])
+
+
+def reconstruir(conn, desde, hasta):
+    """
+    Recalcula el resumen de los días [desde, hasta] (ambos incluidos) desde la tabla ventas.
+    """
+    inicio = datetime.combine(desde, time.min)
+    fin = datetime.combine(hasta + timedelta(days=1), time.min)
+    conn.execute(
+        delete(ventas_diarias).where(ventas_diarias.c.fecha >= desde, ventas_diarias.c.fecha <= hasta)
+    )
+
+    fecha = func.date(ventas.c.fecha_venta)
+    origen = (
+        select(
+            fecha,
+            ventas.c.id_producto,
+            # Lo que falta cuenta 0, igual que fila_resumen (las columnas no admiten NULL)
+            func.coalesce(func.sum(ventas.c.cantidad), 0),
+            func.coalesce(func.sum(ventas.c.precio_total), 0),
+            func.coalesce(func.sum(ventas.c.costo_unitario * ventas.c.cantidad), 0)
+        )
+        .where(
+            ventas.c.fecha_venta >= inicio, ventas.c.fecha_venta < fin,
+            ventas.c.id_producto.isnot(None)
+        )
+        .group_by(fecha, ventas.c.id_producto)
+    )
+    conn.execute(
+        insert(ventas_diarias).from_select(
+            ["fecha", "id_producto", "unidades", "generado", "inversion"], origen
+        )
+    )
+
+
+def reconstruir_todo(conn, desde=None, hasta=None, dias_por_lote=31):
+    """
+    Backfill completo por tramos (un commit por tramo). Devuelve los días procesados.
+    """
+    if desde is None or hasta is None:
+        minimo, maximo = conn.execute(
+            select(func.min(ventas.c.fecha_venta), func.max(ventas.c.fecha_venta))
+        ).one()
+        if minimo is None:
+            return 0
+        desde = desde or minimo.date()
+        hasta = hasta or maximo.date()
+
+    dias = 0
+    actual = desde
+    while actual <= hasta:
+        final = min(actual + timedelta(days=dias_por_lote - 1), hasta)
+        reconstruir(conn, actual, final)
+        conn.commit()
+        dias += (final - actual).days + 1
+        actual = final + timedelta(days=1)
+    return dias
+
+
+def como_fecha(valor):
+    # SQLite devuelve date() como texto
+    return date.fromisoformat(valor) if isinstance(valor, str) else valor